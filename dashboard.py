@@ -5,12 +5,13 @@ Sirve el frontend y expone endpoints API.
 
 import os
 import json
+import gzip
+import hashlib
 import threading
-from datetime import datetime
-from flask import Flask, jsonify, send_file, abort
+from flask import Flask, Response, jsonify, request, stream_with_context
 import main as bot
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)   # los estáticos los sirve static_hash
 PORT = int(os.environ.get("PORT", "8080"))
 
 # ── Estado del scan en curso ───────────────────────────────────────────────────
@@ -32,9 +33,7 @@ def _run_scan_background():
 
 @app.route("/api/data")
 def api_data():
-    data = bot.get_dashboard_data()
-    data["scan_running"] = _scan_running
-    return jsonify(data)
+    return jsonify(_datos_dashboard()[1])
 
 
 @app.route("/api/scan", methods=["POST"])
@@ -51,28 +50,65 @@ def api_scan():
     return jsonify({"ok": True, "message": "Scan iniciado"})
 
 
+@app.route("/api/export/<tipo>")
+def api_export(tipo):
+    """Export en streaming: ?formato=ndjson|csv&desde=YYYY-MM-DD&hasta=...&gzip=1&cartera=..."""
+    args = request.args
+    formato = args.get("formato", "ndjson")
+    comprimir = args.get("gzip") in ("1", "true")
+    try:
+        datos = bot.exportar(tipo, formato, args.get("desde"), args.get("hasta"),
+                             comprimir, args.get("cartera"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    nombre = f"{tipo}.{'csv' if formato == 'csv' else 'ndjson'}{'.gz' if comprimir else ''}"
+    resp = Response(stream_with_context(datos),
+                    mimetype="text/csv" if formato == "csv" else "application/x-ndjson")
+    resp.headers["Content-Disposition"] = f'attachment; filename="{nombre}"'
+    if comprimir:
+        resp.mimetype = "application/gzip"
+    return resp
+
+
+@app.route("/api/ready")
+def api_ready():
+    """Readiness: 200 cuando el calentamiento terminó, 503 mientras tanto."""
+    estado = bot.estado_arranque()
+    return jsonify(estado), (200 if estado["listo"] else 503)
+
+
 @app.route("/api/positions")
 def api_positions():
-    return jsonify({"positions": bot.load_positions()})
+    return jsonify({"positions": [p.to_dict() for p in bot.load_positions()]})
 
 
 @app.route("/api/scan_log")
 def api_scan_log():
-    return jsonify({"log": bot.load_scan_log()})
+    return jsonify({"log": [e.to_dict() for e in bot.load_scan_log()]})
+
+
+@app.route("/api/positions/query")
+def api_positions_query():
+    """Posiciones abiertas + archivadas con filtros, orden y cursor (ver bot.consultar_indice_posiciones)."""
+    try:
+        return jsonify(bot.consultar_posiciones(request.args.to_dict()))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/api/scan_log/query")
+def api_scan_log_query():
+    """Resultados de scans con filtros, orden y cursor (ver bot.consultar_indice_scans)."""
+    try:
+        return jsonify(bot.consultar_scans(request.args.to_dict()))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 
 # ── Frontend ───────────────────────────────────────────────────────────────────
 
-DASHBOARD_HTML = r"""<!DOCTYPE html>
-<html lang="es">
-<head>
-<meta charset="UTF-8" />
-<meta name="viewport" content="width=device-width, initial-scale=1.0" />
-<title>NBA EDGE ALPHA</title>
-<link rel="preconnect" href="https://fonts.googleapis.com">
-<link href="https://fonts.googleapis.com/css2?family=Share+Tech+Mono&family=Barlow+Condensed:wght@300;400;600;800&display=swap" rel="stylesheet">
-<style>
-  :root {
+DASHBOARD_CSS = r"""  :root {
     --bg:      #050a0f;
     --surface: #0b1520;
     --border:  #1a2f45;
@@ -316,6 +352,7 @@ DASHBOARD_HTML = r"""<!DOCTYPE html>
   .pos-card.open    { border-left: 3px solid var(--accent); }
   .pos-card.closed-tp { border-left: 3px solid var(--green); }
   .pos-card.closed-sl { border-left: 3px solid var(--red); }
+  .pos-card.closed-settled { border-left: 3px solid var(--gold); }
 
   .pos-header {
     display: flex;
@@ -350,6 +387,7 @@ DASHBOARD_HTML = r"""<!DOCTYPE html>
   .pos-badge.open   { color: var(--accent); border-color: var(--accent); }
   .pos-badge.tp     { color: var(--green);  border-color: var(--green); }
   .pos-badge.sl     { color: var(--red);    border-color: var(--red); }
+  .pos-badge.settled { color: var(--gold);  border-color: var(--gold); }
 
   .pos-prices {
     display: flex;
@@ -552,145 +590,10 @@ DASHBOARD_HTML = r"""<!DOCTYPE html>
     .stats-row { grid-template-columns: repeat(2, 1fr); }
     .pos-prices { flex-wrap: wrap; gap: 12px; }
   }
-</style>
-</head>
-<body>
-<div id="app">
-
-  <header>
-    <div class="logo">
-      <div class="logo-icon">🏀</div>
-      <div class="logo-text">
-        <div class="title">NBA Edge Alpha</div>
-        <div class="sub">Polymarket · Price Inefficiency Bot</div>
-      </div>
-    </div>
-    <div class="header-right">
-      <div>
-        <div class="timestamp" id="clock">--:--:-- ET</div>
-        <div class="last-scan" id="last-scan-label">Last scan: --</div>
-      </div>
-      <button id="scan-btn" onclick="triggerScan()">⚡ SCAN NOW</button>
-    </div>
-  </header>
-
-  <main>
-
-    <!-- Stats -->
-    <div class="stats-row">
-      <div class="stat-card">
-        <div class="stat-label">Capital Actual</div>
-        <div class="stat-value" id="stat-capital" style="font-size:24px">$100.00</div>
-      </div>
-      <div class="stat-card">
-        <div class="stat-label">PnL Total</div>
-        <div class="stat-value" id="stat-pnl" style="font-size:24px">$0.00</div>
-      </div>
-      <div class="stat-card">
-        <div class="stat-label">Posiciones Abiertas</div>
-        <div class="stat-value" id="stat-open">0</div>
-      </div>
-      <div class="stat-card green">
-        <div class="stat-label">Take Profits</div>
-        <div class="stat-value" id="stat-tp">0</div>
-      </div>
-      <div class="stat-card red">
-        <div class="stat-label">Stop Losses</div>
-        <div class="stat-value" id="stat-sl">0</div>
-      </div>
-      <div class="stat-card gold">
-        <div class="stat-label">Win Rate</div>
-        <div class="stat-value" id="stat-wr">0%</div>
-      </div>
-    </div>
-
-    <!-- Config -->
-    <div class="section-header">
-      <span class="section-title">Configuración Activa</span>
-      <div class="section-line"></div>
-    </div>
-    <div class="config-grid" style="margin-bottom:28px">
-      <div class="config-item">
-        <div class="config-label">NEA Umbral (pts)</div>
-        <div class="config-value" id="cfg-nea">--</div>
-      </div>
-      <div class="config-item">
-        <div class="config-label">Valor Real Mínimo</div>
-        <div class="config-value" id="cfg-vrmin">--</div>
-      </div>
-      <div class="config-item">
-        <div class="config-label">Take Profit (fijo)</div>
-        <div class="config-value" id="cfg-tp">--</div>
-      </div>
-      <div class="config-item">
-        <div class="config-label">Monto / Trade</div>
-        <div class="config-value" id="cfg-monto">--</div>
-      </div>
-    </div>
-
-    <!-- Posiciones abiertas + Oportunidades -->
-    <div class="two-col">
-
-      <!-- Posiciones abiertas -->
-      <div>
-        <div class="section-header">
-          <span class="section-title">Posiciones Abiertas</span>
-          <div class="section-line"></div>
-          <span class="section-count" id="open-count">0</span>
-        </div>
-        <div class="scroll-box">
-          <div class="positions-grid" id="open-positions">
-            <div class="empty-state">Sin posiciones abiertas</div>
-          </div>
-        </div>
-      </div>
-
-      <!-- Último scan - oportunidades -->
-      <div>
-        <div class="section-header">
-          <span class="section-title">Último Scan — Oportunidades</span>
-          <div class="section-line"></div>
-          <span class="section-count" id="ops-count">0</span>
-        </div>
-        <div class="scroll-box">
-          <table class="ops-table">
-            <thead>
-              <tr>
-                <th>Partido</th>
-                <th>Equipo</th>
-                <th>Precio</th>
-                <th>Valor Real</th>
-                <th>NEA</th>
-                <th>Acción</th>
-              </tr>
-            </thead>
-            <tbody id="ops-tbody">
-              <tr><td colspan="6" class="empty-state">Sin datos del último scan</td></tr>
-            </tbody>
-          </table>
-        </div>
-      </div>
-    </div>
-
-    <!-- Posiciones cerradas -->
-    <div class="section-header">
-      <span class="section-title">Historial Posiciones Cerradas</span>
-      <div class="section-line"></div>
-      <span class="section-count" id="closed-count">0</span>
-    </div>
-    <div class="scroll-box" style="max-height:300px; margin-bottom:40px">
-      <div class="positions-grid" id="closed-positions">
-        <div class="empty-state">Sin posiciones cerradas</div>
-      </div>
-    </div>
-
-  </main>
-</div>
+"""
 
-<div id="notif"></div>
 
-<script>
-let data = {};
+DASHBOARD_JS = r"""let data = {};
 
 function fmt(v, decimals=4) {
   return (v*100).toFixed(1) + '¢';
@@ -706,12 +609,15 @@ function fmtTs(iso) {
 
 function renderPosCard(pos) {
   const statusClass = pos.status === 'OPEN' ? 'open' :
-                      pos.close_reason === 'TAKE_PROFIT' ? 'closed-tp' : 'closed-sl';
+                      pos.close_reason === 'TAKE_PROFIT' ? 'closed-tp' :
+                      pos.close_reason === 'SETTLED' ? 'closed-settled' : 'closed-sl';
 
   const badgeClass = pos.status === 'OPEN' ? 'open' :
-                     pos.close_reason === 'TAKE_PROFIT' ? 'tp' : 'sl';
+                     pos.close_reason === 'TAKE_PROFIT' ? 'tp' :
+                     pos.close_reason === 'SETTLED' ? 'settled' : 'sl';
   const badgeLabel = pos.status === 'OPEN' ? 'OPEN' :
-                     pos.close_reason === 'TAKE_PROFIT' ? '✅ TAKE PROFIT' : '🛑 STOP LOSS';
+                     pos.close_reason === 'TAKE_PROFIT' ? '✅ TAKE PROFIT' :
+                     pos.close_reason === 'SETTLED' ? '🏁 SETTLED ' + Math.round((pos.precio_salida ?? 0) * 100) + '¢' : '🛑 STOP LOSS';
 
   const pnl = pos.pnl_pct || 0;
   const pnlClass = pnl > 0 ? 'pos' : pnl < 0 ? 'neg' : 'neu';
@@ -723,7 +629,7 @@ function renderPosCard(pos) {
   const range = hi - lo || 0.01;
 
   const pct = v => Math.max(0, Math.min(100, (v - lo) / range * 100));
-  const cur = pos.status === 'OPEN' ? pos.precio_actual : (pos.close_reason === 'TAKE_PROFIT' ? pos.take_profit : pos.stop_loss);
+  const cur = pos.status === 'OPEN' ? pos.precio_actual : (pos.precio_salida ?? (pos.close_reason === 'TAKE_PROFIT' ? pos.take_profit : pos.stop_loss));
 
   const priceBarHtml = pos.status === 'OPEN' ? `
     <div class="price-bar-wrapper">
@@ -739,8 +645,8 @@ function renderPosCard(pos) {
   <div class="pos-card ${statusClass}">
     <div class="pos-header">
       <div>
-        <div class="pos-match">${pos.partido} · ${pos.hora_partido}</div>
-        <div class="pos-team">${pos.equipo}</div>
+        <div class="pos-match">${(pos.liga || 'nba').toUpperCase()} · ${pos.partido} · ${pos.hora_partido}</div>
+        <div class="pos-team">${pos.equipo} <span style="font-size:11px;color:var(--dim);font-weight:400">${pos.mercado || '💰 Moneyline'}</span></div>
       </div>
       <div>
         <span class="pos-badge ${badgeClass}">${badgeLabel}</span>
@@ -777,6 +683,65 @@ function renderPosCard(pos) {
   </div>`;
 }
 
+// ── Render incremental ──────────────────────────────────────────────────────
+// Cada lista guarda, por clave (id de posición / token_id), el nodo y el HTML
+// con que se dibujó. En cada poll solo se reemplazan los nodos cuyo HTML
+// cambió, se eliminan los que ya no están y se mueven los fuera de orden.
+const _nodos = new Map();
+const _tpl = document.createElement('template');
+
+function patchList(id, items, keyFn, renderFn, emptyHtml) {
+  const cont = document.getElementById(id);
+  let prev = _nodos.get(id);
+  if (items.length === 0) {
+    if (!prev || prev.size) cont.innerHTML = emptyHtml;
+    _nodos.set(id, new Map());
+    return;
+  }
+  if (!prev || prev.size === 0) {
+    cont.innerHTML = '';
+    prev = new Map();
+  }
+
+  const next = new Map();
+  for (const item of items) {
+    const key  = keyFn(item);
+    const html = renderFn(item);
+    let entry  = prev.get(key);
+    if (!entry || entry.html !== html) {
+      _tpl.innerHTML = html.trim();
+      const el = _tpl.content.firstElementChild;
+      if (entry) entry.el.replaceWith(el);
+      entry = {el, html};
+    }
+    next.set(key, entry);
+  }
+  prev.forEach((entry, key) => { if (!next.has(key)) entry.el.remove(); });
+
+  let cursor = cont.firstElementChild;
+  next.forEach(entry => {
+    if (entry.el === cursor) cursor = cursor.nextElementSibling;
+    else cont.insertBefore(entry.el, cursor);
+  });
+  _nodos.set(id, next);
+}
+
+function renderOpRow(op) {
+  const isBuy  = op.accion === 'COMPRAR';
+  const neaCls = isBuy ? 'nea-buy' : 'nea-avoid';
+  const actCls = isBuy ? 'action-buy' : 'action-avoid';
+  const actLbl = isBuy ? '🔥 COMPRAR' : '⚠️ EVITAR';
+  return `
+  <tr>
+    <td style="font-size:12px;color:var(--dim)">${(op.liga || 'nba').toUpperCase()} · ${op.partido}<br><span style="font-size:11px;color:var(--dim)">${op.hora}</span></td>
+    <td><strong>${op.equipo}</strong><br><span style="font-size:11px;color:var(--dim)">${op.mercado || '💰 Moneyline'}</span></td>
+    <td class="price-mono">${op.p_poly.toFixed(1)}¢</td>
+    <td class="price-mono" style="color:var(--gold)">${op.valor_real.toFixed(1)}¢</td>
+    <td class="${neaCls}">${op.nea > 0 ? '+' : ''}${op.nea.toFixed(1)}</td>
+    <td class="${actCls}">${actLbl}</td>
+  </tr>`;
+}
+
 function render(d) {
   data = d;
 
@@ -795,52 +760,59 @@ function render(d) {
   document.getElementById('stat-sl').textContent      = d.stats.stop_losses;
   document.getElementById('stat-wr').textContent      = d.stats.win_rate + '%';
 
+  // Métricas
+  const pnlHoy = d.stats.pnl_hoy_usd || 0;
+  document.getElementById('met-pnl-hoy').textContent = (pnlHoy >= 0 ? '+' : '') + '$' + pnlHoy.toFixed(4);
+  document.getElementById('met-dd').textContent      = '$' + (d.stats.max_drawdown_usd || 0).toFixed(4);
+  document.getElementById('met-hold').textContent    = (d.stats.hold_promedio_h || 0).toFixed(1) + ' h';
+  document.getElementById('met-sharpe').textContent  = (d.stats.sharpe_trade || 0).toFixed(2);
+
+  // Estrategias
+  const estrategias = d.estrategias || [];
+  document.getElementById('estrategias-box').style.display = estrategias.length > 1 ? '' : 'none';
+  document.getElementById('estrategias-count').textContent = estrategias.length;
+  document.getElementById('estrategias-tbody').innerHTML = estrategias.map(e => {
+    const c = e.config, s = e.stats;
+    const pnlE = s.pnl_total_usd || 0;
+    return `
+    <tr>
+      <td><strong>${e.nombre}</strong></td>
+      <td class="price-mono" style="font-size:12px">${c.nea_umbral ?? d.config.nea_umbral} pts · ${(c.take_profit_precio * 100).toFixed(0)}¢ · ${(c.stop_fraccion * 100).toFixed(0)}%</td>
+      <td class="price-mono">${s.total_open}</td>
+      <td class="price-mono">${s.total_closed}</td>
+      <td class="price-mono">${s.win_rate}%</td>
+      <td class="${pnlE >= 0 ? 'nea-buy' : 'nea-avoid'}">${pnlE >= 0 ? '+' : ''}$${pnlE.toFixed(4)}</td>
+      <td class="price-mono">$${(s.max_drawdown_usd || 0).toFixed(4)}</td>
+    </tr>`;
+  }).join('');
+
   // Config
   document.getElementById('cfg-nea').textContent   = d.config.nea_umbral + ' pts';
   document.getElementById('cfg-vrmin').textContent  = (d.config.valor_real_minimo * 100).toFixed(0) + '¢';
   document.getElementById('cfg-tp').textContent     = (d.config.take_profit_precio * 100).toFixed(0) + '¢';
-  document.getElementById('cfg-monto').textContent  = '$' + d.config.monto_por_trade_usd + ' (1%)';
+  document.getElementById('cfg-monto').textContent  = d.config.sizing_modo && d.config.sizing_modo !== 'fijo'
+    ? d.config.sizing_modo.toUpperCase()
+    : '$' + d.config.monto_por_trade_usd + ' (' + (d.config.riesgo_por_trade * 100).toFixed(0) + '%)';
+  if (d.llm) {
+    const h = d.llm.hoy, p = d.llm.presupuesto;
+    document.getElementById('cfg-llm').textContent = h.llamadas + (p.llamadas ? '/' + p.llamadas : '') + ' · '
+      + (h.tokens_total / 1000).toFixed(1) + 'k tok' + (p.agotado ? ' · AGOTADO' : '');
+  }
 
   // Open positions
-  const openEl = document.getElementById('open-positions');
   document.getElementById('open-count').textContent = d.positions_open.length;
-  if (d.positions_open.length === 0) {
-    openEl.innerHTML = '<div class="empty-state">Sin posiciones abiertas</div>';
-  } else {
-    openEl.innerHTML = d.positions_open.map(renderPosCard).join('');
-  }
+  patchList('open-positions', d.positions_open, pos => pos.id, renderPosCard,
+            '<div class="empty-state">Sin posiciones abiertas</div>');
 
   // Opportunities
-  const tbody = document.getElementById('ops-tbody');
   document.getElementById('ops-count').textContent = d.last_scan_ops.length;
-  if (d.last_scan_ops.length === 0) {
-    tbody.innerHTML = '<tr><td colspan="6" class="empty-state">Sin datos del último scan</td></tr>';
-  } else {
-    tbody.innerHTML = d.last_scan_ops.map(op => {
-      const isBuy  = op.accion === 'COMPRAR';
-      const neaCls = isBuy ? 'nea-buy' : 'nea-avoid';
-      const actCls = isBuy ? 'action-buy' : 'action-avoid';
-      const actLbl = isBuy ? '🔥 COMPRAR' : '⚠️ EVITAR';
-      return `
-      <tr>
-        <td style="font-size:12px;color:var(--dim)">${op.partido}<br><span style="font-size:11px;color:var(--dim)">${op.hora}</span></td>
-        <td><strong>${op.equipo}</strong></td>
-        <td class="price-mono">${op.p_poly.toFixed(1)}¢</td>
-        <td class="price-mono" style="color:var(--gold)">${op.valor_real.toFixed(1)}¢</td>
-        <td class="${neaCls}">${op.nea > 0 ? '+' : ''}${op.nea.toFixed(1)}</td>
-        <td class="${actCls}">${actLbl}</td>
-      </tr>`;
-    }).join('');
-  }
+  patchList('ops-tbody', d.last_scan_ops, op => op.token_id, renderOpRow,
+            '<tr><td colspan="6" class="empty-state">Sin datos del último scan</td></tr>');
 
   // Closed positions
-  const closedEl = document.getElementById('closed-positions');
-  document.getElementById('closed-count').textContent = d.positions_closed.length;
-  if (d.positions_closed.length === 0) {
-    closedEl.innerHTML = '<div class="empty-state">Sin posiciones cerradas</div>';
-  } else {
-    closedEl.innerHTML = [...d.positions_closed].reverse().map(renderPosCard).join('');
-  }
+  document.getElementById('closed-count').textContent = d.stats.total_closed;
+  patchList('closed-positions', [...d.positions_closed].reverse(), pos => pos.id, renderPosCard,
+            '<div class="empty-state">Sin posiciones cerradas</div>');
 }
 
 async function fetchData() {
@@ -901,24 +873,307 @@ function updateClock() {
   document.getElementById('clock').textContent = et + ' ET';
 }
 
-// Init
-fetchData();
+// Init: primer render con el snapshot embebido en la página (sin request extra)
+const boot = document.getElementById('bootstrap-data');
+let booted = false;
+if (boot) {
+  try { render(JSON.parse(boot.textContent)); booted = true; } catch (e) { console.error('Bootstrap inválido', e); }
+}
+if (!booted) fetchData();
 setInterval(fetchData, 60000);  // refresh cada 60s
 updateClock();
 setInterval(updateClock, 1000);
-</script>
+"""
+
+
+DASHBOARD_HTML = r"""<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="UTF-8" />
+<meta name="viewport" content="width=device-width, initial-scale=1.0" />
+<title>NBA EDGE ALPHA</title>
+<link rel="preconnect" href="https://fonts.googleapis.com">
+<link href="https://fonts.googleapis.com/css2?family=Share+Tech+Mono&family=Barlow+Condensed:wght@300;400;600;800&display=swap" rel="stylesheet">
+<link rel="stylesheet" href="__CSS_URL__">
+</head>
+<body>
+<div id="app">
+
+  <header>
+    <div class="logo">
+      <div class="logo-icon">🏀</div>
+      <div class="logo-text">
+        <div class="title">NBA Edge Alpha</div>
+        <div class="sub">Polymarket · Price Inefficiency Bot</div>
+      </div>
+    </div>
+    <div class="header-right">
+      <div>
+        <div class="timestamp" id="clock">--:--:-- ET</div>
+        <div class="last-scan" id="last-scan-label">Last scan: --</div>
+      </div>
+      <button id="scan-btn" onclick="triggerScan()">⚡ SCAN NOW</button>
+    </div>
+  </header>
+
+  <main>
+
+    <!-- Stats -->
+    <div class="stats-row">
+      <div class="stat-card">
+        <div class="stat-label">Capital Actual</div>
+        <div class="stat-value" id="stat-capital" style="font-size:24px">$100.00</div>
+      </div>
+      <div class="stat-card">
+        <div class="stat-label">PnL Total</div>
+        <div class="stat-value" id="stat-pnl" style="font-size:24px">$0.00</div>
+      </div>
+      <div class="stat-card">
+        <div class="stat-label">Posiciones Abiertas</div>
+        <div class="stat-value" id="stat-open">0</div>
+      </div>
+      <div class="stat-card green">
+        <div class="stat-label">Take Profits</div>
+        <div class="stat-value" id="stat-tp">0</div>
+      </div>
+      <div class="stat-card red">
+        <div class="stat-label">Stop Losses</div>
+        <div class="stat-value" id="stat-sl">0</div>
+      </div>
+      <div class="stat-card gold">
+        <div class="stat-label">Win Rate</div>
+        <div class="stat-value" id="stat-wr">0%</div>
+      </div>
+    </div>
+
+    <!-- Métricas -->
+    <div class="section-header">
+      <span class="section-title">Métricas del Portafolio</span>
+      <div class="section-line"></div>
+    </div>
+    <div class="config-grid" style="margin-bottom:28px">
+      <div class="config-item">
+        <div class="config-label">PnL Hoy</div>
+        <div class="config-value" id="met-pnl-hoy">--</div>
+      </div>
+      <div class="config-item">
+        <div class="config-label">Max Drawdown</div>
+        <div class="config-value" id="met-dd">--</div>
+      </div>
+      <div class="config-item">
+        <div class="config-label">Hold Promedio</div>
+        <div class="config-value" id="met-hold">--</div>
+      </div>
+      <div class="config-item">
+        <div class="config-label">Sharpe / Trade</div>
+        <div class="config-value" id="met-sharpe">--</div>
+      </div>
+    </div>
+
+    <!-- Estrategias (principal + sombra) -->
+    <div id="estrategias-box" style="display:none">
+      <div class="section-header">
+        <span class="section-title">Estrategias</span>
+        <div class="section-line"></div>
+        <span class="section-count" id="estrategias-count">0</span>
+      </div>
+      <div class="scroll-box" style="margin-bottom:28px">
+        <table class="ops-table">
+          <thead>
+            <tr>
+              <th>Estrategia</th>
+              <th>NEA / TP / SL</th>
+              <th>Abiertas</th>
+              <th>Cerradas</th>
+              <th>Win Rate</th>
+              <th>PnL</th>
+              <th>Max DD</th>
+            </tr>
+          </thead>
+          <tbody id="estrategias-tbody"></tbody>
+        </table>
+      </div>
+    </div>
+
+    <!-- Config -->
+    <div class="section-header">
+      <span class="section-title">Configuración Activa</span>
+      <div class="section-line"></div>
+    </div>
+    <div class="config-grid" style="margin-bottom:28px">
+      <div class="config-item">
+        <div class="config-label">NEA Umbral (pts)</div>
+        <div class="config-value" id="cfg-nea">--</div>
+      </div>
+      <div class="config-item">
+        <div class="config-label">Valor Real Mínimo</div>
+        <div class="config-value" id="cfg-vrmin">--</div>
+      </div>
+      <div class="config-item">
+        <div class="config-label">Take Profit (fijo)</div>
+        <div class="config-value" id="cfg-tp">--</div>
+      </div>
+      <div class="config-item">
+        <div class="config-label">Monto / Trade</div>
+        <div class="config-value" id="cfg-monto">--</div>
+      </div>
+      <div class="config-item">
+        <div class="config-label">Gemini hoy</div>
+        <div class="config-value" id="cfg-llm">--</div>
+      </div>
+    </div>
+
+    <!-- Posiciones abiertas + Oportunidades -->
+    <div class="two-col">
+
+      <!-- Posiciones abiertas -->
+      <div>
+        <div class="section-header">
+          <span class="section-title">Posiciones Abiertas</span>
+          <div class="section-line"></div>
+          <span class="section-count" id="open-count">0</span>
+        </div>
+        <div class="scroll-box">
+          <div class="positions-grid" id="open-positions">
+            <div class="empty-state">Sin posiciones abiertas</div>
+          </div>
+        </div>
+      </div>
+
+      <!-- Último scan - oportunidades -->
+      <div>
+        <div class="section-header">
+          <span class="section-title">Último Scan — Oportunidades</span>
+          <div class="section-line"></div>
+          <span class="section-count" id="ops-count">0</span>
+        </div>
+        <div class="scroll-box">
+          <table class="ops-table">
+            <thead>
+              <tr>
+                <th>Partido</th>
+                <th>Equipo</th>
+                <th>Precio</th>
+                <th>Valor Real</th>
+                <th>NEA</th>
+                <th>Acción</th>
+              </tr>
+            </thead>
+            <tbody id="ops-tbody">
+              <tr><td colspan="6" class="empty-state">Sin datos del último scan</td></tr>
+            </tbody>
+          </table>
+        </div>
+      </div>
+    </div>
+
+    <!-- Posiciones cerradas -->
+    <div class="section-header">
+      <span class="section-title">Historial Posiciones Cerradas</span>
+      <div class="section-line"></div>
+      <span class="section-count" id="closed-count">0</span>
+    </div>
+    <div class="scroll-box" style="max-height:300px; margin-bottom:40px">
+      <div class="positions-grid" id="closed-positions">
+        <div class="empty-state">Sin posiciones cerradas</div>
+      </div>
+    </div>
+
+  </main>
+</div>
+
+<div id="notif"></div>
+
+<script id="bootstrap-data" type="application/json">__BOOTSTRAP__</script>
+<script src="__JS_URL__" defer></script>
 </body>
 </html>
 """
 
 
+# ── Servido de estáticos precomprimidos ───────────────────────────────────────
+# CSS y JS se sirven desde URLs con hash de contenido y caché immutable de un
+# año; el HTML (que solo referencia esas URLs) se revalida en cada carga con
+# ETag fuerte, así una recarga sin cambios cuesta un 304. Todo se comprime una
+# sola vez al importar: gzip siempre, brotli si el paquete está instalado.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Activo:
+    def __init__(self, contenido: str, mimetype: str):
+        self.mimetype = mimetype
+        self.cuerpos  = {"identity": contenido.encode("utf-8")}
+        self.cuerpos["gzip"] = gzip.compress(self.cuerpos["identity"], 9, mtime=0)
+        if brotli is not None:
+            self.cuerpos["br"] = brotli.compress(self.cuerpos["identity"])
+        self.hash = hashlib.sha256(self.cuerpos["identity"]).hexdigest()[:16]
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.hash}-{encoding}"'
+
+    def responder(self, cache_control: str):
+        aceptadas = request.headers.get("Accept-Encoding", "")
+        encoding  = next((e for e in ("br", "gzip") if e in self.cuerpos and e in aceptadas), "identity")
+        etag = self.etag(encoding)
+        if etag in request.headers.get("If-None-Match", ""):
+            resp = Response(status=304)
+        else:
+            resp = Response(self.cuerpos[encoding], mimetype=self.mimetype)
+            if encoding != "identity":
+                resp.headers["Content-Encoding"] = encoding
+        resp.headers["ETag"]          = etag
+        resp.headers["Vary"]          = "Accept-Encoding"
+        resp.headers["Cache-Control"] = cache_control
+        return resp
+
+
+_CSS = Activo(DASHBOARD_CSS, "text/css")
+_JS  = Activo(DASHBOARD_JS, "application/javascript")
+ESTATICOS = {f"app.{_CSS.hash}.css": _CSS, f"app.{_JS.hash}.js": _JS}
+_SHELL = (DASHBOARD_HTML.replace("__CSS_URL__", f"/static/app.{_CSS.hash}.css")
+                        .replace("__JS_URL__", f"/static/app.{_JS.hash}.js"))
+
+# Página = shell + snapshot del dashboard embebido. Se regenera (y se vuelve a
+# comprimir) solo cuando cambia la versión del snapshot o el estado del scan.
+_pagina = {"clave": None, "activo": None}
+_pagina_lock = threading.Lock()
+
+
+def _datos_dashboard() -> tuple[str, dict]:
+    version, data = bot.dashboard_snapshot()
+    return version, {**data, "scan_running": _scan_running}
+
+
+def _pagina_actual() -> Activo:
+    version, data = _datos_dashboard()
+    clave = (version, data["scan_running"])
+    with _pagina_lock:
+        if _pagina["clave"] != clave:
+            embebido = json.dumps(data, ensure_ascii=False).replace("</", "<\\/")
+            _pagina["activo"] = Activo(_SHELL.replace("__BOOTSTRAP__", embebido), "text/html")
+            _pagina["clave"]  = clave
+        return _pagina["activo"]
+
+
+@app.route("/static/<nombre>")
+def static_hash(nombre):
+    activo = ESTATICOS.get(nombre)
+    if activo is None:
+        return Response("Not Found", status=404)
+    return activo.responder("public, max-age=31536000, immutable")
+
+
 @app.route("/")
 def index():
-    return DASHBOARD_HTML
+    return _pagina_actual().responder("no-cache")
 
 
 # Iniciar scheduler al cargar el módulo (funciona con Gunicorn y con python directo)
 bot.iniciar_scheduler()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=PORT)v
+    app.run(host="0.0.0.0", port=PORT)
@@ -8,14 +8,28 @@
 
 import os
 import re
+import gzip
+import io
+import csv
+import zlib
+import base64
+import hashlib
+import random
 import json
 import logging
+import statistics
 import threading
+import time
 import requests
-from datetime import datetime, date, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from zoneinfo import ZoneInfo
 
+_T0_ARRANQUE = time.monotonic()
+
 # ── Cargar .env ────────────────────────────────────────────────────────────────
 def _cargar_env():
     env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
@@ -49,22 +63,83 @@ GEMINI_API_KEY = os.environ.get("".join(_KEY_PARTS), "")
 GAMMA_API         = os.environ.get("GAMMA_API", "https://gamma-api.polymarket.com")
 CLOB_API          = os.environ.get("CLOB_API", "https://clob.polymarket.com")
 NBA_SERIES_ID     = int(os.environ.get("NBA_SERIES_ID", "10345"))
+LIGAS_ACTIVAS     = [l.strip().lower() for l in os.environ.get("LIGAS_ACTIVAS", "nba").split(",") if l.strip()]
+PRECIO_CACHE_TTL  = float(os.environ.get("PRECIO_CACHE_TTL", "30"))      # segundos de validez de un precio CLOB cacheado
+VENTANA_HORAS       = float(os.environ.get("VENTANA_HORAS", "36"))       # horas hacia adelante (ET) para buscar partidos
+VENTANA_ATRAS_HORAS = float(os.environ.get("VENTANA_ATRAS_HORAS", "6"))  # horas hacia atrás (partidos en juego)
+GAMMA_PAGINA        = int(os.environ.get("GAMMA_PAGINA", "50"))          # eventos por página de Gamma
+GAMMA_MAX_PAGINAS   = int(os.environ.get("GAMMA_MAX_PAGINAS", "20"))
+GAMMA_CACHE_TTL     = float(os.environ.get("GAMMA_CACHE_TTL", "300"))    # segundos sin revalidar una página
 NEA_UMBRAL          = float(os.environ.get("NEA_UMBRAL", "10.0"))       # puntos mínimos NEA para señal COMPRAR
 VALOR_REAL_MINIMO   = float(os.environ.get("VALOR_REAL_MINIMO", "0.40")) # filtro: valor real debe ser > 0.40
 TAKE_PROFIT_PRECIO  = float(os.environ.get("TAKE_PROFIT_PRECIO", "0.42"))# precio fijo de salida TP (42¢)
 # Stop Loss = valor real de la posición (calculado al abrir) — no hay delta fijo
 MONITOR_INTERVAL    = int(os.environ.get("MONITOR_INTERVAL", "3600"))    # segundos entre actualizaciones (default 1h)
+LIQUIDACION_ACTIVA  = os.environ.get("LIQUIDACION_ACTIVA", "true").lower() == "true"  # cierra posiciones de mercados resueltos
+LIQUIDACION_LOTE    = int(os.environ.get("LIQUIDACION_LOTE", "50"))      # token_ids por request a Gamma /markets
+RESCORE_INTERVAL    = int(os.environ.get("RESCORE_INTERVAL", "900"))     # segundos entre re-scorings intradía (0 = off)
+ARRANQUE_PRESUPUESTO = float(os.environ.get("ARRANQUE_PRESUPUESTO", "10"))  # segundos para quedar listo tras arrancar
+RESCORE_SOLO_PREVIO = os.environ.get("RESCORE_SOLO_PREVIO", "true").lower() == "true"  # solo partidos sin empezar
 CAPITAL_TOTAL       = float(os.environ.get("CAPITAL_TOTAL", "100.0"))    # capital simulado en USD
 RIESGO_POR_TRADE    = float(os.environ.get("RIESGO_POR_TRADE", "0.01"))  # 1% del capital por posición
+SIZING_MODO         = os.environ.get("SIZING_MODO", "fijo").lower()   # "fijo", "kelly" o "volatilidad"
+KELLY_FRACCION      = float(os.environ.get("KELLY_FRACCION", "0.25"))   # fracción de Kelly aplicada
+SIZING_MAX_PCT      = float(os.environ.get("SIZING_MAX_PCT", "0.05"))   # tope por trade (fracción del capital)
+RIESGO_MONTO_MIN    = float(os.environ.get("RIESGO_MONTO_MIN", "0.10")) # USD mínimos para abrir tras los límites
+EXPOSICION_MAX_PARTIDO = float(os.environ.get("EXPOSICION_MAX_PARTIDO", "0.03"))  # fracciones del capital actual
+EXPOSICION_MAX_EQUIPO  = float(os.environ.get("EXPOSICION_MAX_EQUIPO", "0.03"))
+EXPOSICION_MAX_DIA     = float(os.environ.get("EXPOSICION_MAX_DIA", "0.20"))      # abierto en el día ET
+EXPOSICION_MAX_TOTAL   = float(os.environ.get("EXPOSICION_MAX_TOTAL", "0.50"))    # todas las posiciones abiertas
+EJECUCION_MODO      = os.environ.get("EJECUCION_MODO", "book").lower()   # "book" (VWAP sobre el libro) o "mid"
+EJECUCION_BOOK_TTL  = float(os.environ.get("EJECUCION_BOOK_TTL", "5"))   # segundos de caché de un order book
+EJECUCION_MIN_FILL  = float(os.environ.get("EJECUCION_MIN_FILL", "0.5")) # fracción mínima del monto a llenar para abrir
+ESTRATEGIAS_SOMBRA  = os.environ.get("ESTRATEGIAS_SOMBRA", "")  # JSON: [{"nombre": "...", "nea_umbral": 8, ...}]
+LIQ_FILTRO          = os.environ.get("LIQ_FILTRO", "true").lower() == "true"
+LIQ_MAX_SPREAD      = float(os.environ.get("LIQ_MAX_SPREAD", "0.05"))        # ask − bid máximo (precio 0–1)
+LIQ_MIN_PROFUNDIDAD = float(os.environ.get("LIQ_MIN_PROFUNDIDAD", "5"))      # USD mínimos en el mejor nivel de cada lado
+LIQ_SNAPSHOT_TTL    = float(os.environ.get("LIQ_SNAPSHOT_TTL", "120"))       # vida de un snapshot de microestructura
 GEMINI_MODEL        = os.environ.get("GEMINI_MODEL", "gemini-flash-lite-latest")
+GEMINI_BUSQUEDA     = os.environ.get("GEMINI_BUSQUEDA", "true").lower() == "true"  # grounding con Google Search
+GEMINI_MODO_SLATE   = os.environ.get("GEMINI_MODO_SLATE", "true").lower() == "true"
+GEMINI_SLATE_CHUNK  = int(os.environ.get("GEMINI_SLATE_CHUNK", "8"))     # partidos por request en modo slate
+GEMINI_MODEL_RESPALDO  = os.environ.get("GEMINI_MODEL_RESPALDO", "")              # modelo de respaldo del router ("" = off)
+GEMINI_HEDGE_PERCENTIL = float(os.environ.get("GEMINI_HEDGE_PERCENTIL", "90"))     # latencia del primario que dispara el respaldo
+GEMINI_HEDGE_SEG       = float(os.environ.get("GEMINI_HEDGE_SEG", "6"))            # umbral de hedge mientras no hay historial
+GEMINI_ROUTER_MUESTREO = float(os.environ.get("GEMINI_ROUTER_MUESTREO", "0"))      # fracción de análisis con ambos modelos completos
+GEMINI_TIMEOUT_SEG     = float(os.environ.get("GEMINI_TIMEOUT_SEG", "90"))         # tope por request (y sin chunks) a Gemini
+GEMINI_PRESUPUESTO_LLAMADAS = int(os.environ.get("GEMINI_PRESUPUESTO_LLAMADAS", "0"))  # llamadas por día ET (0 = sin límite)
+GEMINI_PRESUPUESTO_TOKENS   = int(os.environ.get("GEMINI_PRESUPUESTO_TOKENS", "0"))    # tokens por día ET (0 = sin límite)
+PREFILTRO           = os.environ.get("PREFILTRO", "true").lower() == "true"  # omite Gemini si NEA no puede cruzar el umbral
+PREFILTRO_DELTA_P   = float(os.environ.get("PREFILTRO_DELTA_P", "15"))   # |p_vegas − p_poly| máximo asumido (pts)
+PREFILTRO_N_MAX     = float(os.environ.get("PREFILTRO_N_MAX", "40"))     # |n| máximo asumido del factor noticias
+PREFILTRO_PREVIO_DELTA_P = float(os.environ.get("PREFILTRO_PREVIO_DELTA_P", "5"))   # |Δp_vegas| respecto del análisis previo
+PREFILTRO_PREVIO_DELTA_N = float(os.environ.get("PREFILTRO_PREVIO_DELTA_N", "15"))  # |Δn| y |Δr| respecto del análisis previo
+PREFILTRO_PREVIO_DELTA_TOTAL = float(os.environ.get("PREFILTRO_PREVIO_DELTA_TOTAL", "4"))  # |Δ total proyectado| (puntos)
+PREFILTRO_PREVIO_MAX_HORAS = float(os.environ.get("PREFILTRO_PREVIO_MAX_HORAS", "12"))  # antigüedad máxima del análisis previo
+PREFILTRO_SOLO_COMPRAR = os.environ.get("PREFILTRO_SOLO_COMPRAR", "false").lower() == "true"  # ignora señales EVITAR
+PREFILTRO_AUDITORIA = os.environ.get("PREFILTRO_AUDITORIA", "false").lower() == "true"  # analiza igual los omitidos
 DATA_DIR            = os.environ.get("DATA_DIR", "/data")
 ET = ZoneInfo("America/New_York")
 
+# Tipos de mercado que se escanean por partido
+MONEYLINE = "💰 Moneyline"
+SPREAD    = "📐 Spread"
+TOTAL     = "🎯 Total O/U"
+
 # ── Persistencia ───────────────────────────────────────────────────────────────
 os.makedirs(DATA_DIR, exist_ok=True)
 POSITIONS_FILE = os.path.join(DATA_DIR, "positions.json")
 SCAN_LOG_FILE  = os.path.join(DATA_DIR, "scan_log.json")
 STATE_FILE     = os.path.join(DATA_DIR, "state.json")
+AGGREGATES_FILE = os.path.join(DATA_DIR, "aggregates.json")
+SLATE_FILE     = os.path.join(DATA_DIR, "slate.json")
+LLM_USAGE_FILE = os.path.join(DATA_DIR, "llm_usage.json")
+ARCHIVE_DIR    = os.path.join(DATA_DIR, "archive")
+SOMBRAS_DIR    = os.path.join(DATA_DIR, "estrategias")   # una subcarpeta por estrategia sombra
+SCANS_DIR      = os.path.join(DATA_DIR, "scans")         # historial completo de scans
+SCANS_INDEX_FILE = os.path.join(SCANS_DIR, "index.json")   # índice único anterior (se migra)
+os.makedirs(ARCHIVE_DIR, exist_ok=True)
+os.makedirs(SCANS_DIR, exist_ok=True)
 
 HEADERS = {"User-Agent": "Mozilla/5.0"}
 SESSION = requests.Session()
@@ -73,6 +148,273 @@ SESSION.headers.update(HEADERS)
 # ── Lock para acceso concurrente a archivos ────────────────────────────────────
 _file_lock = threading.Lock()
 
+try:
+    import fcntl
+except ImportError:     # sin flock (Windows): solo se serializa dentro del proceso
+    fcntl = None
+
+
+@contextmanager
+def _bloqueo_entre_procesos(path: str):
+    """Lock exclusivo sobre `path`.lock, compartido con otros procesos (web, CLI)."""
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _firma_archivo(path: str) -> tuple | None:
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except FileNotFoundError:
+        return None
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODELOS
+# ══════════════════════════════════════════════════════════════════════════════
+# Registros tipados con __slots__ en lugar de dicts libres. El esquema JSON en
+# disco no cambia: to_dict()/from_dict() convierten sin pérdida en ambos sentidos.
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _iso_a_us(ts: str) -> int:
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=ET)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _us_a_iso(us: int) -> str:
+    return (_EPOCH + timedelta(microseconds=us)).astimezone(ET).isoformat()
+
+
+@dataclass(slots=True)
+class PricePoint:
+    ts:    str
+    price: float
+
+    def to_dict(self) -> dict:
+        return {"ts": self.ts, "price": self.price}
+
+
+class PriceHistory:
+    """Historial de precios como dos arrays paralelos (µs epoch + precio)."""
+
+    __slots__ = ("ts_us", "precios")
+
+    def __init__(self):
+        self.ts_us   = array("q")
+        self.precios = array("d")
+
+    def append(self, ts: str, price: float):
+        self.ts_us.append(_iso_a_us(ts))
+        self.precios.append(float(price))
+
+    def recortar(self, maximo: int):
+        if len(self.precios) > maximo:
+            del self.ts_us[:-maximo]
+            del self.precios[:-maximo]
+
+    def __len__(self) -> int:
+        return len(self.precios)
+
+    def __repr__(self) -> str:
+        return f"PriceHistory({len(self)} puntos)"
+
+    def __iter__(self):
+        for us, price in zip(self.ts_us, self.precios):
+            yield PricePoint(_us_a_iso(us), price)
+
+    def to_list(self) -> list[dict]:
+        return [pp.to_dict() for pp in self]
+
+    @classmethod
+    def from_list(cls, items: list[dict]) -> "PriceHistory":
+        h = cls()
+        for item in items or []:
+            h.append(item["ts"], item["price"])
+        return h
+
+
+@dataclass(slots=True)
+class Opportunity:
+    partido:    str
+    equipo:     str
+    es_local:   bool
+    p_poly:     float
+    valor_real: float
+    nea:        float
+    accion:     str
+    hora:       str
+    token_id:   str
+    resumen:    str
+    scanned_at: str
+    liga:       str = "nba"
+    mercado:    str = MONEYLINE
+    linea:      float | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "liga":       self.liga,
+            "mercado":    self.mercado,
+            "linea":      self.linea,
+            "partido":    self.partido,
+            "equipo":     self.equipo,
+            "es_local":   self.es_local,
+            "p_poly":     self.p_poly,
+            "valor_real": self.valor_real,
+            "nea":        self.nea,
+            "accion":     self.accion,
+            "hora":       self.hora,
+            "token_id":   self.token_id,
+            "resumen":    self.resumen,
+            "scanned_at": self.scanned_at,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Opportunity":
+        return cls(
+            partido=d["partido"], equipo=d["equipo"], es_local=d["es_local"],
+            p_poly=d["p_poly"], valor_real=d["valor_real"], nea=d["nea"],
+            accion=d["accion"], hora=d["hora"], token_id=d["token_id"],
+            resumen=d.get("resumen", ""), scanned_at=d.get("scanned_at", ""),
+            liga=d.get("liga", "nba"), mercado=d.get("mercado", MONEYLINE),
+            linea=d.get("linea"),
+        )
+
+
+@dataclass(slots=True)
+class ScanEntry:
+    ts:            str
+    partidos:      int
+    oportunidades: int
+    resultados:    list[Opportunity] = field(default_factory=list)
+    por_liga:      dict = field(default_factory=dict)
+    llm:           dict = field(default_factory=dict)   # consumo de Gemini del scan
+    slate:         list[dict] = field(default_factory=list)  # partidos evaluados: análisis + precios
+
+    def to_dict(self) -> dict:
+        return {
+            "ts":            self.ts,
+            "partidos":      self.partidos,
+            "oportunidades": self.oportunidades,
+            "resultados":    [op.to_dict() for op in self.resultados],
+            "por_liga":      self.por_liga,
+            "llm":           self.llm,
+            "slate":         self.slate,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ScanEntry":
+        return cls(
+            ts=d["ts"], partidos=d.get("partidos", 0),
+            oportunidades=d.get("oportunidades", 0),
+            resultados=[Opportunity.from_dict(r) for r in d.get("resultados", [])],
+            por_liga=d.get("por_liga", {}),
+            llm=d.get("llm", {}),
+            slate=d.get("slate", []),
+        )
+
+
+_POSITION_KEYS = (
+    "id", "partido", "equipo", "token_id", "precio_entrada", "precio_actual",
+    "valor_real", "nea_entrada", "take_profit", "stop_loss", "monto_usd",
+    "hora_partido", "status", "opened_at", "closed_at", "close_reason",
+    "pnl_usd", "pnl_pct", "liga", "mercado", "shares", "precio_salida",
+    "slippage_entrada", "slippage_salida", "price_history",
+)
+
+
+@dataclass(slots=True)
+class Position:
+    id:             str
+    partido:        str
+    equipo:         str
+    token_id:       str
+    precio_entrada: float
+    precio_actual:  float
+    valor_real:     float
+    nea_entrada:    float
+    take_profit:    float
+    stop_loss:      float
+    monto_usd:      float
+    hora_partido:   str
+    status:         str
+    opened_at:      str
+    closed_at:      str | None = None
+    close_reason:   str | None = None
+    pnl_usd:        float = 0.0
+    pnl_pct:        float = 0.0
+    liga:           str = "nba"
+    mercado:        str = MONEYLINE
+    shares:         float = 0.0
+    precio_salida:  float | None = None
+    slippage_entrada: float = 0.0       # % sobre el mid al abrir (VWAP vs mid)
+    slippage_salida:  float = 0.0       # % bajo el mid al cerrar
+    price_history:  PriceHistory = field(default_factory=PriceHistory)
+    extra:          dict = field(default_factory=dict)   # claves desconocidas, se preservan
+
+    def to_dict(self) -> dict:
+        d = {
+            "id":             self.id,
+            "partido":        self.partido,
+            "equipo":         self.equipo,
+            "token_id":       self.token_id,
+            "precio_entrada": self.precio_entrada,
+            "precio_actual":  self.precio_actual,
+            "valor_real":     self.valor_real,
+            "nea_entrada":    self.nea_entrada,
+            "take_profit":    self.take_profit,
+            "stop_loss":      self.stop_loss,
+            "monto_usd":      self.monto_usd,
+            "hora_partido":   self.hora_partido,
+            "status":         self.status,
+            "opened_at":      self.opened_at,
+            "closed_at":      self.closed_at,
+            "close_reason":   self.close_reason,
+            "pnl_usd":        self.pnl_usd,
+            "pnl_pct":        self.pnl_pct,
+            "liga":           self.liga,
+            "mercado":        self.mercado,
+            "shares":         self.shares,
+            "precio_salida":  self.precio_salida,
+            "slippage_entrada": self.slippage_entrada,
+            "slippage_salida":  self.slippage_salida,
+            "price_history":  self.price_history.to_list(),
+        }
+        d.update(self.extra)
+        return d
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Position":
+        return cls(
+            id=d["id"], partido=d["partido"], equipo=d["equipo"],
+            token_id=d["token_id"], precio_entrada=d["precio_entrada"],
+            precio_actual=d.get("precio_actual", d["precio_entrada"]),
+            valor_real=d.get("valor_real", 0.0), nea_entrada=d.get("nea_entrada", 0.0),
+            take_profit=d["take_profit"], stop_loss=d["stop_loss"],
+            monto_usd=d.get("monto_usd", 1.0), hora_partido=d.get("hora_partido", ""),
+            status=d["status"], opened_at=d["opened_at"],
+            closed_at=d.get("closed_at"), close_reason=d.get("close_reason"),
+            pnl_usd=d.get("pnl_usd", 0.0), pnl_pct=d.get("pnl_pct", 0.0),
+            liga=d.get("liga", "nba"), mercado=d.get("mercado", MONEYLINE),
+            shares=d.get("shares") or round(d.get("monto_usd", 1.0) / d["precio_entrada"], 6),
+            precio_salida=d.get("precio_salida"),
+            slippage_entrada=d.get("slippage_entrada", 0.0),
+            slippage_salida=d.get("slippage_salida", 0.0),
+            price_history=PriceHistory.from_list(d.get("price_history", [])),
+            extra={k: v for k, v in d.items() if k not in _POSITION_KEYS},
+        )
+
 
 # ══════════════════════════════════════════════════════════════════════════════
 # PERSISTENCIA
@@ -94,582 +436,3858 @@ def save_json(path: str, data):
         os.replace(tmp, path)
 
 
-def load_positions() -> list[dict]:
-    return load_json(POSITIONS_FILE, [])
+# ── Posiciones: escrituras versionadas ───────────────────────────────────────
+# positions.json guarda {"version": n, "positions": [...]}. Las actualizaciones
+# son transacciones optimistas: se lee (posiciones, versión), se aplica el
+# cambio en memoria y se escribe solo si la versión en disco no cambió; si
+# otro hilo (u otro proceso, p. ej. la CLI) escribió en el medio, se reintenta
+# sobre los datos frescos. _file_lock (y el flock entre procesos) solo cubre el
+# compare-and-swap, no la lectura ni el cálculo.
 
+POSICIONES_REINTENTOS = 20
+TX_STATS = {"commits": 0, "conflictos": 0}
 
-def save_positions(positions: list[dict]):
-    save_json(POSITIONS_FILE, positions)
 
+class ConflictoPosiciones(RuntimeError):
+    pass
 
-def load_scan_log() -> list[dict]:
-    return load_json(SCAN_LOG_FILE, [])
 
+def load_positions_versionado(path: str = POSITIONS_FILE) -> tuple[list[Position], int]:
+    data = load_json(path, [])
+    if isinstance(data, list):          # formato previo sin versión
+        return [Position.from_dict(d) for d in data], 0
+    return [Position.from_dict(d) for d in data.get("positions", [])], data.get("version", 0)
 
-def append_scan_log(entry: dict):
-    log_data = load_scan_log()
-    log_data.append(entry)
-    # Guardar solo los últimos 50 scans
-    save_json(SCAN_LOG_FILE, log_data[-50:])
 
+def load_positions(path: str = POSITIONS_FILE) -> list[Position]:
+    return load_positions_versionado(path)[0]
 
-def load_state() -> dict:
-    return load_json(STATE_FILE, {"last_scan": None, "manual_triggered": False})
 
+def _version_actual(path: str) -> int:
+    """Versión en disco (llamar con _file_lock tomado)."""
+    data = load_json(path, [])
+    return data.get("version", 0) if isinstance(data, dict) else 0
 
-def save_state(state: dict):
-    save_json(STATE_FILE, state)
 
+def _escribir_posiciones(path: str, positions: list[Position], version: int):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": version, "positions": [p.to_dict() for p in positions]},
+                  f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
 
-# ══════════════════════════════════════════════════════════════════════════════
-# MÓDULO 1 — POLYMARKET
-# ══════════════════════════════════════════════════════════════════════════════
 
-def obtener_partidos_hoy() -> list[dict]:
-    hoy = date.today().strftime("%Y-%m-%d")
-    resp = SESSION.get(
-        f"{GAMMA_API}/events",
-        params={
-            "series_id": NBA_SERIES_ID, "tag_id": 100639,
-            "active": "true", "closed": "false",
-            "limit": 50, "order": "startTime", "ascending": "true",
-        }, timeout=15
-    )
-    resp.raise_for_status()
-    todos = resp.json()
-    return [e for e in todos if e.get("eventDate") == hoy]
-
-
-def clasificar_mercado(pregunta: str) -> str | None:
-    p, pl = pregunta.strip(), pregunta.lower()
-    excluir = [
-        "points o/u", "rebounds o/u", "assists o/u", "steals o/u",
-        "blocks o/u", "turnovers o/u", "3-pointer", "field goal", "free throw",
-        "first quarter", "second quarter", "third quarter", "fourth quarter",
-        "first half", "second half", "halftime", "triple double", "double double",
-        "will there be", "lead at any", "margin of victory", "largest lead",
-    ]
-    if any(ex in pl for ex in excluir): return None
-    if p.startswith("Spread:"):         return "📐 Spread"
-    if ": O/U" in p:                    return "🎯 Total O/U"
-    if "vs." in pl and ":" not in p:    return "💰 Moneyline"
-    return None
+def save_positions(positions: list[Position], path: str = POSITIONS_FILE, al_commit=None):
+    """Escritura incondicional (migraciones). Para cambios concurrentes usar transaccion_posiciones."""
+    with _file_lock, _bloqueo_entre_procesos(path):
+        version = _version_actual(path)
+        _escribir_posiciones(path, positions, version + 1)
+        if al_commit is not None:
+            al_commit(None, version + 1)
 
 
-def extraer_token_ids(m: dict) -> list[str]:
-    raw = m.get("clobTokenIds", "[]")
-    try:   return [str(i) for i in (json.loads(raw) if isinstance(raw, str) else raw)]
-    except: return []
+def transaccion_posiciones(fn, path: str = POSITIONS_FILE, intentos: int = POSICIONES_REINTENTOS,
+                           al_commit=None):
+    """
+    Aplica `fn(posiciones) -> (nuevas | None, resultado)` con concurrencia
+    optimista y retorna `resultado`. Con `nuevas` None no se escribe nada.
+    `fn` puede ejecutarse más de una vez: no debe tener efectos fuera de las
+    posiciones que recibe (logs, estadísticas y archivo van después del commit).
+    `al_commit(version_leida, version_escrita)` corre con el lock tomado.
+    """
+    for intento in range(intentos):
+        positions, version = load_positions_versionado(path)
+        nuevas, resultado = fn(positions)
+        if nuevas is None:
+            return resultado
+        with _file_lock, _bloqueo_entre_procesos(path):
+            if _version_actual(path) == version:
+                _escribir_posiciones(path, nuevas, version + 1)
+                TX_STATS["commits"] += 1
+                if al_commit is not None:
+                    al_commit(version, version + 1)
+                return resultado
+            TX_STATS["conflictos"] += 1
+        time.sleep(random.uniform(0, min(0.001 * 2 ** intento, 0.05)))   # backoff con jitter
+    raise ConflictoPosiciones(f"{path}: sin poder escribir tras {intentos} intentos")
+
+
+# ── Archivo de posiciones cerradas ────────────────────────────────────────────
+# positions.json solo guarda posiciones OPEN. Al cerrarse, cada posición se
+# mueve a un segmento diario archive/positions-YYYY-MM-DD.jsonl (una por línea)
+# y se registra el cierre en ESTADISTICAS (aggregates.json). Las estrategias
+# sombra usan las mismas funciones con sus propios archivos.
+
+def _segmento_archivo(pos: Position, archive_dir: str = ARCHIVE_DIR) -> str:
+    dia = (pos.closed_at or pos.opened_at)[:10]
+    return os.path.join(archive_dir, f"positions-{dia}.jsonl")
+
+
+def _ids_archivados(path: str) -> set[str]:
+    def _leer():
+        if not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return {json.loads(line)["id"] for line in f if line.strip()}
+    return _leer_memo(path, _leer, clave=f"ids:{path}")
 
 
-def extraer_outcomes(m: dict) -> list[str]:
-    raw = m.get("outcomes", "[]")
-    try:   return json.loads(raw) if isinstance(raw, str) else raw
-    except: return []
+def _ya_archivada(pos: Position, archive_dir: str) -> bool:
+    # Un reintento puede cerrar con otra fecha: se miran los segmentos entre
+    # la apertura y el cierre.
+    dia = datetime.fromisoformat(pos.opened_at[:10]).date()
+    fin = datetime.fromisoformat((pos.closed_at or pos.opened_at)[:10]).date()
+    while dia <= fin:
+        if pos.id in _ids_archivados(os.path.join(archive_dir, f"positions-{dia.isoformat()}.jsonl")):
+            return True
+        dia += timedelta(days=1)
+    return False
 
 
-def precio_clob(token_id: str) -> tuple[str, float | None]:
-    try:
-        r = SESSION.get(f"{CLOB_API}/midpoint",
-                        params={"token_id": token_id}, timeout=8)
-        r.raise_for_status()
-        mid = r.json().get("mid")
-        return token_id, float(mid) if mid is not None else None
-    except Exception:
-        return token_id, None
+def archivar_posiciones(cerradas: list[Position], archive_dir: str = ARCHIVE_DIR):
+    """
+    Agrega las posiciones cerradas a su segmento diario; idempotente por id.
+    Se llama antes de quitarlas de positions.json: si el proceso cae en el
+    medio, la posición sigue abierta y el próximo ciclo la vuelve a cerrar
+    sin duplicarla en el archivo.
+    """
+    with _file_lock:
+        for pos in cerradas:
+            if _ya_archivada(pos, archive_dir):
+                continue
+            with open(_segmento_archivo(pos, archive_dir), "a") as f:
+                f.write(json.dumps(pos.to_dict(), ensure_ascii=False) + "\n")
 
 
-def obtener_precios_paralelo(token_ids: list[str]) -> dict[str, float]:
-    resultado = {}
-    with ThreadPoolExecutor(max_workers=20) as pool:
-        futuros = {pool.submit(precio_clob, tid): tid for tid in token_ids}
-        for f in as_completed(futuros):
-            tid, precio = f.result()
-            if precio is not None:
-                resultado[tid] = precio
-    return resultado
+def iter_archivo_posiciones(desde: str | None = None, hasta: str | None = None,
+                            archive_dir: str = ARCHIVE_DIR):
+    """Recorre las posiciones archivadas en orden de fecha (YYYY-MM-DD inclusive)."""
+    for nombre in sorted(os.listdir(archive_dir)):
+        if not (nombre.startswith("positions-") and nombre.endswith(".jsonl")):
+            continue
+        dia = nombre[len("positions-"):-len(".jsonl")]
+        if (desde and dia < desde) or (hasta and dia > hasta):
+            continue
+        with open(os.path.join(archive_dir, nombre)) as f:
+            for line in f:
+                if line.strip():
+                    yield Position.from_dict(json.loads(line))
 
 
-def construir_estructura(partidos: list[dict]) -> list[dict]:
-    estructura = []
-    for evento in partidos:
-        candidatos = []
-        for m in evento.get("markets", []):
-            tipo = clasificar_mercado(m.get("question", ""))
-            if not tipo: continue
-            token_ids = extraer_token_ids(m)
-            if not token_ids: continue
-            candidatos.append({
-                "tipo":      tipo,
-                "pregunta":  m.get("question", ""),
-                "volumen":   float(m.get("volume", 0) or 0),
-                "token_ids": token_ids,
-                "outcomes":  extraer_outcomes(m),
-            })
-        seleccionados = {}
-        for c in sorted(candidatos, key=lambda x: x["volumen"], reverse=True):
-            if c["tipo"] not in seleccionados:
-                seleccionados[c["tipo"]] = c
-            if len(seleccionados) == 3: break
-        estructura.append({"evento": evento, "mercados": seleccionados})
-    return estructura
+def compactar_posiciones():
+    """Migra positions.json (de cada cartera) con posiciones cerradas al esquema archivado."""
+    for cartera in CARTERAS:
+        cartera.compactar()
 
 
-# ══════════════════════════════════════════════════════════════════════════════
-# MÓDULO 2 — GEMINI
-# ══════════════════════════════════════════════════════════════════════════════
+_memo_archivos: dict[str, tuple] = {}
 
-def analizar_partido_con_gemini(equipo_local: str, equipo_visitante: str,
-                                 linea_ml_local: float) -> dict:
-    if not GEMINI_API_KEY:
-        log.warning("API key de Gemini no configurada, usando valores por defecto")
-        return _valores_defecto(linea_ml_local)
 
-    from google import genai
-    from google.genai import types
+def _leer_memo(path: str, loader, clave: str | None = None):
+    """Resultado de `loader()` memoizado mientras el archivo no cambie (mtime + tamaño)."""
+    try:
+        st = os.stat(path)
+        firma = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        firma = None
+    clave = clave or path
+    item = _memo_archivos.get(clave)
+    if item is not None and item[0] == firma:
+        return item[1]
+    valor = loader()
+    _memo_archivos[clave] = (firma, valor)
+    return valor
+
+
+def load_scan_log() -> list[ScanEntry]:
+    """Scans recientes (memoizado: no mutar el resultado)."""
+    return _leer_memo(SCAN_LOG_FILE,
+                      lambda: [ScanEntry.from_dict(d) for d in load_json(SCAN_LOG_FILE, [])])
+
+
+def append_scan_log(entry: ScanEntry):
+    log_data = load_json(SCAN_LOG_FILE, [])
+    # scan_log.json guarda solo los últimos 50 scans y sin el slate; el
+    # historial completo va a los segmentos diarios comprimidos
+    log_data.append({k: v for k, v in entry.to_dict().items() if k != "slate"})
+    save_json(SCAN_LOG_FILE, log_data[-50:])
+    with _indice_scans_lock:
+        # bajo el lock: o el índice ya existe y se agrega, o se construirá
+        # después leyendo el segmento que ya incluye este scan
+        guardar_scan_segmento(entry)
+        if _indice_scans["indice"] is not None:
+            agregar_a_indice_scans(_indice_scans["indice"], entry)
 
-    client = genai.Client(api_key=GEMINI_API_KEY)
-    prompt = f"""Eres un analista experto de apuestas deportivas NBA.
-Necesito que analices el partido de HOY: {equipo_visitante} (visitante) @ {equipo_local} (local).
 
-Usando búsqueda web, responde EXACTAMENTE en este formato JSON (sin markdown):
+# ── Historial de scans en segmentos diarios comprimidos ──────────────────────
+# Cada scan se agrega como un miembro gzip independiente (una línea NDJSON) a
+# scans/scans-YYYY-MM-DD.ndjson.gz; la concatenación sigue siendo un gzip
+# válido. El scan incluye el slate completo (análisis + precios de cada
+# partido evaluado, crucen o no el umbral). scans/index-YYYY-MM-DD.ndjson
+# agrega una línea por scan con el offset y tamaño del miembro y los partidos
+# que contiene: escribir es un append y leer un scan es un seek + un miembro,
+# sin importar el tamaño del historial.
 
-{{
-  "p_vegas": <número 0-100, probabilidad implícita del equipo LOCAL según casas de apuestas hoy>,
-  "n_local": <número -100 a 100, factor noticias equipo local>,
-  "n_visitante": <número -100 a 100, factor noticias equipo visitante>,
-  "r_local": <número 0-100, racha equipo local últimos 5 partidos>,
-  "r_visitante": <número 0-100, racha equipo visitante últimos 5 partidos>,
-  "resumen": "<2 oraciones: estado actual, lesiones importantes y contexto>"
-}}
+def _segmento_scans(dia: str) -> str:
+    return os.path.join(SCANS_DIR, f"scans-{dia}.ndjson.gz")
 
-Busca: odds actuales DraftKings/FanDuel, lesiones confirmadas, últimos 5 resultados de cada equipo.
-Responde SOLO el JSON."""
 
-    try:
-        respuesta_texto = ""
-        for chunk in client.models.generate_content_stream(
-            model=GEMINI_MODEL,
-            contents=[types.Content(role="user", parts=[types.Part.from_text(text=prompt)])],
-            config=types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(thinking_budget=0),
-                tools=[types.Tool(googleSearch=types.GoogleSearch())],
-            ),
-        ):
-            if chunk.text:
-                respuesta_texto += chunk.text
-
-        respuesta_texto = re.sub(r"```json|```", "", respuesta_texto).strip()
-        match = re.search(r"\{.*\}", respuesta_texto, re.DOTALL)
-        if match:
-            data = json.loads(match.group())
-            return {
-                "p_vegas":     float(data.get("p_vegas", 50)),
-                "n_local":     float(data.get("n_local", 0)),
-                "n_visitante": float(data.get("n_visitante", 0)),
-                "r_local":     float(data.get("r_local", 50)),
-                "r_visitante": float(data.get("r_visitante", 50)),
-                "resumen":     data.get("resumen", "Sin información disponible."),
-            }
-    except Exception as e:
-        log.error(f"Error Gemini: {e}")
+def _indice_scans_dia(dia: str) -> str:
+    return os.path.join(SCANS_DIR, f"index-{dia}.ndjson")
 
-    return _valores_defecto(linea_ml_local)
 
+def _dias_indice_scans() -> list[str]:
+    return sorted(n[len("index-"):-len(".ndjson")] for n in os.listdir(SCANS_DIR)
+                  if n.startswith("index-") and n.endswith(".ndjson"))
 
-def _valores_defecto(linea_ml_local: float) -> dict:
-    return {
-        "p_vegas":     linea_ml_local * 100,
-        "n_local":     0.0,
-        "n_visitante": 0.0,
-        "r_local":     50.0,
-        "r_visitante": 50.0,
-        "resumen":     "Análisis no disponible (sin API key de Gemini).",
-    }
 
+def _leer_indice_dia(path: str) -> list[dict]:
+    refs = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                try:
+                    refs.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass    # línea a medio escribir
+    return refs
 
-# ══════════════════════════════════════════════════════════════════════════════
-# MÓDULO 3 — FÓRMULA NEA
-# ══════════════════════════════════════════════════════════════════════════════
 
-def calcular_nea(p_poly: float, p_vegas: float, n: float,
-                 v: float, r: float) -> float:
-    valor_real = 0.45 * p_vegas + 0.40 * n + 0.10 * v + 0.05 * r
-    return p_poly - valor_real
+def load_indice_scans() -> dict:
+    """{dia: [{ts, offset, bytes, partidos, oportunidades}]} (memoizado por día: no mutar)."""
+    return {dia: _leer_memo(_indice_scans_dia(dia), lambda d=dia: _leer_indice_dia(_indice_scans_dia(d)))
+            for dia in _dias_indice_scans()}
 
 
-def extraer_equipos(titulo: str) -> tuple[str, str]:
-    partes = titulo.split(" vs. ")
-    if len(partes) == 2:
-        return partes[0].strip(), partes[1].strip()
-    return titulo, titulo
+def _partidos_scan(entry: ScanEntry) -> list[str]:
+    return sorted({j["partido"] for j in entry.slate} | {op.partido for op in entry.resultados})
 
 
-def hora_et(st: str) -> str:
-    try:
-        dt = datetime.fromisoformat(st.replace("Z", "+00:00"))
-        return (dt - timedelta(hours=5)).strftime("%I:%M %p ET")
-    except: return st
+def guardar_scan_segmento(entry: ScanEntry):
+    dia = entry.ts[:10]
+    miembro = gzip.compress(json.dumps(entry.to_dict(), ensure_ascii=False).encode("utf-8") + b"\n",
+                            mtime=0)
+    with _file_lock:
+        path = _segmento_scans(dia)
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        with open(path, "ab") as f:
+            f.write(miembro)
+        ref = {
+            "ts":            entry.ts,
+            "offset":        offset,
+            "bytes":         len(miembro),
+            "partidos":      _partidos_scan(entry),
+            "oportunidades": entry.oportunidades,
+        }
+        with open(_indice_scans_dia(dia), "a") as f:
+            f.write(json.dumps(ref, ensure_ascii=False) + "\n")
+
+
+def leer_scan(dia: str, ref: dict) -> ScanEntry:
+    with open(_segmento_scans(dia), "rb") as f:
+        f.seek(ref["offset"])
+        return ScanEntry.from_dict(json.loads(gzip.decompress(f.read(ref["bytes"]))))
+
+
+def iter_scans(desde: str | None = None, hasta: str | None = None, partido: str | None = None):
+    """Scans del historial en orden, opcionalmente por rango de días y partido."""
+    indice = load_indice_scans()
+    for dia in sorted(indice):
+        if (desde and dia < desde) or (hasta and dia > hasta):
+            continue
+        for ref in indice[dia]:
+            if partido is None or partido in ref["partidos"]:
+                yield leer_scan(dia, ref)
 
 
-# ══════════════════════════════════════════════════════════════════════════════
-# MÓDULO 4 — SCAN Y OPORTUNIDADES
-# ══════════════════════════════════════════════════════════════════════════════
+def ultimo_scan() -> ScanEntry | None:
+    dias = _dias_indice_scans()
+    if not dias:
+        return None
+    path = _indice_scans_dia(dias[-1])
+    refs = _leer_memo(path, lambda: _leer_indice_dia(path))
+    if not refs:
+        return None
+    return _leer_memo(path, lambda: leer_scan(dias[-1], refs[-1]), clave="ultimo_scan")
 
-def ejecutar_scan() -> list[dict]:
-    """Corre el scan completo y retorna lista de oportunidades."""
-    log.info("🔍 Iniciando scan NBA Edge Alpha...")
-    todas_oportunidades = []
 
-    try:
-        partidos = obtener_partidos_hoy()
-    except Exception as e:
-        log.error(f"Error obteniendo partidos: {e}")
-        return []
+def migrar_scan_log():
+    """
+    Pasa el índice único anterior (scans/index.json) a índices diarios y copia
+    a los segmentos los scans de scan_log.json previos al historial comprimido.
+    """
+    if os.path.exists(SCANS_INDEX_FILE):
+        with _file_lock:
+            for dia, refs in load_json(SCANS_INDEX_FILE, {}).items():
+                with open(_indice_scans_dia(dia), "w") as f:
+                    f.writelines(json.dumps(ref, ensure_ascii=False) + "\n" for ref in refs)
+            os.remove(SCANS_INDEX_FILE)
+        log.info("🗄 scans/index.json migrado a índices diarios")
+    if _dias_indice_scans():
+        return
+    scans = load_scan_log()
+    for entry in scans:
+        guardar_scan_segmento(entry)
+    if scans:
+        log.info(f"🗄 {len(scans)} scan(s) de scan_log.json migrados a segmentos diarios")
 
-    if not partidos:
-        log.info("Sin partidos para hoy.")
-        return []
 
-    log.info(f"✅ {len(partidos)} partido(s) encontrado(s)")
-    estructura = construir_estructura(partidos)
+def load_slate() -> dict:
+    return load_json(SLATE_FILE, {"ts": None, "partidos": []})
 
-    all_tokens = list({
-        tid
-        for item in estructura
-        for m in item["mercados"].values()
-        for tid in m["token_ids"]
-    })
-    precios = obtener_precios_paralelo(all_tokens)
-    log.info(f"💹 {len(precios)}/{len(all_tokens)} precios obtenidos")
 
-    for item in estructura:
-        titulo = item["evento"].get("title", "?")
-        equipo_visit, equipo_local = extraer_equipos(titulo)
-        hora = hora_et(item["evento"].get("startTime", ""))
+def save_slate(partidos: list[dict]):
+    """Guarda la estructura + análisis del último scan para el re-scoring intradía."""
+    save_json(SLATE_FILE, {"ts": datetime.now(ET).isoformat(), "partidos": partidos})
 
-        ml = item["mercados"].get("💰 Moneyline")
-        p_local_clob = 0.5
-        if ml:
-            for outcome, tid in zip(ml["outcomes"], ml["token_ids"]):
-                if outcome == equipo_local and tid in precios:
-                    p_local_clob = precios[tid]
-                    break
 
-        log.info(f"🤖 Analizando: {titulo}...")
-        analisis = analizar_partido_con_gemini(equipo_local, equipo_visit, p_local_clob)
+def load_state() -> dict:
+    return load_json(STATE_FILE, {"last_scan": None, "manual_triggered": False})
 
-        if not ml:
-            continue
 
-        for outcome, token_id in zip(ml["outcomes"], ml["token_ids"]):
-            precio_poly = precios.get(token_id)
-            if precio_poly is None:
-                continue
+def save_state(state: dict):
+    save_json(STATE_FILE, state)
 
-            p_poly_pct = precio_poly * 100
-            es_local = (outcome == equipo_local)
-            v_factor = 5.0 if es_local else -5.0
 
-            if es_local:
-                p_vegas = analisis["p_vegas"]
-                n       = analisis["n_local"]
-                r       = analisis["r_local"]
-            else:
-                p_vegas = 100 - analisis["p_vegas"]
-                n       = analisis["n_visitante"]
-                r       = analisis["r_visitante"]
-
-            n_norm = (n + 100) / 2
-            nea    = calcular_nea(p_poly_pct, p_vegas, n_norm, v_factor, r)
-            valor_real = 0.45 * p_vegas + 0.40 * n_norm + 0.10 * v_factor + 0.05 * r
-
-            if abs(nea) >= NEA_UMBRAL:
-                accion = "COMPRAR" if nea <= -NEA_UMBRAL else "EVITAR"
-                op = {
-                    "partido":     titulo,
-                    "equipo":      outcome,
-                    "es_local":    es_local,
-                    "p_poly":      round(p_poly_pct, 2),
-                    "valor_real":  round(valor_real, 2),
-                    "nea":         round(nea, 2),
-                    "accion":      accion,
-                    "hora":        hora,
-                    "token_id":    token_id,
-                    "resumen":     analisis["resumen"],
-                    "scanned_at":  datetime.now(ET).isoformat(),
-                }
-                todas_oportunidades.append(op)
+# ══════════════════════════════════════════════════════════════════════════════
+# ESTADÍSTICAS DEL PORTAFOLIO
+# ══════════════════════════════════════════════════════════════════════════════
 
-    todas_oportunidades.sort(key=lambda x: abs(x["nea"]), reverse=True)
-    log.info(f"🎯 Scan completado: {len(todas_oportunidades)} oportunidades encontradas")
+MAX_RECIENTES = 20
 
-    # Log del scan
-    append_scan_log({
-        "ts":            datetime.now(ET).isoformat(),
-        "partidos":      len(partidos),
-        "oportunidades": len(todas_oportunidades),
-        "resultados":    todas_oportunidades,
-    })
 
-    return todas_oportunidades
+def equipo_base(equipo: str, mercado: str) -> str | None:
+    """Equipo de una posición/oportunidad sin la línea del spread; None en totales."""
+    if mercado == TOTAL:
+        return None
+    return equipo.rsplit(" ", 1)[0] if mercado == SPREAD else equipo
 
 
-# ══════════════════════════════════════════════════════════════════════════════
-# MÓDULO 5 — GESTIÓN DE POSICIONES
-# ══════════════════════════════════════════════════════════════════════════════
+def _segundos_entre(desde: str, hasta: str) -> float:
+    try:
+        return (datetime.fromisoformat(hasta) - datetime.fromisoformat(desde)).total_seconds()
+    except Exception:
+        return 0.0
+
 
-def abrir_posicion(oportunidad: dict) -> dict | None:
+class EstadisticasPortafolio:
     """
-    Simula apertura de posición con las siguientes reglas:
-      - Solo señales COMPRAR
-      - Valor real debe ser > VALOR_REAL_MINIMO (0.40 por defecto)
-      - Tamaño: 1% del capital total (CAPITAL_TOTAL * RIESGO_POR_TRADE)
-      - Take Profit: precio fijo TAKE_PROFIT_PRECIO (0.42 por defecto)
-      - Stop Loss: precio sube hasta valor_real (el mercado te da la razón → salís)
+    Acumulador de estadísticas actualizado en cada apertura/cierre de posición.
+    Todas las lecturas son O(1). Se persiste en aggregates.json y puede
+    reconstruirse desde el archivo de cerradas tras un reinicio. Cada evento
+    relee aggregates.json bajo un lock entre procesos antes de escribirlo, y
+    las lecturas lo recargan si otro proceso (p. ej. la CLI) lo cambió.
     """
-    if oportunidad["accion"] != "COMPRAR":
-        return None
 
-    # Filtro: valor real mínimo 0.40
-    valor_real_decimal = oportunidad["valor_real"] / 100
-    if valor_real_decimal <= VALOR_REAL_MINIMO:
-        log.info(f"⏭ SKIP {oportunidad['equipo']}: valor real {valor_real_decimal:.2f} ≤ {VALOR_REAL_MINIMO} (muy bajo)")
-        return None
+    VERSION = 2
+
+    def __init__(self, path: str, data: dict | None = None,
+                 archive_dir: str = ARCHIVE_DIR, capital: float = CAPITAL_TOTAL):
+        self.path        = path
+        self.archive_dir = archive_dir
+        self.capital     = capital
+        self._lock = threading.Lock()
+        self.d     = {**self._vacio(), **(data or {})}
+        self._firma = _firma_archivo(path)
+
+    @classmethod
+    def _vacio(cls) -> dict:
+        return {
+            "version":          cls.VERSION,
+            "total_opened":     0,
+            "total_closed":     0,
+            "take_profits":     0,
+            "stop_losses":      0,
+            "liquidadas":       0,      # cierres SETTLED (mercado resuelto)
+            "liquidadas_ganadas": 0,    # SETTLED con PnL > 0 (cuentan como ganadas)
+            "pnl_total_usd":    0.0,
+            "pnl_pico_usd":     0.0,
+            "max_drawdown_usd": 0.0,
+            "hold_total_seg":   0.0,
+            "ret_n":            0,      # Welford sobre pnl_pct por trade
+            "ret_media":        0.0,
+            "ret_m2":           0.0,
+            "pnl_por_dia":      {},
+            "por_equipo":       {},
+            "recientes":        [],
+        }
+
+    @classmethod
+    def cargar(cls, path: str, **kwargs) -> "EstadisticasPortafolio":
+        return cls(path, load_json(path, {}), **kwargs)
+
+    def vigente(self) -> bool:
+        with self._lock:
+            self._refrescar()
+            return os.path.exists(self.path) and self.d.get("version") == self.VERSION
+
+    def _refrescar(self):
+        """Recarga desde disco si aggregates.json cambió desde la última lectura/escritura (con _lock)."""
+        firma = _firma_archivo(self.path)
+        if firma != self._firma:
+            self.d = {**self._vacio(), **load_json(self.path, {})}
+            self._firma = firma
+
+    def _guardar(self):
+        save_json(self.path, self.d)
+        self._firma = _firma_archivo(self.path)
+
+    # ── Eventos ──────────────────────────────────────────────────────────────
+    def registrar_apertura(self, pos: Position, guardar: bool = True):
+        with self._lock, _bloqueo_entre_procesos(self.path):
+            self._refrescar()
+            self.d["total_opened"] += 1
+            if guardar:
+                self._guardar()
+
+    def registrar_cierre(self, pos: Position, guardar: bool = True):
+        with self._lock, _bloqueo_entre_procesos(self.path):
+            self._refrescar()
+            self._acumular_cierre(pos)
+            if guardar:
+                self._guardar()
+
+    def _acumular_cierre(self, pos: Position):
+        d = self.d
+        d["total_closed"] += 1
+        if pos.close_reason == "TAKE_PROFIT":
+            d["take_profits"] += 1
+        elif pos.close_reason == "STOP_LOSS":
+            d["stop_losses"] += 1
+        elif pos.close_reason == "SETTLED":
+            d["liquidadas"] += 1
+            d["liquidadas_ganadas"] += int(pos.pnl_usd > 0)
+
+        # Curva de PnL y drawdown máximo
+        d["pnl_total_usd"]    = round(d["pnl_total_usd"] + pos.pnl_usd, 6)
+        d["pnl_pico_usd"]     = max(d["pnl_pico_usd"], d["pnl_total_usd"])
+        d["max_drawdown_usd"] = round(max(d["max_drawdown_usd"],
+                                          d["pnl_pico_usd"] - d["pnl_total_usd"]), 6)
+
+        dia = (pos.closed_at or pos.opened_at)[:10]
+        d["pnl_por_dia"][dia] = round(d["pnl_por_dia"].get(dia, 0.0) + pos.pnl_usd, 6)
+
+        if pos.closed_at:
+            d["hold_total_seg"] += max(_segundos_entre(pos.opened_at, pos.closed_at), 0.0)
+
+        d["ret_n"] += 1
+        delta = pos.pnl_pct - d["ret_media"]
+        d["ret_media"] += delta / d["ret_n"]
+        d["ret_m2"]    += delta * (pos.pnl_pct - d["ret_media"])
+
+        equipo = equipo_base(pos.equipo, pos.mercado)
+        if equipo:
+            eq = d["por_equipo"].setdefault(equipo, {"trades": 0, "take_profits": 0, "pnl_usd": 0.0})
+            eq["trades"]  += 1
+            eq["pnl_usd"]  = round(eq["pnl_usd"] + pos.pnl_usd, 6)
+            if pos.close_reason == "TAKE_PROFIT":
+                eq["take_profits"] += 1
+
+        d["recientes"] = (d["recientes"] + [pos.to_dict()])[-MAX_RECIENTES:]
+
+    # ── Lectura ──────────────────────────────────────────────────────────────
+    def snapshot(self, total_open: int = 0) -> dict:
+        with self._lock:
+            self._refrescar()
+            d = self.d
+            n = d["total_closed"]
+            std = (d["ret_m2"] / (d["ret_n"] - 1)) ** 0.5 if d["ret_n"] > 1 else 0.0
+            return {
+                "total_open":       total_open,
+                "total_opened":     d["total_opened"],
+                "total_closed":     n,
+                "take_profits":     d["take_profits"],
+                "stop_losses":      d["stop_losses"],
+                "liquidadas":       d["liquidadas"],
+                "win_rate":         round((d["take_profits"] + d["liquidadas_ganadas"]) / max(n, 1) * 100, 1),
+                "pnl_total_usd":    round(d["pnl_total_usd"], 4),
+                "capital_actual":   round(self.capital + d["pnl_total_usd"], 4),
+                "pnl_hoy_usd":      round(d["pnl_por_dia"].get(datetime.now(ET).date().isoformat(), 0.0), 4),
+                "max_drawdown_usd": round(d["max_drawdown_usd"], 4),
+                "hold_promedio_h":  round(d["hold_total_seg"] / max(n, 1) / 3600, 2),
+                "sharpe_trade":     round(d["ret_media"] / std, 3) if std > 0 else 0.0,
+            }
 
-    positions = load_positions()
-
-    # Evitar duplicados
-    for p in positions:
-        if p["token_id"] == oportunidad["token_id"] and p["status"] == "OPEN":
-            log.info(f"Posición ya abierta para {oportunidad['equipo']}")
-            return p
-
-    precio_entrada = oportunidad["p_poly"] / 100
-    monto_usd      = round(CAPITAL_TOTAL * RIESGO_POR_TRADE, 2)  # $1.00
-
-    position = {
-        "id":             f"pos_{datetime.now(ET).strftime('%Y%m%d%H%M%S')}_{oportunidad['token_id'][:8]}",
-        "partido":        oportunidad["partido"],
-        "equipo":         oportunidad["equipo"],
-        "token_id":       oportunidad["token_id"],
-        "precio_entrada": round(precio_entrada, 4),
-        "precio_actual":  round(precio_entrada, 4),
-        "valor_real":     round(valor_real_decimal, 4),
-        "nea_entrada":    oportunidad["nea"],
-        "take_profit":    round(TAKE_PROFIT_PRECIO, 4),         # TP fijo: 0.42
-        "stop_loss":      round(precio_entrada * 0.50, 4),    # SL = 50% del precio de entrada
-        "monto_usd":      monto_usd,                          # $1.00 (1% de $100)
-        "hora_partido":   oportunidad["hora"],
-        "status":         "OPEN",
-        "opened_at":      datetime.now(ET).isoformat(),
-        "closed_at":      None,
-        "close_reason":   None,
-        "pnl_usd":        0.0,
-        "pnl_pct":        0.0,
-        "price_history":  [
-            {"ts": datetime.now(ET).isoformat(), "price": precio_entrada}
-        ],
-    }
+    def pnl_total(self) -> float:
+        with self._lock:
+            self._refrescar()
+            return self.d["pnl_total_usd"]
 
-    positions.append(position)
-    save_positions(positions)
-    log.info(
-        f"✅ POSICIÓN ABIERTA: {position['equipo']} | "
-        f"Entrada: {precio_entrada:.2%} | "
-        f"TP: {TAKE_PROFIT_PRECIO:.2%} | "
-        f"SL (−50%): {precio_entrada * 0.50:.2%} | "
-        f"Monto: ${monto_usd}"
-    )
-    return position
+    def recientes(self) -> list[dict]:
+        with self._lock:
+            self._refrescar()
+            return list(self.d["recientes"])
 
+    def por_equipo(self) -> dict:
+        with self._lock:
+            self._refrescar()
+            return {k: dict(v) for k, v in self.d["por_equipo"].items()}
 
-def actualizar_posiciones():
-    """
-    Actualiza precios de posiciones abiertas y ejecuta:
-      - Take Profit: precio_actual >= 0.42 (TAKE_PROFIT_PRECIO)
-      - Stop Loss:   precio_actual >= valor_real (el mercado reconoció el valor → salís)
-    """
-    positions = load_positions()
-    abiertas = [p for p in positions if p["status"] == "OPEN"]
+    def pnl_por_dia(self) -> dict:
+        with self._lock:
+            self._refrescar()
+            return dict(self.d["pnl_por_dia"])
 
-    if not abiertas:
-        log.info("Sin posiciones abiertas para monitorear.")
-        return
+    # ── Reconstrucción ───────────────────────────────────────────────────────
+    def reconstruir(self, abiertas: list[Position]):
+        """Recalcula todo desde el archivo de cerradas + las abiertas actuales."""
+        cerradas = sorted(iter_archivo_posiciones(archive_dir=self.archive_dir), key=lambda p: p.closed_at or p.opened_at)
+        with self._lock, _bloqueo_entre_procesos(self.path):
+            self.d = self._vacio()
+            for pos in cerradas:
+                self.d["total_opened"] += 1
+                self._acumular_cierre(pos)
+            self.d["total_opened"] += len(abiertas)
+            self._guardar()
+        log.info(f"📊 Estadísticas reconstruidas: {len(cerradas)} cerradas, {len(abiertas)} abiertas")
 
-    token_ids = [p["token_id"] for p in abiertas]
-    precios = obtener_precios_paralelo(token_ids)
 
-    modificado = False
-    for pos in positions:
-        if pos["status"] != "OPEN":
-            continue
+ESTADISTICAS = EstadisticasPortafolio.cargar(AGGREGATES_FILE)
 
-        precio_actual = precios.get(pos["token_id"])
-        if precio_actual is None:
-            log.warning(f"Sin precio para token {pos['token_id']}")
-            continue
 
-        pos["precio_actual"] = round(precio_actual, 4)
+# ══════════════════════════════════════════════════════════════════════════════
+# CONSULTAS — índices en memoria sobre posiciones y scans
+# ══════════════════════════════════════════════════════════════════════════════
+# Cada IndiceRegistros guarda registros planos (dicts) por id y un índice
+# invertido campo → valor → ids. Los filtros de igualdad intersectan los
+# conjuntos más chicos primero; rangos y orden se aplican sobre el resultado.
+# La paginación es por cursor (clave de orden del último ítem), estable ante
+# inserciones entre páginas.
 
-        # PnL en % y en USD
-        pnl_pct = (precio_actual - pos["precio_entrada"]) / pos["precio_entrada"] * 100
-        pnl_usd = pos.get("monto_usd", 1.0) * (precio_actual - pos["precio_entrada"]) / pos["precio_entrada"]
-        pos["pnl_pct"] = round(pnl_pct, 2)
-        pos["pnl_usd"] = round(pnl_usd, 4)
+CONSULTA_LIMITE     = 50
+CONSULTA_LIMITE_MAX = 500
 
-        # Historial de precios (máx 48 puntos)
-        pos.setdefault("price_history", []).append({
-            "ts":    datetime.now(ET).isoformat(),
-            "price": precio_actual,
-        })
-        pos["price_history"] = pos["price_history"][-48:]
 
-        modificado = True
+def _clave_mercado(mercado: str | None) -> str:
+    """'💰 Moneyline' → 'moneyline', '🎯 Total O/U' → 'total'."""
+    partes = (mercado or MONEYLINE).split()
+    return (partes[1] if len(partes) > 1 else partes[0]).lower()
 
-        # ── Take Profit: precio sube hasta 0.42 ──────────────────────────────
-        if precio_actual >= pos["take_profit"]:
-            pos["status"]       = "CLOSED"
-            pos["closed_at"]    = datetime.now(ET).isoformat()
-            pos["close_reason"] = "TAKE_PROFIT"
-            log.info(
-                f"🎯 TAKE PROFIT: {pos['equipo']} | "
-                f"{pos['precio_entrada']:.2%} → {precio_actual:.2%} | "
-                f"PnL: {pos['pnl_pct']:+.2f}% (${pos['pnl_usd']:+.4f})"
-            )
 
-        # ── Stop Loss: precio cae al 50% del precio de entrada ──────────────
-        elif precio_actual <= pos["stop_loss"]:
-            pos["status"]       = "CLOSED"
-            pos["closed_at"]    = datetime.now(ET).isoformat()
-            pos["close_reason"] = "STOP_LOSS"
-            log.info(
-                f"🛑 STOP LOSS (−50% entrada): {pos['equipo']} | "
-                f"{pos['precio_entrada']:.2%} → {precio_actual:.2%} | "
-                f"PnL: {pos['pnl_pct']:+.2f}% (${pos['pnl_usd']:+.4f})"
-            )
+def _cursor_codificar(clave: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(clave).encode()).decode().rstrip("=")
 
-    if modificado:
-        save_positions(positions)
 
+def _cursor_decodificar(cursor: str) -> tuple:
+    """(es_nulo, valor, id): la clave de orden de IndiceRegistros.consultar."""
+    try:
+        clave = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("cursor inválido")
+    if not (isinstance(clave, list) and len(clave) == 3 and isinstance(clave[0], bool)
+            and isinstance(clave[1], (str, int, float)) and not isinstance(clave[1], bool)
+            and isinstance(clave[2], str)):
+        raise ValueError("cursor inválido")
+    return tuple(clave)
 
-# ══════════════════════════════════════════════════════════════════════════════
-# MÓDULO 6 — SCHEDULER
-# ══════════════════════════════════════════════════════════════════════════════
 
-def ciclo_scan_y_posiciones():
-    """Ejecuta scan + abre posiciones para oportunidades COMPRAR."""
-    oportunidades = ejecutar_scan()
+def _float_filtro(filtros: dict, nombre: str) -> float | None:
+    valor = filtros.get(nombre)
+    if valor in (None, ""):
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        raise ValueError(f"{nombre} debe ser numérico")
+
+
+class IndiceRegistros:
+    def __init__(self, claves, campo_id: str = "id"):
+        self._claves   = claves             # registro → {campo: valor indexado}
+        self.campo_id  = campo_id
+        self.registros = {}
+        self.indices   = {}
+        self._lock     = threading.Lock()
+
+    def __len__(self):
+        return len(self.registros)
+
+    def upsert(self, registro: dict):
+        rid = registro[self.campo_id]
+        with self._lock:
+            anterior = self.registros.get(rid)
+            if anterior is not None:
+                for campo, valor in self._claves(anterior).items():
+                    self.indices.get(campo, {}).get(valor, set()).discard(rid)
+            self.registros[rid] = registro
+            for campo, valor in self._claves(registro).items():
+                self.indices.setdefault(campo, {}).setdefault(valor, set()).add(rid)
+
+    def consultar(self, iguales: dict, predicados: list, orden: str, desc: bool,
+                  cursor: str | None, limite: int) -> dict:
+        with self._lock:
+            conjuntos = sorted((self.indices.get(c, {}).get(v, set()) for c, v in iguales.items()), key=len)
+            if conjuntos:
+                ids = set(conjuntos[0])
+                for otro in conjuntos[1:]:
+                    ids &= otro
+                candidatos = [self.registros[i] for i in ids]
+            else:
+                candidatos = list(self.registros.values())
+        items = [r for r in candidatos if all(p(r) for p in predicados)]
+
+        def clave(r):
+            v = r.get(orden)
+            return ((v is None) != desc, v if v is not None else "", str(r[self.campo_id]))
+
+        items.sort(key=clave, reverse=desc)
+        total = len(items)
+        if cursor:
+            desde = _cursor_decodificar(cursor)
+            try:
+                items = [r for r in items if (clave(r) < desde if desc else clave(r) > desde)]
+            except TypeError:
+                # cursor bien formado pero de otro orden (p. ej. texto contra número)
+                raise ValueError("cursor inválido")
+        pagina = items[:limite]
+        return {
+            "items":       pagina,
+            "total":       total,
+            "next_cursor": _cursor_codificar(clave(pagina[-1])) if len(items) > limite else None,
+        }
+
+
+def _parse_consulta(filtros: dict, ordenes: tuple[str, ...], defecto: str) -> tuple[str, bool, str | None, int]:
+    orden = filtros.get("sort") or defecto
+    desc  = orden.startswith("-")
+    orden = orden.lstrip("-")
+    if orden not in ordenes:
+        raise ValueError(f"sort debe ser uno de: {', '.join(ordenes)}")
+    try:
+        limite = int(filtros.get("limit") or CONSULTA_LIMITE)
+    except ValueError:
+        raise ValueError("limit debe ser entero")
+    return orden, desc, filtros.get("cursor") or None, min(max(limite, 1), CONSULTA_LIMITE_MAX)
 
-    for op in oportunidades:
-        if op["accion"] == "COMPRAR":
-            abrir_posicion(op)
 
-    state = load_state()
-    state["last_scan"]        = datetime.now(ET).isoformat()
-    state["manual_triggered"] = False
-    save_state(state)
+def _predicados_rango(filtros: dict, campo_fecha: str, campo_nea: str) -> list:
+    predicados = []
+    if filtros.get("desde"):
+        predicados.append(lambda r, d=filtros["desde"]: (r.get(campo_fecha) or "")[:10] >= d)
+    if filtros.get("hasta"):
+        predicados.append(lambda r, h=filtros["hasta"]: (r.get(campo_fecha) or "")[:10] <= h)
+    nea_min, nea_max = _float_filtro(filtros, "nea_min"), _float_filtro(filtros, "nea_max")
+    if nea_min is not None:
+        predicados.append(lambda r: r.get(campo_nea, 0) >= nea_min)
+    if nea_max is not None:
+        predicados.append(lambda r: r.get(campo_nea, 0) <= nea_max)
+    return predicados
 
 
-def ciclo_monitoreo():
-    """Actualiza precios de posiciones abiertas."""
-    log.info("📡 Actualizando precios de posiciones abiertas...")
-    actualizar_posiciones()
+# ── Posiciones ───────────────────────────────────────────────────────────────
 
+ORDEN_POSICIONES = ("opened_at", "closed_at", "pnl_usd", "pnl_pct", "nea_entrada", "monto_usd")
 
-def _thread_scheduler():
-    """Hilo scheduler: scan a las 9AM ET, monitoreo cada MONITOR_INTERVAL segundos."""
-    import time
 
-    last_scan_date = None
+def _claves_posicion(r: dict) -> dict:
+    return {
+        "status":       r["status"],
+        "close_reason": r.get("close_reason"),
+        "equipo":       (equipo_base(r["equipo"], r.get("mercado", MONEYLINE)) or "").lower(),
+        "partido":      r["partido"].lower(),
+        "liga":         r.get("liga", "nba"),
+        "mercado":      _clave_mercado(r.get("mercado")),
+    }
 
-    while True:
-        now_et = datetime.now(ET)
-        state  = load_state()
 
-        # Verificar si se solicitó scan manual
-        if state.get("manual_triggered"):
-            log.info("🖐 Scan manual solicitado")
-            ciclo_scan_y_posiciones()
-            last_scan_date = now_et.date()
+def registro_posicion(pos: Position) -> dict:
+    """Registro plano para el índice (sin price_history)."""
+    d = pos.to_dict()
+    d.pop("price_history", None)
+    return d
 
-        # Scan automático a las 9:00 AM ET
-        elif now_et.hour == 9 and now_et.minute < 2:
-            if last_scan_date != now_et.date():
-                log.info("⏰ Scan automático 9AM ET")
-                ciclo_scan_y_posiciones()
-                last_scan_date = now_et.date()
 
-        # Monitoreo de posiciones cada MONITOR_INTERVAL
-        ciclo_monitoreo()
+def nuevo_indice_posiciones(positions) -> IndiceRegistros:
+    indice = IndiceRegistros(_claves_posicion)
+    for pos in positions:
+        indice.upsert(registro_posicion(pos))
+    return indice
 
-        time.sleep(MONITOR_INTERVAL)
 
+def consultar_indice_posiciones(indice: IndiceRegistros, filtros: dict) -> dict:
+    """
+    Filtros (strings, como vienen de la query): status, close_reason, equipo,
+    partido, liga, mercado (moneyline/spread/total), desde/hasta (YYYY-MM-DD
+    sobre opened_at), nea_min/nea_max (nea_entrada), sort (campo o -campo),
+    limit, cursor.
+    """
+    orden, desc, cursor, limite = _parse_consulta(filtros, ORDEN_POSICIONES, "-opened_at")
+    iguales = {}
+    for campo, norm in (("status", str.upper), ("close_reason", str.upper), ("equipo", str.lower),
+                        ("partido", str.lower), ("liga", str.lower), ("mercado", str.lower)):
+        if filtros.get(campo):
+            iguales[campo] = norm(filtros[campo])
+    return indice.consultar(iguales, _predicados_rango(filtros, "opened_at", "nea_entrada"),
+                            orden, desc, cursor, limite)
 
-def iniciar_scheduler():
-    t = threading.Thread(target=_thread_scheduler, daemon=True)
-    t.start()
-    log.info(f"🚀 Scheduler iniciado | Scan: 9AM ET | Monitoreo: cada {MONITOR_INTERVAL}s")
 
+# ── Scans ────────────────────────────────────────────────────────────────────
 
-# ══════════════════════════════════════════════════════════════════════════════
-# API para el dashboard
-# ══════════════════════════════════════════════════════════════════════════════
+ORDEN_SCANS = ("scan_ts", "nea", "p_poly", "valor_real")
 
-def trigger_manual_scan():
-    """Llama desde el dashboard para forzar un scan."""
-    state = load_state()
-    state["manual_triggered"] = True
-    save_state(state)
-    log.info("🖐 Scan manual marcado en estado")
 
+def _claves_resultado(r: dict) -> dict:
+    return {
+        "accion":  r["accion"],
+        "equipo":  (equipo_base(r["equipo"], r.get("mercado", MONEYLINE)) or "").lower(),
+        "partido": r["partido"].lower(),
+        "liga":    r.get("liga", "nba"),
+        "mercado": _clave_mercado(r.get("mercado")),
+    }
 
-def get_dashboard_data() -> dict:
-    positions = load_positions()
-    scan_log  = load_scan_log()
-    state     = load_state()
 
-    abiertas = [p for p in positions if p["status"] == "OPEN"]
-    cerradas  = [p for p in positions if p["status"] == "CLOSED"]
+def agregar_a_indice_scans(indice: IndiceRegistros, scan: ScanEntry):
+    for op in scan.resultados:
+        indice.upsert({**op.to_dict(), "scan_ts": scan.ts, "id": f"{scan.ts}|{op.token_id}"})
 
-    tp_count  = sum(1 for p in cerradas if p.get("close_reason") == "TAKE_PROFIT")
-    sl_count  = sum(1 for p in cerradas if p.get("close_reason") == "STOP_LOSS")
 
-    # PnL total en USD
-    pnl_total_usd = sum(p.get("pnl_usd", 0) for p in cerradas)
-    capital_actual = round(CAPITAL_TOTAL + pnl_total_usd, 4)
+def nuevo_indice_scans(scans) -> IndiceRegistros:
+    indice = IndiceRegistros(_claves_resultado)
+    for scan in scans:
+        agregar_a_indice_scans(indice, scan)
+    return indice
 
-    last_scan_ops = []
-    if scan_log:
-        last_scan_ops = scan_log[-1].get("resultados", [])
 
-    return {
-        "ts":               datetime.now(ET).isoformat(),
-        "last_scan":        state.get("last_scan"),
-        "positions_open":   abiertas,
-        "positions_closed": cerradas[-20:],
-        "stats": {
-            "total_open":    len(abiertas),
-            "total_closed":  len(cerradas),
-            "take_profits":  tp_count,
-            "stop_losses":   sl_count,
-            "win_rate":      round(tp_count / max(len(cerradas), 1) * 100, 1),
-            "pnl_total_usd": round(pnl_total_usd, 4),
-            "capital_actual": capital_actual,
-        },
+_indice_scans = {"indice": None}     # historial completo; se construye una vez y se mantiene al escribir
+_indice_scans_lock = threading.Lock()
+
+
+def consultar_indice_scans(indice: IndiceRegistros, filtros: dict) -> dict:
+    """
+    Resultados de scans. Filtros: accion, equipo, partido, liga, mercado,
+    desde/hasta (fecha del scan), nea_min/nea_max, sort, limit, cursor.
+    """
+    orden, desc, cursor, limite = _parse_consulta(filtros, ORDEN_SCANS, "-scan_ts")
+    iguales = {}
+    for campo, norm in (("accion", str.upper), ("equipo", str.lower), ("partido", str.lower),
+                        ("liga", str.lower), ("mercado", str.lower)):
+        if filtros.get(campo):
+            iguales[campo] = norm(filtros[campo])
+    return indice.consultar(iguales, _predicados_rango(filtros, "scan_ts", "nea"),
+                            orden, desc, cursor, limite)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# LIGAS
+# ══════════════════════════════════════════════════════════════════════════════
+# Registro de ligas escaneables. Cada liga define sus IDs de Gamma, el
+# clasificador de mercados, el prompt de análisis y sus umbrales. Las ligas
+# sin series_id configurado no se escanean.
+
+_EXCLUIR_BASKET = (
+    "points o/u", "rebounds o/u", "assists o/u", "steals o/u",
+    "blocks o/u", "turnovers o/u", "3-pointer", "field goal", "free throw",
+    "first quarter", "second quarter", "third quarter", "fourth quarter",
+    "first half", "second half", "halftime", "triple double", "double double",
+    "will there be", "lead at any", "margin of victory", "largest lead",
+)
+
+_EXCLUIR_HOCKEY = (
+    "goals o/u", "shots o/u", "saves o/u", "points o/u", "assists o/u",
+    "first period", "second period", "third period", "1st period", "2nd period",
+    "3rd period", "overtime", "shootout", "will there be", "first goal",
+    "margin of victory",
+)
+
+_PROMPT_ANALISIS = """Eres un analista experto de apuestas deportivas {deporte}.
+Necesito que analices el partido de HOY: {visitante} (visitante) @ {local} (local).
+
+Usando búsqueda web, responde EXACTAMENTE en este formato JSON (sin markdown):
+
+{{
+  "p_vegas": <número 0-100, probabilidad implícita del equipo LOCAL según casas de apuestas hoy>,
+  "n_local": <número -100 a 100, factor noticias equipo local>,
+  "n_visitante": <número -100 a 100, factor noticias equipo visitante>,
+  "r_local": <número 0-100, racha equipo local últimos 5 partidos>,
+  "r_visitante": <número 0-100, racha equipo visitante últimos 5 partidos>,
+  "total_proyectado": <número, total de {unidad} esperado del partido según la línea O/U de las casas hoy>,
+  "resumen": "<2 oraciones: estado actual, lesiones importantes y contexto>"
+}}
+
+Busca: odds actuales DraftKings/FanDuel, lesiones confirmadas, últimos 5 resultados de cada equipo.
+Responde SOLO el JSON."""
+
+_PROMPT_SLATE = """Eres un analista experto de apuestas deportivas {deporte}.
+Necesito que analices TODOS estos partidos de HOY (visitante @ local):
+
+{partidos}
+
+Usando búsqueda web, responde EXACTAMENTE con un array JSON (sin markdown), un objeto por partido:
+
+[
+  {{
+    "partido": "<copia exacta de la línea 'visitante @ local' de la lista>",
+    "p_vegas": <número 0-100, probabilidad implícita del equipo LOCAL según casas de apuestas hoy>,
+    "n_local": <número -100 a 100, factor noticias equipo local>,
+    "n_visitante": <número -100 a 100, factor noticias equipo visitante>,
+    "r_local": <número 0-100, racha equipo local últimos 5 partidos>,
+    "r_visitante": <número 0-100, racha equipo visitante últimos 5 partidos>,
+    "total_proyectado": <número, total de {unidad} esperado del partido según la línea O/U de las casas hoy>,
+    "resumen": "<2 oraciones: estado actual, lesiones importantes y contexto>"
+  }}
+]
+
+Busca: odds actuales DraftKings/FanDuel, lesiones confirmadas, últimos 5 resultados de cada equipo.
+Responde SOLO el array JSON."""
+
+
+def _env_opt_int(nombre: str, defecto: int | None = None) -> int | None:
+    valor = os.environ.get(nombre)
+    return int(valor) if valor else defecto
+
+
+@dataclass(slots=True)
+class Liga:
+    clave:             str
+    nombre:            str
+    deporte:           str
+    series_id:         int | None
+    tag_id:            int = 100639
+    excluir:           tuple[str, ...] = _EXCLUIR_BASKET
+    nea_umbral:        float = NEA_UMBRAL
+    valor_real_minimo: float = VALOR_REAL_MINIMO
+    ventaja_local:     float = 5.0      # factor v de la fórmula NEA
+    sigma_margen:      float = 12.0     # desviación del margen final (spreads)
+    sigma_total:       float = 18.0     # desviación del total final (O/U)
+    unidad:            str = "puntos"
+    prompt:            str = _PROMPT_ANALISIS
+    prompt_slate:      str = _PROMPT_SLATE
+
+    def clasificar_mercado(self, pregunta: str) -> str | None:
+        p, pl = pregunta.strip(), pregunta.lower()
+        if any(ex in pl for ex in self.excluir): return None
+        if p.startswith("Spread:"):         return SPREAD
+        if ": O/U" in p:                    return TOTAL
+        if "vs." in pl and ":" not in p:    return MONEYLINE
+        return None
+
+    def extraer_equipos(self, titulo: str) -> tuple[str, str]:
+        partes = titulo.split(" vs. ")
+        if len(partes) == 2:
+            return partes[0].strip(), partes[1].strip()
+        return titulo, titulo
+
+    def prompt_analisis(self, equipo_local: str, equipo_visitante: str) -> str:
+        return self.prompt.format(deporte=self.deporte, local=equipo_local,
+                                  visitante=equipo_visitante, unidad=self.unidad)
+
+    def prompt_analisis_slate(self, partidos: list[str]) -> str:
+        return self.prompt_slate.format(deporte=self.deporte, unidad=self.unidad,
+                                        partidos="\n".join(f"- {p}" for p in partidos))
+
+
+def _liga_env(clave: str, **kwargs) -> Liga:
+    """Construye una liga leyendo overrides <CLAVE>_NEA_UMBRAL / <CLAVE>_VALOR_REAL_MINIMO."""
+    prefijo = clave.upper()
+    return Liga(
+        clave=clave,
+        nea_umbral=float(os.environ.get(f"{prefijo}_NEA_UMBRAL", NEA_UMBRAL)),
+        valor_real_minimo=float(os.environ.get(f"{prefijo}_VALOR_REAL_MINIMO", VALOR_REAL_MINIMO)),
+        **kwargs,
+    )
+
+
+LIGAS: dict[str, Liga] = {
+    "nba":   _liga_env("nba", nombre="NBA", deporte="NBA", series_id=NBA_SERIES_ID),
+    "wnba":  _liga_env("wnba", nombre="WNBA", deporte="WNBA",
+                       series_id=_env_opt_int("WNBA_SERIES_ID"),
+                       sigma_margen=11.0, sigma_total=15.0),
+    "ncaab": _liga_env("ncaab", nombre="NCAAB", deporte="baloncesto universitario NCAA",
+                       series_id=_env_opt_int("NCAAB_SERIES_ID"), ventaja_local=7.0,
+                       sigma_margen=11.0, sigma_total=16.0),
+    "nhl":   _liga_env("nhl", nombre="NHL", deporte="NHL (hockey)",
+                       series_id=_env_opt_int("NHL_SERIES_ID"),
+                       excluir=_EXCLUIR_HOCKEY, ventaja_local=3.0,
+                       sigma_margen=2.2, sigma_total=2.0, unidad="goles"),
+}
+
+
+def ligas_activas() -> list[Liga]:
+    activas = []
+    for clave in LIGAS_ACTIVAS:
+        liga = LIGAS.get(clave)
+        if liga is None:
+            log.warning(f"Liga desconocida en LIGAS_ACTIVAS: {clave}")
+        elif liga.series_id is None:
+            log.warning(f"Liga {liga.nombre} sin series_id ({clave.upper()}_SERIES_ID), se omite")
+        else:
+            activas.append(liga)
+    return activas
+
+
+def liga_de(clave: str) -> Liga:
+    return LIGAS.get(clave, LIGAS["nba"])
+
+
+# ── Caches compartidos entre ligas ────────────────────────────────────────────
+
+class CacheTTL:
+    """Dict thread-safe cuyas entradas expiran tras `ttl` segundos."""
+
+    def __init__(self, ttl: float):
+        self.ttl   = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            valor, ts = item
+            if time.monotonic() - ts > self.ttl:
+                del self._data[key]
+                return None
+            return valor
+
+    def set(self, key, valor):
+        with self._lock:
+            self._data[key] = (valor, time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+CACHE_PRECIOS  = CacheTTL(PRECIO_CACHE_TTL)
+CACHE_ANALISIS = CacheTTL(24 * 3600)     # clave incluye la fecha ET del partido
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MÓDULO 1 — POLYMARKET
+# ══════════════════════════════════════════════════════════════════════════════
+
+def inicio_evento(evento: dict) -> datetime | None:
+    """Hora de inicio del evento en ET (startTime, o eventDate a mediodía ET)."""
+    st = evento.get("startTime")
+    if st:
+        try:
+            return datetime.fromisoformat(st.replace("Z", "+00:00")).astimezone(ET)
+        except ValueError:
+            pass
+    fecha = evento.get("eventDate")
+    if fecha:
+        try:
+            return datetime.fromisoformat(fecha).replace(hour=12, tzinfo=ET)
+        except ValueError:
+            pass
+    return None
+
+
+class DescubridorEventos:
+    """
+    Descubre eventos de Gamma paginando en paralelo y filtrando por una
+    ventana horaria en ET. Cada página se cachea GAMMA_CACHE_TTL segundos y
+    después se revalida con If-None-Match / If-Modified-Since, así que los
+    scans repetidos solo descargan lo que cambió.
+    """
+
+    def __init__(self, paralelo: int = 4):
+        self.paralelo = paralelo
+        self._paginas = {}
+        self._lock    = threading.Lock()
+        self.stats    = {"requests": 0, "no_modificadas": 0, "cache": 0}
+
+    def _contar(self, clave: str):
+        with self._lock:
+            self.stats[clave] += 1
+
+    def _pagina(self, liga: Liga, offset: int) -> list[dict]:
+        clave = (liga.series_id, liga.tag_id, offset, GAMMA_PAGINA)
+        with self._lock:
+            entrada = self._paginas.get(clave)
+        if entrada and time.monotonic() - entrada["ts"] < GAMMA_CACHE_TTL:
+            self._contar("cache")
+            return entrada["data"]
+
+        headers = {}
+        if entrada and entrada.get("etag"):
+            headers["If-None-Match"] = entrada["etag"]
+        if entrada and entrada.get("last_modified"):
+            headers["If-Modified-Since"] = entrada["last_modified"]
+
+        self._contar("requests")
+        resp = SESSION.get(
+            f"{GAMMA_API}/events",
+            params={
+                "series_id": liga.series_id, "tag_id": liga.tag_id,
+                "active": "true", "closed": "false",
+                "limit": GAMMA_PAGINA, "offset": offset,
+                "order": "startTime", "ascending": "true",
+            }, headers=headers, timeout=15
+        )
+        if resp.status_code == 304 and entrada:
+            self._contar("no_modificadas")
+            with self._lock:
+                entrada["ts"] = time.monotonic()
+            return entrada["data"]
+        resp.raise_for_status()
+        data = resp.json()
+        with self._lock:
+            self._paginas[clave] = {
+                "data":          data,
+                "etag":          resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "ts":            time.monotonic(),
+            }
+        return data
+
+    def eventos(self, liga: Liga, desde: datetime | None = None,
+                hasta: datetime | None = None) -> list[dict]:
+        ahora = datetime.now(ET)
+        desde = desde or ahora - timedelta(hours=VENTANA_ATRAS_HORAS)
+        hasta = hasta or ahora + timedelta(hours=VENTANA_HORAS)
+
+        encontrados = {}
+        offset, limite = 0, GAMMA_MAX_PAGINAS * GAMMA_PAGINA
+        with ThreadPoolExecutor(max_workers=self.paralelo) as pool:
+            while offset < limite:
+                offsets = [o for o in range(offset, offset + self.paralelo * GAMMA_PAGINA, GAMMA_PAGINA)
+                           if o < limite]
+                fin = False
+                for pagina in pool.map(lambda o: self._pagina(liga, o), offsets):
+                    for e in pagina:
+                        inicio = inicio_evento(e)
+                        if inicio and desde <= inicio <= hasta:
+                            encontrados[e.get("id") or e.get("slug") or e.get("title")] = e
+                    # Orden ascendente por startTime: página corta o pasada la ventana → fin
+                    ultimo = inicio_evento(pagina[-1]) if pagina else None
+                    if len(pagina) < GAMMA_PAGINA or (ultimo and ultimo > hasta):
+                        fin = True
+                        break
+                if fin:
+                    break
+                offset += self.paralelo * GAMMA_PAGINA
+
+        return sorted(encontrados.values(), key=lambda e: inicio_evento(e))
+
+
+DESCUBRIDOR = DescubridorEventos()
+
+
+def obtener_partidos_hoy(liga: Liga | None = None) -> list[dict]:
+    """Eventos de la liga dentro de la ventana ET [−VENTANA_ATRAS_HORAS, +VENTANA_HORAS]."""
+    return DESCUBRIDOR.eventos(liga or LIGAS["nba"])
+
+
+def clasificar_mercado(pregunta: str, liga: Liga | None = None) -> str | None:
+    return (liga or LIGAS["nba"]).clasificar_mercado(pregunta)
+
+
+def extraer_token_ids(m: dict) -> list[str]:
+    raw = m.get("clobTokenIds", "[]")
+    try:   return [str(i) for i in (json.loads(raw) if isinstance(raw, str) else raw)]
+    except: return []
+
+
+def extraer_outcomes(m: dict) -> list[str]:
+    raw = m.get("outcomes", "[]")
+    try:   return json.loads(raw) if isinstance(raw, str) else raw
+    except: return []
+
+
+def precio_clob(token_id: str) -> tuple[str, float | None]:
+    try:
+        r = SESSION.get(f"{CLOB_API}/midpoint",
+                        params={"token_id": token_id}, timeout=8)
+        r.raise_for_status()
+        mid = r.json().get("mid")
+        return token_id, float(mid) if mid is not None else None
+    except Exception:
+        return token_id, None
+
+
+def obtener_precios_paralelo(token_ids: list[str], usar_cache: bool = False) -> dict[str, float]:
+    """
+    Precios midpoint en paralelo. Con usar_cache=True reutiliza precios de
+    CACHE_PRECIOS (TTL PRECIO_CACHE_TTL) y solo pide los que faltan.
+    """
+    resultado = {}
+    pendientes = []
+    for tid in token_ids:
+        cacheado = CACHE_PRECIOS.get(tid) if usar_cache else None
+        if cacheado is not None:
+            resultado[tid] = cacheado
+        else:
+            pendientes.append(tid)
+
+    if pendientes:
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            futuros = {pool.submit(precio_clob, tid): tid for tid in pendientes}
+            for f in as_completed(futuros):
+                tid, precio = f.result()
+                if precio is not None:
+                    resultado[tid] = precio
+                    CACHE_PRECIOS.set(tid, precio)
+    return resultado
+
+
+def construir_estructura(partidos: list[dict], liga: Liga | None = None,
+                         stats: dict | None = None) -> list[dict]:
+    """
+    Elige, por partido, el mercado de mayor volumen de cada tipo. Con
+    LIQ_FILTRO se descartan antes los mercados cuyo libro no cumple
+    LIQ_MAX_SPREAD / LIQ_MIN_PROFUNDIDAD (snapshot bulk de todos los tokens).
+    """
+    liga = liga or LIGAS["nba"]
+    estructura = []
+    libros = None
+    if LIQ_FILTRO:
+        tokens = [tid for ev in partidos for m in ev.get("markets", [])
+                  if liga.clasificar_mercado(m.get("question", "")) for tid in extraer_token_ids(m)]
+        libros = EJECUCION.snapshot(tokens)
+    liq = {"libros": len(libros or {}), "iliquidos": 0, "sin_libro": 0}
+
+    for evento in partidos:
+        candidatos = []
+        for m in evento.get("markets", []):
+            tipo = liga.clasificar_mercado(m.get("question", ""))
+            if not tipo: continue
+            token_ids = extraer_token_ids(m)
+            if not token_ids: continue
+            if libros is not None:
+                if not any(t in libros for t in token_ids):
+                    liq["sin_libro"] += 1
+                else:
+                    motivo = next((libros[t].motivo_iliquido() for t in token_ids
+                                   if t in libros and libros[t].motivo_iliquido()), None)
+                    if motivo:
+                        liq["iliquidos"] += 1
+                        log.debug(f"[{liga.nombre}] Mercado ilíquido ({motivo}): {m.get('question', '')}")
+                        continue
+            candidatos.append({
+                "tipo":      tipo,
+                "pregunta":  m.get("question", ""),
+                "volumen":   float(m.get("volume", 0) or 0),
+                "token_ids": token_ids,
+                "outcomes":  extraer_outcomes(m),
+            })
+        seleccionados = {}
+        for c in sorted(candidatos, key=lambda x: x["volumen"], reverse=True):
+            if c["tipo"] not in seleccionados:
+                seleccionados[c["tipo"]] = c
+            if len(seleccionados) == 3: break
+        estructura.append({"evento": evento, "mercados": seleccionados})
+    if stats is not None and libros is not None:
+        stats["liquidez"] = liq
+    return estructura
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MÓDULO 2 — GEMINI
+# ══════════════════════════════════════════════════════════════════════════════
+
+# ── Contabilidad de llamadas ──────────────────────────────────────────────────
+# Cada llamada a Gemini deja un LlamadaLLM (TTFT, latencia, tokens de
+# usage_metadata, búsquedas de grounding, error). CONTABILIDAD_LLM los agrega
+# por día ET en llm_usage.json y acumula totales en memoria, de los que cada
+# scan toma la diferencia. Con el presupuesto diario agotado no se llama a
+# Gemini: se reutiliza el análisis del último slate o se cae a _valores_defecto.
+
+@dataclass(slots=True)
+class LlamadaLLM:
+    tipo:             str                 # "partido" | "slate"
+    modelo:           str
+    ttft:             float | None = None # segundos hasta el primer chunk con texto
+    latencia:         float = 0.0
+    tokens_prompt:    int = 0
+    tokens_respuesta: int = 0
+    tokens_total:     int = 0
+    busquedas:        int = 0
+    error:            str | None = None
+
+    def uso(self) -> dict:
+        return {"tokens_prompt": self.tokens_prompt, "tokens_respuesta": self.tokens_respuesta,
+                "tokens_total": self.tokens_total, "busquedas": self.busquedas}
+
+
+_CAMPOS_LLM = ("llamadas", "fallos", "fallbacks", "degradados", "tokens_prompt",
+               "tokens_respuesta", "tokens_total", "busquedas", "latencia_seg", "ttft_seg")
+
+
+class ContabilidadLLM:
+    def __init__(self, path: str):
+        self.path    = path
+        self._lock   = threading.Lock()
+        self._dias   = None                  # {dia: agregados}, se carga al primer uso
+        self.totales = dict.fromkeys(_CAMPOS_LLM, 0)
+        self.motivos: dict[str, int] = {}
+
+    def _hoy(self) -> dict:
+        if self._dias is None:
+            self._dias = load_json(self.path, {})
+        dia = datetime.now(ET).date().isoformat()
+        return self._dias.setdefault(dia, {**dict.fromkeys(_CAMPOS_LLM, 0), "latencia_max_seg": 0.0,
+                                           "por_motivo": {}, "por_tipo": {}})
+
+    def _sumar(self, **valores):
+        hoy = self._hoy()
+        for campo, valor in valores.items():
+            hoy[campo] += valor
+            self.totales[campo] += valor
+
+    def _guardar(self):
+        save_json(self.path, self._dias)
+
+    def registrar(self, llamada: LlamadaLLM):
+        with self._lock:
+            self._sumar(llamadas=1, fallos=int(llamada.error is not None),
+                        tokens_prompt=llamada.tokens_prompt, tokens_respuesta=llamada.tokens_respuesta,
+                        tokens_total=llamada.tokens_total, busquedas=llamada.busquedas,
+                        latencia_seg=llamada.latencia, ttft_seg=llamada.ttft or 0.0)
+            hoy = self._hoy()
+            hoy["latencia_max_seg"] = max(hoy["latencia_max_seg"], llamada.latencia)
+            hoy["por_tipo"][llamada.tipo] = hoy["por_tipo"].get(llamada.tipo, 0) + 1
+            self._guardar()
+
+    def fallback(self, motivo: str, degradado: bool = False):
+        """Análisis que no salió de una respuesta válida de Gemini (defecto o slate previo)."""
+        with self._lock:
+            self._sumar(**({"degradados": 1} if degradado else {"fallbacks": 1}))
+            por_motivo = self._hoy()["por_motivo"]
+            por_motivo[motivo] = por_motivo.get(motivo, 0) + 1
+            self.motivos[motivo] = self.motivos.get(motivo, 0) + 1
+            self._guardar()
+
+    def presupuesto_agotado(self) -> bool:
+        if not (GEMINI_PRESUPUESTO_LLAMADAS or GEMINI_PRESUPUESTO_TOKENS):
+            return False
+        with self._lock:
+            hoy = self._hoy()
+            return ((GEMINI_PRESUPUESTO_LLAMADAS and hoy["llamadas"] >= GEMINI_PRESUPUESTO_LLAMADAS)
+                    or (GEMINI_PRESUPUESTO_TOKENS and hoy["tokens_total"] >= GEMINI_PRESUPUESTO_TOKENS))
+
+    def marca(self) -> dict:
+        with self._lock:
+            return {**self.totales, "por_motivo": dict(self.motivos)}
+
+    def desde(self, marca: dict) -> dict:
+        """Diferencia respecto de una marca(): el consumo de un scan."""
+        actual = self.marca()
+        delta = {c: round(actual[c] - marca[c], 3) if isinstance(actual[c], float) else actual[c] - marca[c]
+                 for c in _CAMPOS_LLM}
+        delta["por_motivo"] = {m: n - marca["por_motivo"].get(m, 0)
+                               for m, n in actual["por_motivo"].items() if n != marca["por_motivo"].get(m, 0)}
+        return delta
+
+    def resumen(self, dias: int = 7) -> dict:
+        with self._lock:
+            self._hoy()
+            por_dia = {}
+            for dia in sorted(self._dias)[-dias:]:
+                d = self._dias[dia]
+                exitosas = d["llamadas"] - d["fallos"]
+                por_dia[dia] = {
+                    **{c: round(d[c], 3) if isinstance(d[c], float) else d[c] for c in _CAMPOS_LLM},
+                    "latencia_media_seg": round(d["latencia_seg"] / d["llamadas"], 3) if d["llamadas"] else None,
+                    "ttft_medio_seg":     round(d["ttft_seg"] / exitosas, 3) if exitosas > 0 else None,
+                    "latencia_max_seg":   round(d["latencia_max_seg"], 3),
+                    "por_motivo":         d["por_motivo"],
+                    "por_tipo":           d["por_tipo"],
+                }
+        hoy = por_dia[max(por_dia)]
+        return {
+            "hoy": hoy,
+            "presupuesto": {"llamadas": GEMINI_PRESUPUESTO_LLAMADAS or None,
+                            "tokens": GEMINI_PRESUPUESTO_TOKENS or None,
+                            "agotado": self.presupuesto_agotado()},
+            "por_dia": por_dia,
+        }
+
+
+CONTABILIDAD_LLM = ContabilidadLLM(LLM_USAGE_FILE)
+
+
+def _gemini_disponible() -> bool:
+    return bool(GEMINI_API_KEY) or reproduciendo()
+
+
+def _gemini_generar(prompt: str, esquema=None, tipo: str = "partido", modelo: str = GEMINI_MODEL,
+                    cancelar: threading.Event | None = None) -> str:
+    """
+    Llamada streaming a Gemini con búsqueda web; retorna el texto completo.
+    Con `esquema` (types.Schema) pide respuesta JSON estructurada. Con una
+    cassette activa el stream se graba o se reproduce desde archivo. Cada
+    llamada queda registrada en CONTABILIDAD_LLM. Si se activa `cancelar`, el
+    stream se corta en el siguiente chunk y se retorna lo recibido; la espera
+    de cada chunk y la llamada completa tienen tope GEMINI_TIMEOUT_SEG.
+    """
+    llamada = LlamadaLLM(tipo=tipo, modelo=modelo)
+    cassette = _cassette["activa"]
+    if cassette is not None:
+        chunks = cassette.stream_gemini(modelo, prompt, esquema,
+                                        lambda: _gemini_stream(prompt, esquema, llamada, modelo), llamada)
+    else:
+        chunks = _gemini_stream(prompt, esquema, llamada, modelo)
+
+    partes = []
+    t0 = time.perf_counter()
+    try:
+        for texto in chunks:
+            if cancelar is not None and cancelar.is_set():
+                chunks.close()
+                break
+            if time.perf_counter() - t0 > GEMINI_TIMEOUT_SEG:
+                chunks.close()
+                raise TimeoutError(f"Gemini ({modelo}) superó {GEMINI_TIMEOUT_SEG:.0f}s")
+            if llamada.ttft is None:
+                llamada.ttft = time.perf_counter() - t0
+            partes.append(texto)
+    except Exception as e:
+        llamada.error = str(e)
+        raise
+    finally:
+        llamada.latencia = time.perf_counter() - t0
+        CONTABILIDAD_LLM.registrar(llamada)
+    return "".join(partes)
+
+
+def _gemini_stream(prompt: str, esquema=None, llamada: LlamadaLLM | None = None,
+                   modelo: str = GEMINI_MODEL):
+    """Textos no vacíos de cada chunk del stream de Gemini; completa el uso en `llamada`."""
+    from google import genai
+    from google.genai import types
+
+    # El timeout del cliente también corta un stream sin chunks: una llamada
+    # cancelada por el router no retiene su hilo más que esto.
+    client = genai.Client(api_key=GEMINI_API_KEY,
+                          http_options=types.HttpOptions(timeout=int(GEMINI_TIMEOUT_SEG * 1000)))
+    config = types.GenerateContentConfig(
+        thinking_config=types.ThinkingConfig(thinking_budget=0),
+        tools=[types.Tool(googleSearch=types.GoogleSearch())] if GEMINI_BUSQUEDA else None,
+    )
+    if esquema is not None:
+        config.response_mime_type = "application/json"
+        config.response_schema    = esquema
+
+    for chunk in client.models.generate_content_stream(
+        model=modelo,
+        contents=[types.Content(role="user", parts=[types.Part.from_text(text=prompt)])],
+        config=config,
+    ):
+        if llamada is not None:
+            uso = getattr(chunk, "usage_metadata", None)
+            if uso is not None:
+                llamada.tokens_prompt    = uso.prompt_token_count or llamada.tokens_prompt
+                llamada.tokens_respuesta = uso.candidates_token_count or llamada.tokens_respuesta
+                llamada.tokens_total     = uso.total_token_count or llamada.tokens_total
+            for cand in chunk.candidates or []:
+                grounding = getattr(cand, "grounding_metadata", None)
+                if grounding is not None and grounding.web_search_queries:
+                    llamada.busquedas = max(llamada.busquedas, len(grounding.web_search_queries))
+        if chunk.text:
+            yield chunk.text
+
+
+def _validar_analisis(data) -> dict | None:
+    """Valida un objeto de análisis y lo normaliza a los rangos esperados."""
+    if not isinstance(data, dict):
+        return None
+    try:
+        return {
+            "p_vegas":     min(max(float(data["p_vegas"]), 0.0), 100.0),
+            "n_local":     min(max(float(data.get("n_local", 0)), -100.0), 100.0),
+            "n_visitante": min(max(float(data.get("n_visitante", 0)), -100.0), 100.0),
+            "r_local":     min(max(float(data.get("r_local", 50)), 0.0), 100.0),
+            "r_visitante": min(max(float(data.get("r_visitante", 50)), 0.0), 100.0),
+            "total_proyectado": _float_opcional(data.get("total_proyectado")),
+            "resumen":     str(data.get("resumen") or "Sin información disponible."),
+            "fuente":      "gemini",
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+# ── Router de análisis: request cubierto (hedged) entre dos modelos ───────────
+# Con GEMINI_MODEL_RESPALDO configurado, cada análisis sale primero a
+# GEMINI_MODEL; si no termina antes del percentil GEMINI_HEDGE_PERCENTIL de
+# sus latencias recientes (GEMINI_HEDGE_SEG mientras no haya historial), o
+# falla o responde algo que no valida, se lanza el mismo prompt al modelo de
+# respaldo. Gana la primera respuesta válida y la otra se cancela (el stream
+# se corta en el siguiente chunk). Con GEMINI_ROUTER_MUESTREO > 0 una fracción
+# de los análisis corre ambos modelos completos para medir su acuerdo.
+
+_MIN_MUESTRAS_HEDGE = 20
+
+
+def _diferencia_p_vegas(a: dict, b: dict) -> float | None:
+    """|Δ p_vegas| medio entre dos análisis (o dos dicts {partido: análisis})."""
+    if "p_vegas" in a and "p_vegas" in b:
+        return abs(a["p_vegas"] - b["p_vegas"])
+    comunes = [k for k in a if k in b]
+    if not comunes:
+        return None
+    return sum(abs(a[k]["p_vegas"] - b[k]["p_vegas"]) for k in comunes) / len(comunes)
+
+
+class RouterAnalisis:
+    def __init__(self, primario: str, respaldo: str = "", percentil: float = 90.0,
+                 espera_inicial: float = 6.0, muestreo: float = 0.0):
+        self.primario       = primario
+        self.respaldo       = respaldo if respaldo and respaldo != primario else ""
+        self.percentil      = percentil
+        self.espera_inicial = espera_inicial
+        self.muestreo       = muestreo
+        self._lock          = threading.Lock()
+        self._pool          = ThreadPoolExecutor(max_workers=8, thread_name_prefix="router-llm")
+        self._modelos       = {}
+        self._hedge         = {"lanzados": 0, "por_latencia": 0, "por_fallo": 0, "ganados_respaldo": 0}
+        self._acuerdo       = {"comparaciones": 0, "suma_diff": 0.0, "dentro_5pts": 0}
+
+    def _stats(self, modelo: str, tipo: str) -> dict:
+        # Por modelo y tipo: un slate (varios partidos por request) tarda
+        # mucho más que un partido y no comparten percentil de hedge.
+        return self._modelos.setdefault((modelo, tipo), {
+            "llamadas": 0, "validas": 0, "ganadas": 0, "errores": 0, "invalidas": 0,
+            "canceladas": 0, "latencias": array("d"),
+        })
+
+    def umbral_hedge(self, tipo: str = "partido") -> float:
+        with self._lock:
+            latencias = sorted(self._stats(self.primario, tipo)["latencias"])
+        if len(latencias) < _MIN_MUESTRAS_HEDGE:
+            return self.espera_inicial
+        return latencias[min(int(len(latencias) * self.percentil / 100), len(latencias) - 1)]
+
+    def _correr(self, modelo: str, prompt: str, validar, esquema, tipo: str,
+                cancelar: threading.Event) -> tuple[str, object, str | None]:
+        t = time.perf_counter()
+        resultado, motivo = None, None
+        try:
+            texto = _gemini_generar(prompt, esquema, tipo, modelo=modelo, cancelar=cancelar)
+            if cancelar.is_set():
+                motivo = "canceladas"
+            else:
+                try:
+                    resultado = validar(texto) or None
+                except (ValueError, TypeError, KeyError):
+                    resultado = None
+                motivo = None if resultado is not None else "invalidas"
+        except Exception as e:
+            log.error(f"Error Gemini ({modelo}): {e}")
+            motivo = "errores"
+        with self._lock:
+            st = self._stats(modelo, tipo)
+            st["llamadas"] += 1
+            st["validas" if motivo is None else motivo] += 1
+            if motivo != "errores":
+                # Una llamada cancelada tardó al menos esto: se registra como
+                # cota inferior para que el p90 no quede sesgado a las rápidas.
+                st["latencias"].append(time.perf_counter() - t)
+                if len(st["latencias"]) > 200:
+                    del st["latencias"][0]
+        return modelo, resultado, motivo
+
+    def _comparar(self, a, b):
+        diff = _diferencia_p_vegas(a, b)
+        if diff is None:
+            return
+        with self._lock:
+            self._acuerdo["comparaciones"] += 1
+            self._acuerdo["suma_diff"] += diff
+            self._acuerdo["dentro_5pts"] += int(diff <= 5)
+
+    def generar(self, prompt: str, validar, esquema=None, tipo: str = "partido"):
+        """
+        Primer resultado válido de `validar(texto)` entre primario y respaldo.
+        Retorna (resultado, None) o (None, motivo) con motivo "error" o
+        "respuesta_invalida" si ningún modelo dio una respuesta válida.
+        """
+        cancelar = {}
+
+        def _lanzar(modelo: str):
+            cancelar[modelo] = threading.Event()
+            return self._pool.submit(self._correr, modelo, prompt, validar, esquema, tipo, cancelar[modelo])
+
+        comparar = bool(self.respaldo) and random.random() < self.muestreo
+        pendientes = {_lanzar(self.primario)}
+        respaldo_lanzado = not self.respaldo
+        if comparar:
+            pendientes.add(_lanzar(self.respaldo))
+            respaldo_lanzado = True
+        limite = time.monotonic() + self.umbral_hedge(tipo)
+
+        ganador, validos, motivos = None, [], []
+        while pendientes and ganador is None:
+            espera = None if respaldo_lanzado else max(0.0, limite - time.monotonic())
+            hechos, pendientes = wait(pendientes, timeout=espera, return_when=FIRST_COMPLETED)
+            for f in hechos:
+                modelo, resultado, motivo = f.result()
+                if resultado is None:
+                    motivos.append(motivo)
+                    continue
+                validos.append(resultado)
+                if ganador is None:
+                    ganador = (modelo, resultado)
+            if ganador is None and not respaldo_lanzado:
+                with self._lock:
+                    self._hedge["lanzados"] += 1
+                    self._hedge["por_latencia" if not hechos else "por_fallo"] += 1
+                pendientes.add(_lanzar(self.respaldo))
+                respaldo_lanzado = True
+
+        if ganador is None:
+            return None, ("respuesta_invalida" if "invalidas" in motivos else "error")
+
+        modelo, resultado = ganador
+        with self._lock:
+            self._stats(modelo, tipo)["ganadas"] += 1
+            if modelo == self.respaldo and not comparar:
+                self._hedge["ganados_respaldo"] += 1
+        if len(validos) > 1:
+            self._comparar(validos[0], validos[1])
+
+        def _comparar_al_terminar(f):
+            otro = f.result()[1]
+            if otro is not None:
+                self._comparar(resultado, otro)
+
+        for f in pendientes:
+            if comparar:
+                f.add_done_callback(_comparar_al_terminar)
+        if not comparar:
+            for otro, evento in cancelar.items():
+                if otro != modelo:
+                    evento.set()
+        return resultado, None
+
+    def resumen(self) -> dict:
+        with self._lock:
+            modelos = {}
+            for (modelo, tipo), st in self._modelos.items():
+                lat = sorted(st["latencias"])
+                modelos.setdefault(modelo, {})[tipo] = {
+                    **{k: v for k, v in st.items() if k != "latencias"},
+                    "p50_seg": round(lat[len(lat) // 2], 3) if lat else None,
+                    "p90_seg": round(lat[min(int(len(lat) * 0.9), len(lat) - 1)], 3) if lat else None,
+                }
+            comp = self._acuerdo["comparaciones"]
+            return {
+                "primario": self.primario,
+                "respaldo": self.respaldo or None,
+                "modelos":  modelos,
+                "hedge":    dict(self._hedge),
+                "acuerdo":  {"comparaciones": comp,
+                             "diff_p_vegas_media": round(self._acuerdo["suma_diff"] / comp, 2) if comp else None,
+                             "dentro_5pts_pct": round(self._acuerdo["dentro_5pts"] / comp * 100, 1) if comp else None},
+            }
+
+
+ROUTER_ANALISIS = RouterAnalisis(GEMINI_MODEL, GEMINI_MODEL_RESPALDO, GEMINI_HEDGE_PERCENTIL,
+                                 GEMINI_HEDGE_SEG, GEMINI_ROUTER_MUESTREO)
+
+
+def _parsear_analisis(texto: str) -> dict | None:
+    texto = re.sub(r"```json|```", "", texto).strip()
+    match = re.search(r"\{.*\}", texto, re.DOTALL)
+    return _validar_analisis(json.loads(match.group())) if match else None
+
+
+def analizar_partido_con_gemini(equipo_local: str, equipo_visitante: str,
+                                 linea_ml_local: float, liga: Liga | None = None) -> dict:
+    liga = liga or LIGAS["nba"]
+    if not _gemini_disponible():
+        log.warning("API key de Gemini no configurada, usando valores por defecto")
+        return _valores_defecto(linea_ml_local)
+
+    if CONTABILIDAD_LLM.presupuesto_agotado():
+        CONTABILIDAD_LLM.fallback("presupuesto")
+        return _valores_defecto(linea_ml_local)
+
+    prompt = liga.prompt_analisis(equipo_local, equipo_visitante)
+    analisis, motivo = ROUTER_ANALISIS.generar(prompt, _parsear_analisis)
+    if analisis:
+        return analisis
+
+    CONTABILIDAD_LLM.fallback(motivo)
+    return _valores_defecto(linea_ml_local)
+
+
+# ── Análisis del slate completo ───────────────────────────────────────────────
+# Un solo request (o pocos, en bloques de GEMINI_SLATE_CHUNK) para todos los
+# partidos de la liga, con un esquema de respuesta estricto: array de objetos
+# con "partido" = "visitante @ local". Los partidos que falten o no validen
+# caen al análisis individual.
+
+def clave_partido(equipo_visitante: str, equipo_local: str) -> str:
+    return f"{equipo_visitante} @ {equipo_local}"
+
+
+# Campos de cada elemento del slate: (requerido, rango numérico; None = texto).
+# _esquema_slate se lo pide a la API y _cumple_esquema_slate lo verifica.
+_CAMPOS_SLATE = {
+    "partido":          (True, None),
+    "p_vegas":          (True, (0, 100)),
+    "n_local":          (True, (-100, 100)),
+    "n_visitante":      (True, (-100, 100)),
+    "r_local":          (True, (0, 100)),
+    "r_visitante":      (True, (0, 100)),
+    "total_proyectado": (False, (0, 1000)),
+    "resumen":          (True, None),
+}
+
+
+def _esquema_slate():
+    from google.genai import types
+
+    numero = lambda desc: types.Schema(type=types.Type.NUMBER, description=desc)
+    return types.Schema(
+        type=types.Type.ARRAY,
+        items=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "partido":          types.Schema(type=types.Type.STRING),
+                "p_vegas":          numero("0-100, probabilidad implícita del LOCAL"),
+                "n_local":          numero("-100 a 100"),
+                "n_visitante":      numero("-100 a 100"),
+                "r_local":          numero("0-100"),
+                "r_visitante":      numero("0-100"),
+                "total_proyectado": numero("total esperado del partido"),
+                "resumen":          types.Schema(type=types.Type.STRING),
+            },
+            required=[c for c, (requerido, _) in _CAMPOS_SLATE.items() if requerido],
+        ),
+    )
+
+
+def _cumple_esquema_slate(obj) -> bool:
+    """True si el elemento tiene todos los campos requeridos con tipo y rango del esquema."""
+    if not isinstance(obj, dict):
+        return False
+    for campo, (requerido, rango) in _CAMPOS_SLATE.items():
+        valor = obj.get(campo)
+        if valor is None:
+            if requerido:
+                return False
+        elif rango is None:
+            if not isinstance(valor, str) or not valor.strip():
+                return False
+        elif (isinstance(valor, bool) or not isinstance(valor, (int, float))
+              or not rango[0] <= valor <= rango[1]):
+            return False
+    return True
+
+
+def _array_json(texto: str) -> list:
+    """
+    Primer array JSON de objetos dentro de `texto`. Con búsqueda web la API
+    no acepta esquema y la respuesta puede traer prosa alrededor: se prueba
+    decodificar desde cada "[" en lugar de recortar con una regex.
+    """
+    texto = re.sub(r"```json|```", "", texto).strip()
+    decoder = json.JSONDecoder()
+    inicio = texto.find("[")
+    while inicio != -1:
+        try:
+            data, _ = decoder.raw_decode(texto, inicio)
+        except json.JSONDecodeError:
+            data = None
+        if isinstance(data, list) and data and all(isinstance(obj, dict) for obj in data):
+            return data
+        inicio = texto.find("[", inicio + 1)
+    raise ValueError("la respuesta del slate no tiene un array JSON de objetos")
+
+
+def _parsear_slate(texto: str, claves: list[str]) -> dict[str, dict]:
+    """
+    {clave: análisis} de los elementos que cumplen el esquema del slate; los
+    que no, se descartan (esos partidos van al análisis individual).
+    """
+    por_clave = {c.casefold(): c for c in claves}
+    resultado = {}
+    for obj in _array_json(texto):
+        if not _cumple_esquema_slate(obj):
+            continue
+        clave = por_clave.get(obj["partido"].strip().casefold())
+        analisis = _validar_analisis(obj)
+        if clave and analisis:
+            resultado[clave] = analisis
+    return resultado
+
+
+def analizar_slate_con_gemini(juegos: list[tuple[str, str]],
+                              liga: Liga | None = None) -> dict[str, dict]:
+    """
+    Analiza varios partidos [(visitante, local), ...] en bloques. Retorna
+    {clave_partido: análisis} solo para los partidos resueltos y válidos.
+    """
+    liga = liga or LIGAS["nba"]
+    if not _gemini_disponible() or not juegos:
+        return {}
+
+    # La API no admite esquema de respuesta junto con búsqueda web: en ese
+    # caso el esquema va en el prompt y cada elemento se valida contra
+    # _CAMPOS_SLATE (los que no cumplen se descartan).
+    esquema = None if GEMINI_BUSQUEDA else _esquema_slate()
+    resultado, llamadas = {}, 0
+    for i in range(0, len(juegos), GEMINI_SLATE_CHUNK):
+        if CONTABILIDAD_LLM.presupuesto_agotado():
+            log.warning(f"[{liga.nombre}] Presupuesto diario de Gemini agotado: slate interrumpido")
+            break
+        bloque = [clave_partido(v, l) for v, l in juegos[i:i + GEMINI_SLATE_CHUNK]]
+        llamadas += 1
+        analisis, motivo = ROUTER_ANALISIS.generar(liga.prompt_analisis_slate(bloque),
+                                                   lambda texto: _parsear_slate(texto, bloque), esquema, tipo="slate")
+        if analisis:
+            resultado.update(analisis)
+        else:
+            log.error(f"[{liga.nombre}] Error Gemini slate ({len(bloque)} partidos): {motivo}")
+
+    log.info(f"🧠 [{liga.nombre}] Slate: {len(resultado)}/{len(juegos)} partidos en {llamadas} llamada(s)")
+    return resultado
+
+
+def _float_opcional(valor) -> float | None:
+    try:
+        return float(valor) if valor is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _valores_defecto(linea_ml_local: float) -> dict:
+    return {
+        "p_vegas":     linea_ml_local * 100,
+        "n_local":     0.0,
+        "n_visitante": 0.0,
+        "r_local":     50.0,
+        "r_visitante": 50.0,
+        "total_proyectado": None,
+        "resumen":     "Análisis no disponible (sin API key de Gemini).",
+        "fuente":      "defecto",
+    }
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MÓDULO 3 — FÓRMULA NEA
+# ══════════════════════════════════════════════════════════════════════════════
+
+def calcular_valor_real(p_vegas: float, n: float, v: float, r: float) -> float:
+    return 0.45 * p_vegas + 0.40 * n + 0.10 * v + 0.05 * r
+
+
+def calcular_nea(p_poly: float, p_vegas: float, n: float,
+                 v: float, r: float) -> float:
+    return p_poly - calcular_valor_real(p_vegas, n, v, r)
+
+
+# ── Valoración por tipo de mercado ────────────────────────────────────────────
+# Moneyline usa p_vegas directamente. Spread y Total derivan una probabilidad
+# con un modelo normal: el margen esperado se infiere de p_vegas
+# (μ = σ_margen · Φ⁻¹(p)) y el total esperado de "total_proyectado".
+# Todas pasan por la misma fórmula NEA; en totales los factores de equipo
+# son neutros (n=50, v=0, r=50).
+
+_NORMAL = statistics.NormalDist()
+_RE_SPREAD = re.compile(r"Spread:\s*(.+?)\s*\(([-+]?\d+(?:\.\d+)?)\)")
+_RE_TOTAL  = re.compile(r"O/U\s*(\d+(?:\.\d+)?)")
+
+
+@dataclass(slots=True)
+class Valoracion:
+    outcome:  str
+    token_id: str
+    etiqueta: str           # texto mostrado como "equipo" en la oportunidad
+    es_local: bool
+    p_modelo: float         # 0-100
+    n_norm:   float
+    v:        float
+    r:        float
+    linea:    float | None = None
+
+
+def _factores_equipo(analisis: dict, es_local: bool, liga: Liga) -> tuple[float, float, float]:
+    if es_local:
+        n, r = analisis["n_local"], analisis["r_local"]
+    else:
+        n, r = analisis["n_visitante"], analisis["r_visitante"]
+    v = liga.ventaja_local if es_local else -liga.ventaja_local
+    return (n + 100) / 2, v, r
+
+
+def margen_esperado_local(analisis: dict, liga: Liga) -> float:
+    p = min(max(analisis["p_vegas"] / 100, 0.01), 0.99)
+    return liga.sigma_margen * _NORMAL.inv_cdf(p)
+
+
+def valorar_mercado(tipo: str, mercado: dict, analisis: dict, liga: Liga,
+                    equipo_local: str, equipo_visit: str) -> list[Valoracion]:
+    pares = list(zip(mercado["outcomes"], mercado["token_ids"]))
+    valoraciones = []
+
+    if tipo == MONEYLINE:
+        for outcome, tid in pares:
+            es_local = (outcome == equipo_local)
+            p = analisis["p_vegas"] if es_local else 100 - analisis["p_vegas"]
+            n_norm, v, r = _factores_equipo(analisis, es_local, liga)
+            valoraciones.append(Valoracion(outcome, tid, outcome, es_local, p, n_norm, v, r))
+
+    elif tipo == SPREAD:
+        m = _RE_SPREAD.search(mercado["pregunta"])
+        if not m or len(pares) != 2:
+            return []
+        equipo_linea, linea = m.group(1).strip(), float(m.group(2))
+        mu_local = margen_esperado_local(analisis, liga)
+        for outcome, tid in pares:
+            es_local = (outcome == equipo_local)
+            mu = mu_local if es_local else -mu_local
+            # El equipo de la pregunta cubre con margen + linea > 0; el otro con la línea opuesta
+            l = linea if outcome == equipo_linea else -linea
+            p = _NORMAL.cdf((mu + l) / liga.sigma_margen) * 100
+            n_norm, v, r = _factores_equipo(analisis, es_local, liga)
+            valoraciones.append(Valoracion(outcome, tid, f"{outcome} {l:+g}", es_local,
+                                           p, n_norm, v, r, l))
+
+    elif tipo == TOTAL:
+        m = _RE_TOTAL.search(mercado["pregunta"])
+        total = analisis.get("total_proyectado")
+        if not m or total is None:
+            return []
+        linea = float(m.group(1))
+        p_over = _NORMAL.cdf((total - linea) / liga.sigma_total) * 100
+        for outcome, tid in pares:
+            p = p_over if outcome.lower().startswith("over") else 100 - p_over
+            valoraciones.append(Valoracion(outcome, tid, f"{outcome} {linea:g}", False,
+                                           p, 50.0, 0.0, 50.0, linea))
+
+    return valoraciones
+
+
+def extraer_equipos(titulo: str, liga: Liga | None = None) -> tuple[str, str]:
+    return (liga or LIGAS["nba"]).extraer_equipos(titulo)
+
+
+def hora_et(st: str) -> str:
+    try:
+        dt = datetime.fromisoformat(st.replace("Z", "+00:00"))
+        return dt.astimezone(ET).strftime("%I:%M %p ET")
+    except: return st
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MÓDULO 4 — SCAN Y OPORTUNIDADES
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _clave_cache_analisis(liga: Liga, equipo_visitante: str, equipo_local: str,
+                          fecha: str | None) -> tuple:
+    return (liga.clave, equipo_visitante, equipo_local, fecha or datetime.now(ET).date().isoformat())
+
+
+def precargar_analisis_slate(liga: Liga, juegos: list[tuple[str, str, str | None]]):
+    """Analiza en modo slate los partidos (visitante, local, fecha) que no están en caché."""
+    if not GEMINI_MODO_SLATE:
+        return
+    pendientes = [(v, l, f) for v, l, f in juegos
+                  if CACHE_ANALISIS.get(_clave_cache_analisis(liga, v, l, f)) is None]
+    if not pendientes:
+        return
+    resueltos = analizar_slate_con_gemini([(v, l) for v, l, _ in pendientes], liga)
+    for v, l, f in pendientes:
+        analisis = resueltos.get(clave_partido(v, l))
+        if analisis:
+            CACHE_ANALISIS.set(_clave_cache_analisis(liga, v, l, f), analisis)
+
+
+def _analisis_previos() -> dict[tuple, tuple[dict, str]]:
+    slate = load_slate()
+    return {(j.get("liga"), j.get("visitante"), j.get("local"), (j.get("inicio") or "")[:10] or None):
+            (j["analisis"], j.get("analizado_en") or slate["ts"])
+            for j in slate["partidos"] if (j.get("analisis") or {}).get("fuente") == "gemini"}
+
+
+def previo_slate(liga: Liga, equipo_visitante: str, equipo_local: str,
+                 fecha: str | None) -> tuple[dict, str] | None:
+    """
+    (análisis, analizado_en) del partido de esa fecha en slate.json, si tiene
+    menos de PREFILTRO_PREVIO_MAX_HORAS; otro cruce de los mismos equipos
+    (serie de playoffs, back-to-back) no reutiliza el análisis.
+    """
+    previos = _leer_memo(SLATE_FILE, _analisis_previos, clave="analisis_previos")
+    item = previos.get((liga.clave, equipo_visitante, equipo_local, fecha))
+    if item is None or not item[1]:
+        return None
+    if datetime.now(ET) - datetime.fromisoformat(item[1]) > timedelta(hours=PREFILTRO_PREVIO_MAX_HORAS):
+        return None
+    return item
+
+
+def analisis_slate_previo(liga: Liga, equipo_visitante: str, equipo_local: str,
+                          fecha: str | None) -> dict | None:
+    """Análisis Gemini vigente del partido guardado en slate.json (memoizado: no mutar)."""
+    item = previo_slate(liga, equipo_visitante, equipo_local, fecha)
+    return item[0] if item else None
+
+
+def analisis_cacheado(liga: Liga, equipo_local: str, equipo_visitante: str,
+                      linea_ml_local: float, fecha: str | None = None) -> dict:
+    """Análisis Gemini del partido, reutilizado para la misma fecha ET (CACHE_ANALISIS)."""
+    clave = _clave_cache_analisis(liga, equipo_visitante, equipo_local, fecha)
+    analisis = CACHE_ANALISIS.get(clave)
+    if analisis is None and CONTABILIDAD_LLM.presupuesto_agotado():
+        # Sin presupuesto: el análisis del último slate, aunque sea de otro scan
+        analisis = analisis_slate_previo(liga, equipo_visitante, equipo_local, fecha)
+        if analisis is not None:
+            CONTABILIDAD_LLM.fallback("slate_previo", degradado=True)
+            return analisis
+    if analisis is None:
+        analisis = analizar_partido_con_gemini(equipo_local, equipo_visitante, linea_ml_local, liga)
+        if analisis.get("fuente") == "gemini":
+            CACHE_ANALISIS.set(clave, analisis)
+    return analisis
+
+
+def cotas_nea(p_poly_pct: float, v: float, neutro: bool = False) -> tuple[float, float]:
+    """
+    Rango [min, max] de NEA alcanzable para un outcome sin conocer el análisis,
+    asumiendo p_vegas ∈ p_poly ± PREFILTRO_DELTA_P, n ∈ ±PREFILTRO_N_MAX y
+    r ∈ [0, 100]. Con neutro=True (totales) n y r son fijos (50).
+    """
+    p_lo = max(p_poly_pct - PREFILTRO_DELTA_P, 0.0)
+    p_hi = min(p_poly_pct + PREFILTRO_DELTA_P, 100.0)
+    if neutro:
+        n_lo = n_hi = r_lo = r_hi = 50.0
+    else:
+        n_lo, n_hi = (100 - PREFILTRO_N_MAX) / 2, (100 + PREFILTRO_N_MAX) / 2
+        r_lo, r_hi = 0.0, 100.0
+    vr_lo = calcular_valor_real(p_lo, n_lo, v, r_lo)
+    vr_hi = calcular_valor_real(p_hi, n_hi, v, r_hi)
+    return p_poly_pct - vr_hi, p_poly_pct - vr_lo
+
+
+def _extremos_previo(previo: dict) -> tuple[dict, dict]:
+    """
+    Dos análisis alrededor del previo: uno movido a favor del local y otro a
+    favor del visitante. El valor real de cada outcome es monótono en p_vegas,
+    n, r y total, así que sus cotas salen de valorarlo con ambos.
+    """
+    dp, dn, dt = PREFILTRO_PREVIO_DELTA_P, PREFILTRO_PREVIO_DELTA_N, PREFILTRO_PREVIO_DELTA_TOTAL
+    total = previo.get("total_proyectado")
+
+    def _mover(signo: int) -> dict:
+        return {
+            **previo,
+            "p_vegas":     min(max(previo["p_vegas"] + signo * dp, 0.0), 100.0),
+            "n_local":     min(max(previo["n_local"] + signo * dn, -100.0), 100.0),
+            "n_visitante": min(max(previo["n_visitante"] - signo * dn, -100.0), 100.0),
+            "r_local":     min(max(previo["r_local"] + signo * dn, 0.0), 100.0),
+            "r_visitante": min(max(previo["r_visitante"] - signo * dn, 0.0), 100.0),
+            "total_proyectado": total + signo * dt if total is not None else None,
+        }
+    return _mover(1), _mover(-1)
+
+
+def _cotas_con_previo(tipo: str, mercado: dict, previo: dict, liga: Liga,
+                      equipo_local: str, equipo_visit: str) -> dict[str, tuple[float, float]]:
+    """{token_id: (valor real mínimo, máximo)} con el análisis previo ± los deltas del prefiltro."""
+    cotas = {}
+    for analisis in _extremos_previo(previo):
+        for val in valorar_mercado(tipo, mercado, analisis, liga, equipo_local, equipo_visit):
+            vr = calcular_valor_real(val.p_modelo, val.n_norm, val.v, val.r)
+            lo, hi = cotas.get(val.token_id, (vr, vr))
+            cotas[val.token_id] = (min(lo, vr), max(hi, vr))
+    return cotas
+
+
+def partido_puede_cruzar(item: dict, precios: dict[str, float], liga: Liga,
+                         equipo_local: str, umbral: float | None = None,
+                         previo: dict | None = None, equipo_visit: str = "") -> bool:
+    """
+    True si algún outcome del partido podría llegar a |NEA| >= umbral. Con el
+    análisis `previo` del partido las cotas salen de él (± PREFILTRO_PREVIO_*);
+    sin él, de las cotas amplias de cotas_nea.
+    """
+    umbral = liga.nea_umbral if umbral is None else umbral
+    for tipo, mercado in item["mercados"].items():
+        cotas_vr = (_cotas_con_previo(tipo, mercado, previo, liga, equipo_local, equipo_visit)
+                    if previo is not None else None)
+        for outcome, tid in zip(mercado["outcomes"], mercado["token_ids"]):
+            precio = precios.get(tid)
+            if precio is None:
+                continue
+            if cotas_vr is not None:
+                if tid not in cotas_vr:
+                    return True         # el previo no alcanza para valorar este mercado
+                vr_lo, vr_hi = cotas_vr[tid]
+                nea_min, nea_max = precio * 100 - vr_hi, precio * 100 - vr_lo
+            elif tipo == TOTAL:
+                nea_min, nea_max = cotas_nea(precio * 100, 0.0, neutro=True)
+            else:
+                v = liga.ventaja_local if outcome == equipo_local else -liga.ventaja_local
+                nea_min, nea_max = cotas_nea(precio * 100, v)
+            if nea_min <= -umbral:
+                # COMPRAR solo es accionable si el valor real puede superar el mínimo
+                vr_max = precio * 100 - nea_min
+                if not PREFILTRO_SOLO_COMPRAR or vr_max > liga.valor_real_minimo * 100:
+                    return True
+            if nea_max >= umbral and not PREFILTRO_SOLO_COMPRAR:
+                return True
+    return False
+
+
+def valorar_partido(juego: dict, precios: dict[str, float], liga: Liga,
+                    umbral: float | None = None) -> list[Opportunity]:
+    """
+    Aplica la fórmula NEA a todos los outcomes de un partido con su análisis.
+    `juego` tiene la forma de una entrada del slate (ver scan_liga).
+    Con `umbral` menor al de la liga (estrategias sombra) también se emiten
+    los outcomes entre ambos umbrales, con acción "SOMBRA".
+    """
+    umbral = liga.nea_umbral if umbral is None else umbral
+    analisis = juego["analisis"]
+    oportunidades = []
+    for tipo, mercado in juego["mercados"].items():
+        for val in valorar_mercado(tipo, mercado, analisis, liga, juego["local"], juego["visitante"]):
+            precio_poly = precios.get(val.token_id)
+            if precio_poly is None:
+                continue
+
+            p_poly_pct = precio_poly * 100
+            valor_real = calcular_valor_real(val.p_modelo, val.n_norm, val.v, val.r)
+            nea        = p_poly_pct - valor_real
+
+            if abs(nea) >= umbral:
+                if abs(nea) < liga.nea_umbral:
+                    accion = "SOMBRA"
+                else:
+                    accion = "COMPRAR" if nea <= -liga.nea_umbral else "EVITAR"
+                oportunidades.append(Opportunity(
+                    partido=juego["partido"],
+                    equipo=val.etiqueta,
+                    es_local=val.es_local,
+                    p_poly=round(p_poly_pct, 2),
+                    valor_real=round(valor_real, 2),
+                    nea=round(nea, 2),
+                    accion=accion,
+                    hora=juego["hora"],
+                    token_id=val.token_id,
+                    resumen=analisis["resumen"],
+                    scanned_at=datetime.now(ET).isoformat(),
+                    liga=liga.clave,
+                    mercado=tipo,
+                    linea=val.linea,
+                ))
+    return oportunidades
+
+
+def scan_liga(liga: Liga) -> tuple[list[Opportunity], dict, list[dict]]:
+    """Scan de una liga. Retorna (oportunidades, estadísticas, slate de partidos analizados)."""
+    t0 = time.monotonic()
+    stats = {"partidos": 0, "tokens": 0, "precios": 0, "oportunidades": 0,
+             "duracion_seg": 0.0, "error": None}
+    oportunidades, slate = [], []
+
+    try:
+        partidos = obtener_partidos_hoy(liga)
+    except Exception as e:
+        log.error(f"[{liga.nombre}] Error obteniendo partidos: {e}")
+        stats["error"] = str(e)
+        return [], stats, []
+
+    stats["partidos"] = len(partidos)
+    if not partidos:
+        log.info(f"[{liga.nombre}] Sin partidos para hoy.")
+        return [], stats, []
+
+    log.info(f"✅ [{liga.nombre}] {len(partidos)} partido(s) encontrado(s)")
+    estructura = construir_estructura(partidos, liga, stats)
+    if stats.get("liquidez", {}).get("iliquidos"):
+        log.info(f"💧 [{liga.nombre}] {stats['liquidez']['iliquidos']} mercado(s) descartado(s) por spread/profundidad")
+
+    all_tokens = sorted({
+        tid
+        for item in estructura
+        for m in item["mercados"].values()
+        for tid in m["token_ids"]
+    })
+    precios = obtener_precios_paralelo(all_tokens, usar_cache=True)
+    stats["tokens"], stats["precios"] = len(all_tokens), len(precios)
+    log.info(f"💹 [{liga.nombre}] {len(precios)}/{len(all_tokens)} precios obtenidos")
+
+    # Etapa 1: prefiltro por precio. Solo los partidos que pueden cruzar el
+    # umbral (o ya tienen análisis en caché) pasan a Gemini.
+    juegos, escalar = [], {}
+    # Los partidos con análisis en el último slate usan cotas ajustadas a él.
+    pf = {"evaluados": 0, "escalados": 0, "omitidos": 0, "en_cache": 0, "con_previo": 0,
+          "falsos_negativos": 0}
+    previos = {}
+    for i, item in enumerate(estructura):
+        visit, local = liga.extraer_equipos(item["evento"].get("title", "?"))
+        inicio = inicio_evento(item["evento"])
+        fecha = inicio.date().isoformat() if inicio else None
+        pf["evaluados"] += 1
+        previo = previo_slate(liga, visit, local, fecha) if PREFILTRO else None
+        if previo is not None:
+            previos[i] = previo
+            pf["con_previo"] += 1
+            previo = previo[0]
+        if CACHE_ANALISIS.get(_clave_cache_analisis(liga, visit, local, fecha)) is not None:
+            pf["en_cache"] += 1
+            escalar[i] = True
+        elif not PREFILTRO or partido_puede_cruzar(item, precios, liga, local, umbral_emision(liga),
+                                                   previo, visit):
+            pf["escalados"] += 1
+            escalar[i] = True
+        else:
+            pf["omitidos"] += 1
+            escalar[i] = False
+        if escalar[i] or PREFILTRO_AUDITORIA:
+            juegos.append((visit, local, fecha))
+    stats["prefiltro"] = pf
+    if pf["omitidos"]:
+        log.info(f"🧹 [{liga.nombre}] Prefiltro: {pf['omitidos']}/{pf['evaluados']} partido(s) sin posibilidad "
+                 f"de cruzar ±{liga.nea_umbral} NEA{' (auditando)' if PREFILTRO_AUDITORIA else ''}")
+
+    # Etapa 2: análisis Gemini (slate + individual) y valoración
+    precargar_analisis_slate(liga, juegos)
+
+    def _juego(item: dict, visit: str, local: str, inicio, analisis: dict | None,
+               analizado_en: str | None = None) -> dict:
+        return {
+            "liga":      liga.clave,
+            "partido":   item["evento"].get("title", "?"),
+            "visitante": visit,
+            "local":     local,
+            "hora":      hora_et(item["evento"].get("startTime", "")),
+            "inicio":    inicio.isoformat() if inicio else None,
+            "mercados":  {
+                tipo: {k: m[k] for k in ("pregunta", "token_ids", "outcomes")}
+                for tipo, m in item["mercados"].items()
+            },
+            "analisis":  analisis,
+            "analizado_en": analizado_en or (datetime.now(ET).isoformat() if analisis else None),
+            "precios":   {tid: precios[tid] for m in item["mercados"].values()
+                          for tid in m["token_ids"] if tid in precios},
+        }
+
+    for i, item in enumerate(estructura):
+        titulo = item["evento"].get("title", "?")
+        equipo_visit, equipo_local = liga.extraer_equipos(titulo)
+        inicio = inicio_evento(item["evento"])
+        if not escalar[i] and not PREFILTRO_AUDITORIA:
+            # Se conserva el análisis previo (sin re-scoring) para acotar el
+            # próximo prefiltro; sin previo queda solo en el historial de scans
+            analisis, analizado_en = previos.get(i, (None, None))
+            slate.append({**_juego(item, equipo_visit, equipo_local, inicio, analisis, analizado_en),
+                          "omitido": True})
+            continue
+        fecha = inicio.date().isoformat() if inicio else None
+        ops_antes = len(oportunidades)
+
+        ml = item["mercados"].get(MONEYLINE)
+        p_local_clob = 0.5
+        if ml:
+            for outcome, tid in zip(ml["outcomes"], ml["token_ids"]):
+                if outcome == equipo_local and tid in precios:
+                    p_local_clob = precios[tid]
+                    break
+
+        log.info(f"🤖 [{liga.nombre}] Analizando: {titulo}...")
+        analisis = analisis_cacheado(liga, equipo_local, equipo_visit, p_local_clob, fecha)
+
+        juego = _juego(item, equipo_visit, equipo_local, inicio, analisis)
+        slate.append(juego)
+        oportunidades.extend(valorar_partido(juego, precios, liga, umbral_emision(liga)))
+
+        nuevas = [o for o in oportunidades[ops_antes:]
+                  if not PREFILTRO_SOLO_COMPRAR or o.accion == "COMPRAR"]
+        if not escalar[i] and nuevas:
+            pf["falsos_negativos"] += 1
+            log.warning(f"🧹 [{liga.nombre}] Prefiltro omitió {titulo} pero generó "
+                        f"{len(nuevas)} oportunidad(es)")
+
+    stats["oportunidades"] = sum(1 for o in oportunidades if o.accion != "SOMBRA")
+    stats["duracion_seg"]  = round(time.monotonic() - t0, 2)
+    return oportunidades, stats, slate
+
+
+def ejecutar_scan(ligas: list[Liga] | None = None, registrar: bool = True) -> list[Opportunity]:
+    """
+    Corre el scan completo de todas las ligas activas en paralelo. Con
+    registrar=False no guarda slate ni scan (dry-run).
+    """
+    ligas = ligas if ligas is not None else ligas_activas()
+    log.info(f"🔍 Iniciando scan Edge Alpha: {', '.join(l.nombre for l in ligas) or 'sin ligas'}...")
+    marca_llm = CONTABILIDAD_LLM.marca()
+    todas_oportunidades = []
+    por_liga = {}
+    slate = []
+
+    if ligas:
+        with ThreadPoolExecutor(max_workers=len(ligas)) as pool:
+            futuros = {pool.submit(scan_liga, liga): liga for liga in ligas}
+            for f in as_completed(futuros):
+                liga = futuros[f]
+                try:
+                    ops, stats, juegos = f.result()
+                except Exception as e:
+                    log.error(f"[{liga.nombre}] Error en scan: {e}")
+                    ops, stats, juegos = [], {"partidos": 0, "oportunidades": 0, "error": str(e)}, []
+                todas_oportunidades.extend(ops)
+                por_liga[liga.clave] = stats
+                slate.extend(juegos)
+
+    total_partidos = sum(s.get("partidos", 0) for s in por_liga.values())
+    if not total_partidos:
+        log.info("Sin partidos para hoy.")
+        return []
+
+    if registrar:
+        save_slate([j for j in slate if j["analisis"] is not None])
+
+    todas_oportunidades.sort(key=lambda x: abs(x.nea), reverse=True)
+    visibles = [op for op in todas_oportunidades if op.accion != "SOMBRA"]
+    log.info(f"🎯 Scan completado: {len(visibles)} oportunidades encontradas")
+
+    if not registrar:
+        return todas_oportunidades
+
+    llm = CONTABILIDAD_LLM.desde(marca_llm)
+    if llm["llamadas"] or llm["fallbacks"] or llm["degradados"]:
+        log.info(f"🧠 Gemini: {llm['llamadas']} llamada(s), {llm['tokens_total']} tokens, "
+                 f"{llm['busquedas']} búsqueda(s), {llm['fallos']} fallo(s), "
+                 f"{llm['fallbacks']} fallback(s), {llm['degradados']} degradado(s)")
+
+    # Log del scan (las señales solo-sombra no se muestran)
+    append_scan_log(ScanEntry(
+        ts=datetime.now(ET).isoformat(),
+        partidos=total_partidos,
+        oportunidades=len(visibles),
+        resultados=visibles,
+        por_liga=por_liga,
+        llm=llm,
+        slate=slate,
+    ))
+
+    return todas_oportunidades
+
+
+# ── Re-scoring intradía ───────────────────────────────────────────────────────
+# Reutiliza el análisis guardado en el slate del último scan y solo vuelve a
+# pedir precios CLOB. Abre posición cuando un outcome pasa a cruzar el umbral
+# COMPRAR respecto del re-scoring anterior.
+
+_rescoring_lock = threading.Lock()
+_cruzando: set[str] = set()     # token_ids en COMPRAR en el último re-scoring
+
+
+def ejecutar_rescoring() -> dict:
+    """Recalcula NEA del slate con precios frescos. Retorna un resumen."""
+    t0 = time.monotonic()
+    ahora = datetime.now(ET)
+    juegos = []
+    for juego in load_slate()["partidos"]:
+        if juego.get("analisis", {}).get("fuente") != "gemini" or juego.get("omitido"):
+            continue
+        if RESCORE_SOLO_PREVIO and juego.get("inicio") and datetime.fromisoformat(juego["inicio"]) <= ahora:
+            continue
+        juegos.append(juego)
+
+    resumen = {"ts": ahora.isoformat(), "partidos": len(juegos), "precios": 0,
+               "comprar": 0, "nuevas": 0, "aperturas": 0, "duracion_seg": 0.0}
+    if not juegos:
+        return resumen
+
+    tokens = sorted({tid for j in juegos for m in j["mercados"].values() for tid in m["token_ids"]})
+    precios = obtener_precios_paralelo(tokens)
+    resumen["precios"] = len(precios)
+
+    comprar = [op for j in juegos
+               for op in valorar_partido(j, precios, liga_de(j["liga"]), umbral_emision(liga_de(j["liga"])))
+               if any(c.acepta(op) for c in CARTERAS)]
+    resumen["comprar"] = len(comprar)
+
+    with _rescoring_lock:
+        nuevas = [op for op in comprar if op.token_id not in _cruzando]
+        _cruzando.clear()
+        _cruzando.update(op.token_id for op in comprar)
+
+    resumen["nuevas"] = len(nuevas)
+    for op in nuevas:
+        log.info(f"📈 Re-scoring: {op.equipo} ({op.partido}) cruza NEA {op.nea:+.1f}")
+        resumen["aperturas"] += abrir_en_carteras(op)
+
+    resumen["duracion_seg"] = round(time.monotonic() - t0, 2)
+    return resumen
+
+
+def marcar_cruzando(oportunidades: list[Opportunity]):
+    """Tras un scan completo, sus señales COMPRAR cuentan como ya cruzadas."""
+    with _rescoring_lock:
+        _cruzando.clear()
+        _cruzando.update(op.token_id for op in oportunidades if any(c.acepta(op) for c in CARTERAS))
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MÓDULO 5 — GESTIÓN DE POSICIONES
+# ══════════════════════════════════════════════════════════════════════════════
+
+# ── Simulador de ejecución sobre el order book ────────────────────────────────
+# En modo "book" las entradas recorren los asks y las salidas los bids del
+# libro CLOB hasta cubrir el monto/shares, y se llena al VWAP resultante.
+# Los libros se cachean EJECUCION_BOOK_TTL segundos. En modo "mid" (o si no
+# hay libro) se llena al midpoint, como antes.
+
+@dataclass(slots=True)
+class Book:
+    bids: list[tuple[float, float]]     # (precio, size) del mejor al peor
+    asks: list[tuple[float, float]]
+
+    @property
+    def best_bid(self) -> float | None:
+        return self.bids[0][0] if self.bids else None
+
+    @property
+    def best_ask(self) -> float | None:
+        return self.asks[0][0] if self.asks else None
+
+    @property
+    def spread(self) -> float | None:
+        if self.best_bid is None or self.best_ask is None:
+            return None
+        return round(self.best_ask - self.best_bid, 4)
+
+    @property
+    def profundidad_usd(self) -> float:
+        """USD en el mejor nivel del lado más delgado (entrada por asks, salida por bids)."""
+        if not self.bids or not self.asks:
+            return 0.0
+        return round(min(self.bids[0][0] * self.bids[0][1], self.asks[0][0] * self.asks[0][1]), 2)
+
+    def motivo_iliquido(self) -> str | None:
+        """None si el libro pasa los filtros LIQ_*; si no, el motivo."""
+        if self.spread is None:
+            return "libro vacío"
+        if self.spread > LIQ_MAX_SPREAD:
+            return f"spread {self.spread:.3f} > {LIQ_MAX_SPREAD}"
+        if self.profundidad_usd < LIQ_MIN_PROFUNDIDAD:
+            return f"profundidad ${self.profundidad_usd} < ${LIQ_MIN_PROFUNDIDAD}"
+        return None
+
+    @classmethod
+    def from_clob(cls, data: dict) -> "Book":
+        niveles = lambda lado: [(float(n["price"]), float(n["size"])) for n in data.get(lado) or []]
+        return cls(
+            bids=sorted(niveles("bids"), key=lambda n: n[0], reverse=True),
+            asks=sorted(niveles("asks"), key=lambda n: n[0]),
+        )
+
+
+@dataclass(slots=True)
+class Fill:
+    precio:    float        # VWAP
+    shares:    float
+    monto_usd: float
+    slippage:  float        # % respecto del precio de referencia (positivo = peor)
+    completo:  bool
+    niveles:   int
+    fuente:    str          # "book" | "mid"
+    sin_llenar: float = 0.0     # shares de una venta que el libro no absorbió (valoradas al mid)
+
+
+class SimuladorEjecucion:
+    def __init__(self, base_url: str = CLOB_API, ttl: float = EJECUCION_BOOK_TTL,
+                 modo: str = EJECUCION_MODO, session: requests.Session | None = None):
+        self.base_url = base_url
+        self.modo     = modo
+        self.session  = session or SESSION
+        self._books   = CacheTTL(ttl)
+        self._snapshot = CacheTTL(LIQ_SNAPSHOT_TTL)
+
+    def snapshot(self, token_ids: list[str], lote: int = 50) -> dict[str, Book]:
+        """
+        Snapshot de microestructura en bulk (POST /books) para todos los
+        candidatos de un scan. Se conserva LIQ_SNAPSHOT_TTL segundos y también
+        alimenta la caché de libros que usan los fills.
+        """
+        resultado, faltan = {}, []
+        for tid in dict.fromkeys(token_ids):
+            book = self._snapshot.get(tid)
+            if book is not None:
+                resultado[tid] = book
+            else:
+                faltan.append(tid)
+
+        def _lote(tids: list[str]) -> list[dict]:
+            r = self.session.post(f"{self.base_url}/books",
+                                  json=[{"token_id": t} for t in tids], timeout=10)
+            r.raise_for_status()
+            return r.json()
+
+        lotes = [faltan[i:i + lote] for i in range(0, len(faltan), lote)]
+        if lotes:
+            with ThreadPoolExecutor(max_workers=min(len(lotes), 4)) as pool:
+                for fut in as_completed([pool.submit(_lote, l) for l in lotes]):
+                    try:
+                        datos = fut.result()
+                    except Exception as e:
+                        log.warning(f"Snapshot de libros falló: {e}")
+                        continue
+                    for d in datos or []:
+                        tid = d.get("asset_id")
+                        if not tid:
+                            continue
+                        book = Book.from_clob(d)
+                        self._snapshot.set(tid, book)
+                        self._books.set(tid, book)
+                        resultado[tid] = book
+        return resultado
+
+    def micro(self, token_id: str) -> Book | None:
+        """Libro del último snapshot del scan; si no hay, se pide uno."""
+        return self._snapshot.get(token_id) or self.book(token_id)
+
+    def book(self, token_id: str) -> Book | None:
+        book = self._books.get(token_id)
+        if book is not None:
+            return book
+        try:
+            r = self.session.get(f"{self.base_url}/book", params={"token_id": token_id}, timeout=8)
+            r.raise_for_status()
+            book = Book.from_clob(r.json())
+        except Exception as e:
+            log.warning(f"Sin order book para {token_id[:10]}…: {e}")
+            return None
+        self._books.set(token_id, book)
+        return book
+
+    def cachear(self, token_id: str, book: Book):
+        self._books.set(token_id, book)
+
+    @staticmethod
+    def _slippage(vwap: float, ref: float, compra: bool) -> float:
+        if not ref:
+            return 0.0
+        return round(((vwap - ref) if compra else (ref - vwap)) / ref * 100, 4)
+
+    def comprar(self, token_id: str, monto_usd: float, precio_ref: float) -> Fill | None:
+        """Compra por `monto_usd` recorriendo los asks."""
+        book = self.book(token_id) if self.modo == "book" else None
+        if book is None or not book.asks:
+            return Fill(precio_ref, monto_usd / precio_ref, monto_usd, 0.0, True, 0, "mid")
+
+        restante, shares, gastado, niveles = monto_usd, 0.0, 0.0, 0
+        for precio, size in book.asks:
+            if restante <= 1e-9:
+                break
+            usd_nivel = min(precio * size, restante)
+            shares   += usd_nivel / precio
+            gastado  += usd_nivel
+            restante -= usd_nivel
+            niveles  += 1
+        if shares <= 0:
+            return None
+        vwap = gastado / shares
+        return Fill(vwap, shares, gastado, self._slippage(vwap, precio_ref, True),
+                    restante <= 1e-9, niveles, "book")
+
+    def vender(self, token_id: str, shares: float, precio_ref: float) -> Fill:
+        """
+        Vende `shares` recorriendo los bids. Lo que el libro no absorbe se
+        valora a `precio_ref` (el mid) y se informa en `sin_llenar`: valorarlo
+        a 0 registraría en libros finos pérdidas que no existen.
+        """
+        book = self.book(token_id) if self.modo == "book" else None
+        if book is None or not book.bids:
+            return Fill(precio_ref, shares, shares * precio_ref, 0.0, True, 0, "mid")
+
+        restante, cobrado, niveles = shares, 0.0, 0
+        for precio, size in book.bids:
+            if restante <= 1e-9:
+                break
+            qty       = min(size, restante)
+            cobrado  += qty * precio
+            restante -= qty
+            niveles  += 1
+        restante = restante if restante > 1e-9 else 0.0
+        monto = cobrado + restante * precio_ref
+        # Precio efectivo sobre todas las shares (las no vendidas, al mid)
+        efectivo = monto / shares if shares > 0 else 0.0
+        return Fill(efectivo, shares, monto, self._slippage(efectivo, precio_ref, False),
+                    restante == 0.0, niveles, "book" if cobrado > 0 else "mid", round(restante, 6))
+
+
+EJECUCION = SimuladorEjecucion()
+
+
+# ── Motor de riesgo ───────────────────────────────────────────────────────────
+# Tamaño por trade según SIZING_MODO y límites de exposición por partido,
+# equipo, día ET y cartera, expresados como fracción del capital actual
+# (capital inicial + PnL cerrado). Cada cartera mantiene un índice en memoria
+# de sus posiciones abiertas, así que cada decisión es O(1).
+
+def tamano_posicion(modo: str, capital: float, precio: float, nea: float,
+                    riesgo_por_trade: float) -> float:
+    """
+    USD a arriesgar en un trade COMPRAR a `precio` (0–1) con NEA `nea`.
+      - fijo:        capital * riesgo_por_trade
+      - kelly:       KELLY_FRACCION * f*, con p = precio − nea/100 (el valor
+                     real) y f* = (p − precio) / (1 − precio)
+      - volatilidad: riesgo_por_trade escalado por 0.5 / σ, σ = √(precio·(1−precio))
+    Siempre con tope SIZING_MAX_PCT del capital.
+    """
+    if not 0 < precio < 1:
+        return 0.0
+    if modo == "kelly":
+        p = min(max(precio - nea / 100, 0.0), 1.0)
+        fraccion = KELLY_FRACCION * max((p - precio) / (1 - precio), 0.0)
+    elif modo == "volatilidad":
+        fraccion = riesgo_por_trade * 0.5 / (precio * (1 - precio)) ** 0.5
+    else:
+        fraccion = riesgo_por_trade
+    return round(capital * min(fraccion, SIZING_MAX_PCT), 2)
+
+
+class IndiceExposicion:
+    """USD comprometidos por partido, equipo, día de apertura y total (posiciones abiertas)."""
+
+    def __init__(self, abiertas: list[Position] = ()):
+        self._lock       = threading.Lock()
+        self.tokens      = set()
+        self.por_partido = {}
+        self.por_equipo  = {}
+        self.por_dia     = {}
+        self.total       = 0.0
+        for pos in abiertas:
+            self.agregar(pos)
+
+    def _mover(self, pos: Position, signo: int):
+        monto  = signo * pos.monto_usd
+        equipo = equipo_base(pos.equipo, pos.mercado)
+        claves = [(self.por_partido, pos.partido), (self.por_dia, pos.opened_at[:10])]
+        if equipo:
+            claves.append((self.por_equipo, equipo))
+        for tabla, clave in claves:
+            valor = round(tabla.get(clave, 0.0) + monto, 6)
+            if valor > 1e-9:
+                tabla[clave] = valor
+            else:
+                tabla.pop(clave, None)
+        self.total = round(max(self.total + monto, 0.0), 6)
+
+    def agregar(self, pos: Position):
+        with self._lock:
+            if pos.token_id in self.tokens:
+                return
+            self.tokens.add(pos.token_id)
+            self._mover(pos, 1)
+
+    def quitar(self, pos: Position):
+        with self._lock:
+            if pos.token_id not in self.tokens:
+                return
+            self.tokens.discard(pos.token_id)
+            self._mover(pos, -1)
+
+    def disponible(self, oportunidad: Opportunity, capital: float, hoy: str) -> tuple[float, str]:
+        """USD que aún admiten los límites para esta oportunidad y el límite más restrictivo."""
+        equipo = equipo_base(oportunidad.equipo, oportunidad.mercado)
+        with self._lock:
+            margenes = [
+                (EXPOSICION_MAX_PARTIDO * capital - self.por_partido.get(oportunidad.partido, 0.0), "partido"),
+                (EXPOSICION_MAX_DIA * capital - self.por_dia.get(hoy, 0.0), "día"),
+                (EXPOSICION_MAX_TOTAL * capital - self.total, "cartera"),
+            ]
+            if equipo:
+                margenes.append((EXPOSICION_MAX_EQUIPO * capital - self.por_equipo.get(equipo, 0.0), "equipo"))
+        margen, limite = min(margenes)
+        return max(margen, 0.0), limite
+
+    def resumen(self) -> dict:
+        with self._lock:
+            return {
+                "abiertas":   len(self.tokens),
+                "total_usd":  round(self.total, 4),
+                "partidos":   len(self.por_partido),
+                "max_partido_usd": round(max(self.por_partido.values(), default=0.0), 4),
+                "hoy_usd":    round(self.por_dia.get(datetime.now(ET).date().isoformat(), 0.0), 4),
+            }
+
+
+# ── Carteras: principal y estrategias sombra ─────────────────────────────────
+# Cada cartera es un libro de paper trading independiente con su propia
+# configuración, archivos y estadísticas. Todas se alimentan del mismo scan y
+# de la misma lectura de precios: agregar estrategias no agrega requests a
+# Gamma, CLOB ni Gemini. La cartera "principal" usa los archivos de siempre
+# (positions.json, archive/, aggregates.json); las sombras viven en
+# estrategias/<nombre>/ y se configuran con ESTRATEGIAS_SOMBRA.
+
+@dataclass(slots=True)
+class ConfigEstrategia:
+    nombre:             str
+    nea_umbral:         float | None = None     # None → umbral de la liga
+    valor_real_minimo:  float | None = None     # None → mínimo de la liga
+    take_profit_precio: float = TAKE_PROFIT_PRECIO
+    stop_fraccion:      float = 0.50            # SL = entrada * stop_fraccion
+    riesgo_por_trade:   float = RIESGO_POR_TRADE
+    capital_total:      float = CAPITAL_TOTAL
+    sizing_modo:        str = SIZING_MODO
+
+    def umbral(self, liga: Liga) -> float:
+        return liga.nea_umbral if self.nea_umbral is None else self.nea_umbral
+
+    def minimo(self, liga: Liga) -> float:
+        return liga.valor_real_minimo if self.valor_real_minimo is None else self.valor_real_minimo
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ConfigEstrategia":
+        return cls(**{k: d[k] for k in cls.__slots__ if k in d})
+
+
+class Cartera:
+    def __init__(self, config: ConfigEstrategia, positions_file: str, archive_dir: str,
+                 stats: EstadisticasPortafolio):
+        self.config         = config
+        self.positions_file = positions_file
+        self.archive_dir    = archive_dir
+        self.stats          = stats
+        self._tag           = "" if config.nombre == "principal" else f"[{config.nombre}] "
+        self._indice        = None
+        self._indice_lock   = threading.Lock()
+        self._historial     = None
+        self._version       = None     # versión de positions.json que reflejan índice e historial
+        self._firma         = None
+
+    @classmethod
+    def en_directorio(cls, config: ConfigEstrategia, directorio: str) -> "Cartera":
+        archive_dir = os.path.join(directorio, "archive")
+        os.makedirs(archive_dir, exist_ok=True)
+        stats = EstadisticasPortafolio.cargar(os.path.join(directorio, "aggregates.json"),
+                                              archive_dir=archive_dir, capital=config.capital_total)
+        return cls(config, os.path.join(directorio, "positions.json"), archive_dir, stats)
+
+    # ── Persistencia ─────────────────────────────────────────────────────────
+    def load_positions(self) -> list[Position]:
+        return load_positions(self.positions_file)
+
+    def save_positions(self, positions: list[Position]):
+        save_positions(positions, self.positions_file, al_commit=self._al_commit)
+
+    def transaccion(self, fn):
+        return transaccion_posiciones(fn, self.positions_file, al_commit=self._al_commit)
+
+    def _al_commit(self, leida: int | None, escrita: int):
+        # Si la transacción partió de la versión que reflejan los índices, el
+        # llamador les aplica su propio cambio; si no, otro proceso escribió
+        # en el medio y se reconstruyen en el próximo acceso.
+        if leida is None or leida != self._version:
+            self._indice = self._historial = None
+        self._version = escrita
+        self._firma = _firma_archivo(self.positions_file)
+
+    def _sincronizar(self):
+        """Descarta índice e historial si otro proceso (p. ej. la CLI) escribió positions.json."""
+        firma = _firma_archivo(self.positions_file)
+        if firma == self._firma:
+            return
+        with _file_lock:
+            version = _version_actual(self.positions_file)
+            if version != self._version:
+                self._indice = self._historial = None
+                self._version = version
+            self._firma = _firma_archivo(self.positions_file)
+
+    def retirar(self, cierres: dict[str, Position], marcar=None,
+                registrar: bool = True) -> tuple[list[Position], list[Position]]:
+        """
+        Archiva `cierres` (id → posición ya cerrada) y después, en una
+        transacción, las quita de positions.json; `marcar(pos)` se aplica al
+        resto de las abiertas (sin efectos externos). Registra en stats solo
+        los cierres que esta llamada quitó (ninguno con registrar=False).
+        Retorna (retiradas, posiciones escritas + retiradas).
+        """
+        archivar_posiciones(list(cierres.values()), self.archive_dir)
+
+        def _tx(positions):
+            retiradas, quedan = [], []
+            for pos in positions:
+                if pos.id in cierres:
+                    retiradas.append(cierres[pos.id])
+                    continue
+                if marcar is not None and pos.status == "OPEN":
+                    marcar(pos)
+                quedan.append(pos)
+            if not retiradas and marcar is None:
+                return None, ([], positions)
+            return quedan, (retiradas, quedan + retiradas)
+
+        retiradas, actualizadas = self.transaccion(_tx)
+        if registrar:
+            for pos in retiradas:
+                self.stats.registrar_cierre(pos)
+        return retiradas, actualizadas
+
+    def compactar(self):
+        # vigente() se evalúa antes de archivar: registrar los cierres
+        # escribiría aggregates.json con la versión actual y la reconstrucción
+        # (que además cuenta las aperturas) no correría nunca.
+        vigente = self.stats.vigente()
+        positions = self.load_positions()
+        cerradas = {p.id: p for p in positions if p.status != "OPEN"}
+        if cerradas:
+            retiradas, _ = self.retirar(cerradas, registrar=vigente)
+            log.info(f"🗄 {self._tag}{len(retiradas)} posición(es) cerrada(s) archivada(s)")
+        if not vigente:
+            self.stats.reconstruir([p for p in self.load_positions() if p.status == "OPEN"])
+
+    # ── Riesgo ───────────────────────────────────────────────────────────────
+    @property
+    def indice(self) -> IndiceExposicion:
+        self._sincronizar()
+        if self._indice is None:
+            with self._indice_lock:
+                if self._indice is None:
+                    self._indice = IndiceExposicion(
+                        [p for p in self.load_positions() if p.status == "OPEN"])
+        return self._indice
+
+    # ── Consultas ────────────────────────────────────────────────────────────
+    @property
+    def historial(self) -> IndiceRegistros:
+        """Índice de consultas sobre abiertas + archivadas; se mantiene en cada escritura."""
+        self._sincronizar()
+        if self._historial is None:
+            with self._indice_lock:
+                if self._historial is None:
+                    archivadas = iter_archivo_posiciones(archive_dir=self.archive_dir)
+                    self._historial = nuevo_indice_posiciones(
+                        [*archivadas, *(p for p in self.load_positions() if p.status == "OPEN")])
+        return self._historial
+
+    def _indexar(self, positions):
+        if self._historial is not None:
+            for pos in positions:
+                self._historial.upsert(registro_posicion(pos))
+
+    def consultar(self, filtros: dict) -> dict:
+        return consultar_indice_posiciones(self.historial, filtros)
+
+    def capital_actual(self) -> float:
+        return self.config.capital_total + self.stats.pnl_total()
+
+    def dimensionar(self, oportunidad: Opportunity, precio: float,
+                    capital: float | None = None) -> tuple[float, str | None]:
+        """Monto USD para la oportunidad tras sizing y límites; (0, motivo) si no se abre."""
+        capital = self.capital_actual() if capital is None else capital
+        monto = tamano_posicion(self.config.sizing_modo, capital, precio,
+                                oportunidad.nea, self.config.riesgo_por_trade)
+        if monto <= 0:
+            return 0.0, f"sizing {self.config.sizing_modo} sin edge"
+        margen, limite = self.indice.disponible(oportunidad, capital, datetime.now(ET).date().isoformat())
+        if margen < monto:
+            if margen < RIESGO_MONTO_MIN:
+                return 0.0, f"límite de exposición por {limite}"
+            monto = round(margen, 2)
+        return monto, None
+
+    # ── Operativa ────────────────────────────────────────────────────────────
+    def acepta(self, oportunidad: Opportunity) -> bool:
+        """True si la oportunidad es COMPRAR según el umbral de esta cartera."""
+        return oportunidad.nea <= -self.config.umbral(liga_de(oportunidad.liga))
+
+    def abrir(self, oportunidad: Opportunity) -> Position | None:
+        """
+        Simula apertura de posición con las siguientes reglas:
+          - Solo señales COMPRAR (NEA ≤ −umbral de la cartera)
+          - Valor real debe ser > valor_real_minimo (0.40 por defecto)
+          - Tamaño: según sizing_modo (fijo = 1% del capital) y límites de exposición
+          - Libro con spread ≤ LIQ_MAX_SPREAD y profundidad ≥ LIQ_MIN_PROFUNDIDAD
+          - Entrada al VWAP del libro (EJECUCION_MODO=book) o al midpoint
+          - Take Profit: precio fijo take_profit_precio (0.42 por defecto)
+          - Stop Loss: entrada * stop_fraccion (50% por defecto)
+        """
+        cfg = self.config
+        if not self.acepta(oportunidad):
+            return None
+
+        # Filtro: valor real mínimo 0.40 (configurable por liga / cartera)
+        minimo = cfg.minimo(liga_de(oportunidad.liga))
+        valor_real_decimal = oportunidad.valor_real / 100
+        if valor_real_decimal <= minimo:
+            log.info(f"⏭ {self._tag}SKIP {oportunidad.equipo}: valor real {valor_real_decimal:.2f} ≤ {minimo} (muy bajo)")
+            return None
+
+        # Evitar duplicados
+        if oportunidad.token_id in self.indice.tokens:
+            for p in self.load_positions():
+                if p.token_id == oportunidad.token_id and p.status == "OPEN":
+                    log.info(f"{self._tag}Posición ya abierta para {oportunidad.equipo}")
+                    return p
+
+        precio_mid = oportunidad.p_poly / 100
+        capital = self.capital_actual()
+        monto_usd, motivo = self.dimensionar(oportunidad, precio_mid, capital)
+        if motivo:
+            log.info(f"⏭ {self._tag}SKIP {oportunidad.equipo}: {motivo}")
+            return None
+
+        if LIQ_FILTRO:
+            book = EJECUCION.micro(oportunidad.token_id)
+            motivo = book.motivo_iliquido() if book else None
+            if motivo:
+                log.info(f"⏭ {self._tag}SKIP {oportunidad.equipo}: ilíquido ({motivo})")
+                return None
+
+        fill = EJECUCION.comprar(oportunidad.token_id, monto_usd, precio_mid)
+        if fill is None or fill.monto_usd < monto_usd * EJECUCION_MIN_FILL:
+            log.info(f"⏭ {self._tag}SKIP {oportunidad.equipo}: profundidad insuficiente para ${monto_usd}")
+            return None
+        precio_entrada = fill.precio
+        monto_usd      = round(fill.monto_usd, 4)
+
+        position = Position(
+            id=f"pos_{datetime.now(ET).strftime('%Y%m%d%H%M%S')}_{oportunidad.token_id[:8]}",
+            partido=oportunidad.partido,
+            equipo=oportunidad.equipo,
+            token_id=oportunidad.token_id,
+            precio_entrada=round(precio_entrada, 4),
+            precio_actual=round(precio_entrada, 4),
+            valor_real=round(valor_real_decimal, 4),
+            nea_entrada=oportunidad.nea,
+            take_profit=round(cfg.take_profit_precio, 4),              # TP fijo: 0.42
+            stop_loss=round(precio_entrada * cfg.stop_fraccion, 4),    # SL = 50% del precio de entrada
+            monto_usd=monto_usd,                                       # $1.00 (1% de $100) en modo fijo
+            hora_partido=oportunidad.hora,
+            status="OPEN",
+            opened_at=datetime.now(ET).isoformat(),
+            liga=oportunidad.liga,
+            mercado=oportunidad.mercado,
+            shares=round(fill.shares, 6),
+            slippage_entrada=fill.slippage,
+        )
+        position.price_history.append(datetime.now(ET).isoformat(), precio_entrada)
+
+        hoy = datetime.now(ET).date().isoformat()
+
+        def _tx(positions):
+            for p in positions:
+                if p.token_id == position.token_id and p.status == "OPEN":
+                    return None, p
+            # Los límites se vuelven a verificar contra lo que se va a
+            # escribir: otro hilo (scan / re-scoring) u otro proceso pudo
+            # abrir en el mismo partido después de dimensionar.
+            exposicion = IndiceExposicion([p for p in positions if p.status == "OPEN"])
+            margen, limite = exposicion.disponible(oportunidad, capital, hoy)
+            if margen + 1e-6 < position.monto_usd:
+                return None, limite
+            return positions + [position], position
+
+        guardada = self.transaccion(_tx)
+        if isinstance(guardada, str):
+            log.info(f"⏭ {self._tag}SKIP {oportunidad.equipo}: límite de exposición por {guardada}")
+            return None
+        if guardada is not position:
+            log.info(f"{self._tag}Posición ya abierta para {oportunidad.equipo}")
+            return guardada
+        self.indice.agregar(position)
+        self._indexar([position])
+        self.stats.registrar_apertura(position)
+        log.info(
+            f"✅ {self._tag}POSICIÓN ABIERTA: {position.equipo} | "
+            f"Entrada: {precio_entrada:.2%} (slippage {fill.slippage:+.2f}%) | "
+            f"TP: {cfg.take_profit_precio:.2%} | "
+            f"SL: {position.stop_loss:.2%} | "
+            f"Monto: ${monto_usd}"
+        )
+        return position
+
+    def actualizar(self, precios: dict[str, float]):
+        """
+        Marca a mercado las posiciones abiertas con `precios` y ejecuta:
+          - Take Profit: precio_actual >= take_profit
+          - Stop Loss:   precio_actual <= stop_loss
+        """
+        # Los fills de salida piden el libro por red: se calculan sobre una
+        # lectura previa, fuera de la transacción.
+        abiertas = [p for p in self.load_positions() if p.status == "OPEN"]
+        cierres = {}
+        for pos in abiertas:
+            precio_actual = precios.get(pos.token_id)
+            if precio_actual is None:
+                continue
+            # Take Profit: precio sube hasta 0.42 / Stop Loss: cae al 50% de la entrada
+            motivo = ("TAKE_PROFIT" if precio_actual >= pos.take_profit
+                      else "STOP_LOSS" if precio_actual <= pos.stop_loss else None)
+            if motivo:
+                _marcar_a_mercado(pos, precio_actual)
+                _cerrar_posicion(pos, motivo, precio_actual)
+                cierres[pos.id] = pos
+
+        sin_precio = [p.token_id for p in abiertas if p.token_id not in precios]
+        if len(sin_precio) == len(abiertas):
+            cerradas, actualizadas = [], []
+        else:
+            def _marcar(pos):
+                if pos.token_id in precios:
+                    _marcar_a_mercado(pos, precios[pos.token_id])
+
+            cerradas, actualizadas = self.retirar(cierres, _marcar)
+        self._indexar(actualizadas)
+        for token_id in sin_precio:
+            log.warning(f"{self._tag}Sin precio para token {token_id}")
+
+        for pos in cerradas:
+            self.indice.quitar(pos)
+            if pos.close_reason == "TAKE_PROFIT":
+                log.info(
+                    f"🎯 {self._tag}TAKE PROFIT: {pos.equipo} | "
+                    f"{pos.precio_entrada:.2%} → {pos.precio_salida:.2%} | "
+                    f"PnL: {pos.pnl_pct:+.2f}% (${pos.pnl_usd:+.4f})"
+                )
+            else:
+                log.info(
+                    f"🛑 {self._tag}STOP LOSS: {pos.equipo} | "
+                    f"{pos.precio_entrada:.2%} → {pos.precio_salida:.2%} | "
+                    f"PnL: {pos.pnl_pct:+.2f}% (${pos.pnl_usd:+.4f})"
+                )
+
+    def liquidar(self, resueltos: dict[str, float]) -> list[Position]:
+        """Cierra con motivo SETTLED las posiciones abiertas cuyo token está en `resueltos` (token → valor)."""
+        cierres = {}
+        for pos in self.load_positions():
+            if pos.status == "OPEN" and pos.token_id in resueltos:
+                _liquidar_posicion(pos, resueltos[pos.token_id])
+                cierres[pos.id] = pos
+        if not cierres:
+            return []
+
+        liquidadas, actualizadas = self.retirar(cierres)
+        self._indexar(actualizadas)
+        for pos in liquidadas:
+            self.indice.quitar(pos)
+            log.info(
+                f"🏁 {self._tag}SETTLED: {pos.equipo} | "
+                f"{pos.precio_entrada:.2%} → {pos.precio_salida:.0%} | "
+                f"PnL: {pos.pnl_pct:+.2f}% (${pos.pnl_usd:+.4f})"
+            )
+        return liquidadas
+
+    def resumen(self) -> dict:
+        abiertas = self.load_positions()
+        return {
+            "nombre":     self.config.nombre,
+            "config":     self.config.to_dict(),
+            "stats":      self.stats.snapshot(total_open=len(abiertas)),
+            "exposicion": self.indice.resumen(),
+        }
+
+
+def _marcar_a_mercado(pos: Position, precio_actual: float):
+    pos.precio_actual = round(precio_actual, 4)
+
+    # PnL en % y en USD (mark-to-market al mid)
+    pnl_usd = pos.shares * precio_actual - pos.monto_usd
+    pnl_pct = pnl_usd / pos.monto_usd * 100 if pos.monto_usd else 0.0
+    pos.pnl_pct = round(pnl_pct, 2)
+    pos.pnl_usd = round(pnl_usd, 4)
+
+    # Historial de precios (máx 48 puntos)
+    pos.price_history.append(datetime.now(ET).isoformat(), precio_actual)
+    pos.price_history.recortar(48)
+
+
+def _cerrar_posicion(pos: Position, motivo: str, precio_mid: float):
+    """Cierra la posición vendiendo sus shares contra el libro (o al mid)."""
+    fill = EJECUCION.vender(pos.token_id, pos.shares, precio_mid)
+    pos.status          = "CLOSED"
+    pos.closed_at       = datetime.now(ET).isoformat()
+    pos.close_reason    = motivo
+    pos.precio_salida   = round(fill.precio, 4)
+    pos.slippage_salida = fill.slippage
+    pos.pnl_usd = round(fill.monto_usd - pos.monto_usd, 4)
+    pos.pnl_pct = round(pos.pnl_usd / pos.monto_usd * 100, 2) if pos.monto_usd else 0.0
+    if fill.sin_llenar:
+        pos.extra["shares_sin_liquidez"] = fill.sin_llenar
+        log.warning(f"💧 {pos.equipo}: {fill.sin_llenar:.2f} de {pos.shares:.2f} shares sin bids, "
+                    f"valoradas al mid {precio_mid:.2%}")
+
+
+def _liquidar_posicion(pos: Position, valor: float):
+    """Cierra la posición al valor de resolución del mercado: no pasa por el libro."""
+    pos.status          = "CLOSED"
+    pos.closed_at       = datetime.now(ET).isoformat()
+    pos.close_reason    = "SETTLED"
+    pos.precio_actual   = valor
+    pos.precio_salida   = valor
+    pos.slippage_salida = 0.0
+    pos.pnl_usd = round(pos.shares * valor - pos.monto_usd, 4)
+    pos.pnl_pct = round(pos.pnl_usd / pos.monto_usd * 100, 2) if pos.monto_usd else 0.0
+
+
+def _cargar_carteras() -> list[Cartera]:
+    principal = Cartera(ConfigEstrategia("principal"), POSITIONS_FILE, ARCHIVE_DIR, ESTADISTICAS)
+    carteras = [principal]
+    if not ESTRATEGIAS_SOMBRA.strip():
+        return carteras
+    try:
+        configs = [ConfigEstrategia.from_dict(d) for d in json.loads(ESTRATEGIAS_SOMBRA)]
+    except (ValueError, TypeError) as e:
+        log.error(f"ESTRATEGIAS_SOMBRA inválido, se ignora: {e}")
+        return carteras
+    for cfg in configs:
+        if not re.fullmatch(r"[\w-]+", cfg.nombre) or cfg.nombre == "principal" \
+                or any(c.config.nombre == cfg.nombre for c in carteras):
+            log.error(f"Estrategia sombra con nombre inválido o repetido: {cfg.nombre!r}")
+            continue
+        carteras.append(Cartera.en_directorio(cfg, os.path.join(SOMBRAS_DIR, cfg.nombre)))
+    return carteras
+
+
+CARTERAS  = _cargar_carteras()
+PRINCIPAL = CARTERAS[0]
+
+
+def umbral_emision(liga: Liga) -> float:
+    """Menor umbral NEA entre todas las carteras: lo que el scan debe emitir."""
+    return min(c.config.umbral(liga) for c in CARTERAS)
+
+
+def abrir_posicion(oportunidad: Opportunity, cartera: Cartera | None = None) -> Position | None:
+    """Abre la oportunidad en la cartera principal (o en `cartera`)."""
+    return (cartera or PRINCIPAL).abrir(oportunidad)
+
+
+def abrir_en_carteras(oportunidad: Opportunity) -> int:
+    """Ofrece la oportunidad a todas las carteras. Retorna cuántas abrieron."""
+    return sum(1 for c in CARTERAS
+               if c.acepta(oportunidad) and c.abrir(oportunidad) is not None)
+
+
+# ── Liquidación de mercados resueltos ─────────────────────────────────────────
+# Un partido terminado deja su mercado cerrado en Gamma con outcomePrices en
+# 0/1 (o 0.5/0.5 si se anuló). Antes de pedir precios, el monitoreo consulta
+# en bloque los mercados detrás de las posiciones abiertas y cierra las
+# resueltas con motivo SETTLED al valor resuelto, así el set monitoreado queda
+# acotado a partidos vivos.
+
+def _valor_resuelto(mercado: dict, token_id: str) -> float | None:
+    if not mercado.get("closed"):
+        return None
+    tokens = extraer_token_ids(mercado)
+    raw = mercado.get("outcomePrices", "[]")
+    try:
+        valores = [float(v) for v in (json.loads(raw) if isinstance(raw, str) else raw)]
+    except (TypeError, ValueError):
+        return None
+    if token_id not in tokens or len(valores) != len(tokens):
+        return None
+    valor = valores[tokens.index(token_id)]
+    resuelto = mercado.get("umaResolutionStatus") == "resolved" or all(min(v, 1 - v) < 1e-3 for v in valores)
+    return valor if resuelto else None
+
+
+def mercados_resueltos(tokens: list[str]) -> dict[str, float]:
+    """{token_id: valor de resolución (outcomePrices)} para los tokens cuyo mercado ya resolvió."""
+    resueltos = {}
+    for i in range(0, len(tokens), LIQUIDACION_LOTE):
+        lote = tokens[i:i + LIQUIDACION_LOTE]
+        try:
+            r = SESSION.get(f"{GAMMA_API}/markets",
+                            params={"clob_token_ids": lote, "closed": "true", "limit": len(lote)},
+                            timeout=15)
+            r.raise_for_status()
+            mercados = r.json()
+        except Exception as e:
+            log.warning(f"Liquidación: error consultando {len(lote)} mercado(s) en Gamma: {e}")
+            continue
+        for mercado in mercados if isinstance(mercados, list) else []:
+            for tid in extraer_token_ids(mercado):
+                if tid in lote:
+                    valor = _valor_resuelto(mercado, tid)
+                    if valor is not None:
+                        resueltos[tid] = valor
+    return resueltos
+
+
+def liquidar_resueltas(tokens: list[str]) -> set[str]:
+    """Cierra en todas las carteras las posiciones de mercados resueltos; retorna sus tokens."""
+    resueltos = mercados_resueltos(tokens) if LIQUIDACION_ACTIVA else {}
+    if resueltos:
+        total = sum(len(c.liquidar(resueltos)) for c in CARTERAS)
+        log.info(f"🏁 Liquidación: {len(resueltos)} token(s) resuelto(s), {total} posición(es) cerrada(s)")
+    return set(resueltos)
+
+
+def actualizar_posiciones():
+    """
+    Liquida las posiciones de mercados ya resueltos y, para el resto, lee una
+    sola vez los precios de todos los tokens abiertos en cualquier cartera y
+    actualiza cada una (TP/SL) con esos precios.
+    """
+    tokens = sorted({p.token_id for c in CARTERAS for p in c.load_positions() if p.status == "OPEN"})
+    if tokens:
+        liquidados = liquidar_resueltas(tokens)
+        tokens = [t for t in tokens if t not in liquidados]
+    if not tokens:
+        log.info("Sin posiciones abiertas para monitorear.")
+        return
+
+    precios = obtener_precios_paralelo(tokens, usar_cache=True)
+    for cartera in CARTERAS:
+        cartera.actualizar(precios)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MÓDULO 6 — SCHEDULER
+# ══════════════════════════════════════════════════════════════════════════════
+
+def ciclo_scan_y_posiciones(ligas: list[Liga] | None = None) -> dict:
+    """Ejecuta scan + abre posiciones para oportunidades COMPRAR en cada cartera."""
+    oportunidades = ejecutar_scan(ligas)
+    marcar_cruzando(oportunidades)
+
+    aperturas = sum(abrir_en_carteras(op) for op in oportunidades)
+
+    state = load_state()
+    state["last_scan"]        = datetime.now(ET).isoformat()
+    state["manual_triggered"] = False
+    save_state(state)
+    return {**_resumen_oportunidades(oportunidades), "aperturas": aperturas}
+
+
+def ciclo_monitoreo():
+    """Actualiza precios de posiciones abiertas."""
+    log.info("📡 Actualizando precios de posiciones abiertas...")
+    actualizar_posiciones()
+
+
+def ciclo_rescoring():
+    """Re-scoring intradía del slate con precios frescos."""
+    resumen = ejecutar_rescoring()
+    if resumen["partidos"]:
+        log.info(
+            f"📈 Re-scoring: {resumen['partidos']} partido(s), {resumen['comprar']} COMPRAR, "
+            f"{resumen['nuevas']} nueva(s), {resumen['aperturas']} apertura(s) en {resumen['duracion_seg']}s"
+        )
+    state = load_state()
+    state["last_rescore"] = resumen
+    save_state(state)
+
+
+def _thread_rescoring():
+    """Hilo de re-scoring cada RESCORE_INTERVAL segundos."""
+    while True:
+        time.sleep(RESCORE_INTERVAL)
+        try:
+            ciclo_rescoring()
+        except Exception as e:
+            log.error(f"Error en re-scoring: {e}")
+
+
+def _thread_scheduler():
+    """Hilo scheduler: scan a las 9AM ET, monitoreo cada MONITOR_INTERVAL segundos."""
+    last_scan_date = None
+
+    while True:
+        now_et = datetime.now(ET)
+        state  = load_state()
+
+        # Verificar si se solicitó scan manual
+        if state.get("manual_triggered"):
+            log.info("🖐 Scan manual solicitado")
+            ciclo_scan_y_posiciones()
+            last_scan_date = now_et.date()
+
+        # Scan automático a las 9:00 AM ET
+        elif now_et.hour == 9 and now_et.minute < 2:
+            if last_scan_date != now_et.date():
+                log.info("⏰ Scan automático 9AM ET")
+                ciclo_scan_y_posiciones()
+                last_scan_date = now_et.date()
+
+        # Monitoreo de posiciones cada MONITOR_INTERVAL
+        try:
+            ciclo_monitoreo()
+        except Exception as e:
+            log.error(f"Error en monitoreo: {e}")
+
+        time.sleep(MONITOR_INTERVAL)
+
+
+def iniciar_scheduler():
+    threading.Thread(target=calentar, daemon=True).start()
+    t = threading.Thread(target=_thread_scheduler, daemon=True)
+    t.start()
+    if RESCORE_INTERVAL > 0:
+        threading.Thread(target=_thread_rescoring, daemon=True).start()
+    log.info(
+        f"🚀 Scheduler iniciado | Scan: 9AM ET | Monitoreo: cada {MONITOR_INTERVAL}s | "
+        f"Re-scoring: {f'cada {RESCORE_INTERVAL}s' if RESCORE_INTERVAL > 0 else 'off'}"
+    )
+
+
+# ── Arranque en caliente ──────────────────────────────────────────────────────
+# Importar main no toca disco ni red más allá de lo imprescindible; al arrancar,
+# calentar() corre en su propio hilo, en paralelo al scheduler (el primer scan
+# o monitoreo no lo espera), y deja en memoria posiciones, índices de riesgo,
+# el último scan, el estado y los precios de las posiciones abiertas (en
+# CACHE_PRECIOS). /api/ready responde 200 cuando termina, o cuando se agota
+# ARRANQUE_PRESUPUESTO.
+
+ARRANQUE = {"listo": False, "segundos": None, "fases": {}, "error": None}
+
+
+def _fase(nombre: str, fn):
+    t = time.perf_counter()
+    resultado = fn()
+    ARRANQUE["fases"][nombre] = round(time.perf_counter() - t, 3)
+    return resultado
+
+
+def calentar():
+    """Precarga lo que necesita el primer request del dashboard."""
+    try:
+        _fase("compactar", compactar_posiciones)
+        _fase("indices", lambda: [(c.indice, c.historial) for c in CARTERAS])
+        _fase("scans", lambda: (migrar_scan_log(), ultimo_scan(), indice_scans()))
+        _fase("estado", load_state)
+
+        tokens = sorted({tid for c in CARTERAS for tid in c.indice.tokens})
+        restante = ARRANQUE_PRESUPUESTO - (time.monotonic() - _T0_ARRANQUE)
+        if tokens and restante > 0:
+            # Los precios pueden tardar: se esperan solo hasta el presupuesto
+            hilo = threading.Thread(target=obtener_precios_paralelo, args=(tokens, True), daemon=True)
+            t = time.perf_counter()
+            hilo.start()
+            hilo.join(timeout=restante)
+            ARRANQUE["fases"]["precios"] = round(time.perf_counter() - t, 3)
+            if hilo.is_alive():
+                log.warning(f"Arranque: precios de {len(tokens)} token(s) fuera del presupuesto de {ARRANQUE_PRESUPUESTO}s")
+    except Exception as e:
+        ARRANQUE["error"] = str(e)
+        log.error(f"Error en calentamiento: {e}")
+    finally:
+        ARRANQUE["segundos"] = round(time.monotonic() - _T0_ARRANQUE, 3)
+        ARRANQUE["listo"] = True
+        log.info(f"🔥 Listo en {ARRANQUE['segundos']}s | {ARRANQUE['fases']}")
+
+
+def estado_arranque() -> dict:
+    return {**ARRANQUE, "fases": dict(ARRANQUE["fases"]),
+            "uptime_seg": round(time.monotonic() - _T0_ARRANQUE, 1)}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# EXPORTACIÓN — NDJSON / CSV en streaming
+# ══════════════════════════════════════════════════════════════════════════════
+# Todo se genera fila a fila desde el archivo diario y los archivos vivos, así
+# la memoria es constante sin importar el tamaño del historial. Lo usan
+# /api/export/<tipo> (respuesta chunked) y `python main.py export`.
+
+EXPORT_FILAS_CHUNK = 500
+_CAMPOS_POSICION = [k for k in _POSITION_KEYS if k != "price_history"]
+_CAMPOS_SCAN = ["scan_ts", "partido", "equipo", "es_local", "p_poly", "valor_real", "nea", "accion",
+                "hora", "token_id", "liga", "mercado", "linea", "scanned_at", "resumen"]
+_CAMPOS_TICK = ["position_id", "token_id", "equipo", "partido", "ts", "precio"]
+
+
+def _en_rango(ts: str | None, desde: str | None, hasta: str | None) -> bool:
+    dia = (ts or "")[:10]
+    return (not desde or dia >= desde) and (not hasta or dia <= hasta)
+
+
+def _iter_posiciones_cartera(cartera, desde: str | None, hasta: str | None):
+    # Un segmento diario solo contiene cierres de ese día: se leen los del rango
+    # y se filtra por apertura; las abiertas salen de positions.json.
+    for pos in iter_archivo_posiciones(desde, None, archive_dir=cartera.archive_dir):
+        if _en_rango(pos.opened_at, desde, hasta):
+            yield pos
+    for pos in cartera.load_positions():
+        if pos.status == "OPEN" and _en_rango(pos.opened_at, desde, hasta):
+            yield pos
+
+
+def export_posiciones(desde: str | None = None, hasta: str | None = None, cartera=None):
+    for pos in _iter_posiciones_cartera(cartera or PRINCIPAL, desde, hasta):
+        yield registro_posicion(pos)
+
+
+def export_ticks(desde: str | None = None, hasta: str | None = None, cartera=None):
+    """Precios registrados (price_history) de cada posición, un tick por fila."""
+    for pos in _iter_posiciones_cartera(cartera or PRINCIPAL, None, None):
+        for punto in pos.price_history:
+            if _en_rango(punto.ts, desde, hasta):
+                yield {"position_id": pos.id, "token_id": pos.token_id, "equipo": pos.equipo,
+                       "partido": pos.partido, "ts": punto.ts, "precio": punto.price}
+
+
+def export_scans(desde: str | None = None, hasta: str | None = None, cartera=None):
+    for scan in iter_scans(desde, hasta):
+        if _en_rango(scan.ts, desde, hasta):
+            yield from _filas_scan(scan)
+
+
+def _filas_scan(scan: ScanEntry):
+    for op in scan.resultados:
+        yield {"scan_ts": scan.ts, **op.to_dict()}
+
+
+EXPORT_TIPOS = {
+    "positions": (export_posiciones, _CAMPOS_POSICION),
+    "scans":     (export_scans, _CAMPOS_SCAN),
+    "ticks":     (export_ticks, _CAMPOS_TICK),
+}
+
+
+def serializar_export(filas, formato: str, campos: list[str]):
+    """Chunks de texto NDJSON o CSV (con encabezado) cada EXPORT_FILAS_CHUNK filas."""
+    buffer = io.StringIO()
+    if formato == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=campos, extrasaction="ignore")
+        writer.writeheader()
+        escribir = writer.writerow
+    else:
+        escribir = lambda fila: buffer.write(json.dumps(fila, ensure_ascii=False) + "\n")
+    for n, fila in enumerate(filas, 1):
+        escribir(fila)
+        if n % EXPORT_FILAS_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def comprimir_gzip(chunks):
+    """Comprime en streaming (formato gzip) un iterable de chunks de texto."""
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        datos = comp.compress(chunk.encode("utf-8"))
+        if datos:
+            yield datos
+    yield comp.flush()
+
+
+def exportar(tipo: str, formato: str = "ndjson", desde: str | None = None,
+             hasta: str | None = None, gzip: bool = False, cartera: str | None = None):
+    """Generador de bytes del export pedido. ValueError si los parámetros no son válidos."""
+    if tipo not in EXPORT_TIPOS:
+        raise ValueError(f"tipo debe ser uno de: {', '.join(EXPORT_TIPOS)}")
+    if formato not in ("ndjson", "csv"):
+        raise ValueError("formato debe ser ndjson o csv")
+    for fecha in (desde, hasta):
+        if fecha and not re.fullmatch(r"\d{4}-\d{2}-\d{2}", fecha):
+            raise ValueError("desde/hasta deben ser YYYY-MM-DD")
+    cart = next((c for c in CARTERAS if c.config.nombre == (cartera or "principal")), None)
+    if cart is None:
+        raise ValueError(f"cartera desconocida: {cartera}")
+
+    generador, campos = EXPORT_TIPOS[tipo]
+    chunks = serializar_export(generador(desde, hasta, cart), formato, campos)
+    return comprimir_gzip(chunks) if gzip else (c.encode("utf-8") for c in chunks)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CASSETTES — grabación y replay de llamadas externas
+# ══════════════════════════════════════════════════════════════════════════════
+# Con una cassette activa, todo request de SESSION (Gamma, CLOB, books) pasa
+# por un adapter que lo graba o lo sirve desde archivo, y _gemini_generar hace
+# lo mismo con los chunks del stream. El archivo es NDJSON comprimido con gzip,
+# una interacción por línea, con la duración y el desfase de cada chunk para
+# reproducir los tiempos (velocidad 1 = originales, 10 = diez veces más rápido,
+# 0 = sin esperas). En replay las interacciones se emparejan solo por método +
+# URL + cuerpo (o modelo + prompt), en el orden en que se grabaron: un request
+# sin grabación exacta falla y cuenta como faltante, nunca recibe la respuesta
+# de otro request (otro token, otro partido).
+
+def _clave_http(metodo: str, url: str, cuerpo) -> str:
+    if isinstance(cuerpo, str):
+        cuerpo = cuerpo.encode("utf-8")
+    digest = hashlib.sha1(cuerpo or b"").hexdigest()[:16]
+    return f"{metodo} {url} {digest}"
+
+
+def _clave_gemini(modelo: str, prompt: str, esquema) -> str:
+    digest = hashlib.sha1(f"{prompt}|{esquema is not None}".encode("utf-8")).hexdigest()[:16]
+    return f"gemini {modelo} {digest}"
+
+
+class _AdaptadorCassette(requests.adapters.HTTPAdapter):
+    def __init__(self, cassette: "Cassette"):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        clave = _clave_http(request.method, request.url, request.body)
+        if self.cassette.modo == "reproducir":
+            reg = self.cassette.tomar(clave)
+            if reg is None:
+                raise requests.ConnectionError(f"Cassette sin grabación para {request.method} {request.url}")
+            self.cassette.esperar(reg["dur"])
+            if "error" in reg:
+                raise requests.ConnectionError(reg["error"])
+            return self._respuesta(request, reg)
+
+        t = time.perf_counter()
+        try:
+            resp = super().send(request, **kwargs)
+        except requests.RequestException as e:
+            self.cassette.agregar({"clave": clave, "dur": time.perf_counter() - t,
+                                   "error": str(e)})
+            raise
+        contenido = resp.content
+        reg = {"clave": clave, "dur": time.perf_counter() - t,
+               "status": resp.status_code, "reason": resp.reason,
+               "content_type": resp.headers.get("Content-Type", "")}
+        try:
+            reg["body"] = contenido.decode("utf-8")
+        except UnicodeDecodeError:
+            reg["body_b64"] = base64.b64encode(contenido).decode("ascii")
+        self.cassette.agregar(reg)
+        return resp
+
+    @staticmethod
+    def _respuesta(request, reg: dict) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = reg["status"]
+        resp.reason      = reg.get("reason", "")
+        resp.url         = request.url
+        resp.request     = request
+        resp.headers     = requests.structures.CaseInsensitiveDict({"Content-Type": reg.get("content_type", "")})
+        resp.encoding    = requests.utils.get_encoding_from_headers(resp.headers) or "utf-8"
+        resp._content    = (reg["body"].encode("utf-8") if "body" in reg
+                            else base64.b64decode(reg.get("body_b64", "")))
+        return resp
+
+
+class Cassette:
+    """
+    Graba (modo "grabar") o reproduce (modo "reproducir") las llamadas HTTP de
+    SESSION y los streams de Gemini. Uso:
+
+        with Cassette("scan.cassette.gz", "grabar"):
+            ciclo_scan_y_posiciones()
+        with Cassette("scan.cassette.gz", "reproducir", velocidad=0):
+            ciclo_scan_y_posiciones()
+    """
+
+    def __init__(self, path: str, modo: str, velocidad: float = 1.0):
+        if modo not in ("grabar", "reproducir"):
+            raise ValueError(f"Modo de cassette desconocido: {modo}")
+        self.path      = path
+        self.modo      = modo
+        self.velocidad = velocidad
+        self.registros: list[dict] = []
+        self.faltantes = 0
+        self._pendientes: dict[str, list[dict]] = {}
+        self._lock     = threading.Lock()
+        self._montados: dict = {}
+
+    # ── Registro ──────────────────────────────────────────────────────────────
+
+    def agregar(self, reg: dict):
+        with self._lock:
+            self.registros.append(reg)
+
+    def tomar(self, clave: str) -> dict | None:
+        """Siguiente interacción grabada con exactamente esta clave; None (faltante) si no hay."""
+        with self._lock:
+            cola = self._pendientes.get(clave)
+            if cola:
+                return cola.pop(0)
+            self.faltantes += 1
+            return None
+
+    def esperar(self, segundos: float):
+        if self.velocidad > 0 and segundos > 0:
+            time.sleep(segundos / self.velocidad)
+
+    # ── Gemini ────────────────────────────────────────────────────────────────
+
+    def stream_gemini(self, modelo: str, prompt: str, esquema, stream_vivo, llamada=None):
+        """Itera los textos del stream: grabando los de `stream_vivo()` o desde archivo."""
+        clave = _clave_gemini(modelo, prompt, esquema)
+        if self.modo == "reproducir":
+            reg = self.tomar(clave)
+            if reg is None:
+                raise RuntimeError(f"Cassette sin grabación de Gemini ({modelo})")
+            if llamada is not None:
+                for campo, valor in reg.get("uso", {}).items():
+                    setattr(llamada, campo, valor)
+            for dt, texto in reg["chunks"]:
+                self.esperar(dt)
+                yield texto
+            if "error" in reg:
+                raise RuntimeError(reg["error"])
+            return
+
+        reg = {"clave": clave, "chunks": []}
+        t = time.perf_counter()
+        try:
+            for texto in stream_vivo():
+                ahora = time.perf_counter()
+                reg["chunks"].append([ahora - t, texto])
+                t = ahora
+                yield texto
+        except Exception as e:
+            reg["error"] = str(e)
+            raise
+        finally:
+            if llamada is not None:
+                reg["uso"] = llamada.uso()
+            self.agregar(reg)
+
+    # ── Activación ────────────────────────────────────────────────────────────
+
+    def __enter__(self) -> "Cassette":
+        if _cassette["activa"] is not None:
+            raise RuntimeError("Ya hay una cassette activa")
+        if self.modo == "reproducir":
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                self.registros = [json.loads(linea) for linea in f if linea.strip()]
+            for reg in self.registros:
+                self._pendientes.setdefault(reg["clave"], []).append(reg)
+        adaptador = _AdaptadorCassette(self)
+        for prefijo in ("https://", "http://"):
+            self._montados[prefijo] = SESSION.adapters[prefijo]
+            SESSION.mount(prefijo, adaptador)
+        _cassette["activa"] = self
+        return self
+
+    def __exit__(self, *exc):
+        _cassette["activa"] = None
+        for prefijo, adaptador in self._montados.items():
+            SESSION.mount(prefijo, adaptador)
+        if self.modo == "grabar":
+            with gzip.open(self.path, "wt", encoding="utf-8") as f:
+                for reg in self.registros:
+                    f.write(json.dumps(reg, ensure_ascii=False, separators=(",", ":")) + "\n")
+            log.info(f"📼 Cassette grabada: {len(self.registros)} interacción(es) → {self.path}")
+        else:
+            sin_usar = sum(len(cola) for cola in self._pendientes.values())
+            log.info(f"📼 Cassette reproducida: {len(self.registros) - sin_usar} usada(s), "
+                     f"{sin_usar} sin usar, {self.faltantes} request(s) sin grabación")
+        return False
+
+
+_cassette = {"activa": None}
+
+
+def reproduciendo() -> bool:
+    c = _cassette["activa"]
+    return c is not None and c.modo == "reproducir"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# API para el dashboard
+# ══════════════════════════════════════════════════════════════════════════════
+
+def trigger_manual_scan():
+    """Llama desde el dashboard para forzar un scan."""
+    state = load_state()
+    state["manual_triggered"] = True
+    save_state(state)
+    log.info("🖐 Scan manual marcado en estado")
+
+
+def get_dashboard_data() -> dict:
+    abiertas  = load_positions()
+    ultimo    = ultimo_scan()
+    state     = load_state()
+
+    last_scan_ops = []
+    if ultimo:
+        last_scan_ops = [op.to_dict() for op in ultimo.resultados]
+
+    return {
+        "ts":               datetime.now(ET).isoformat(),
+        "last_scan":        state.get("last_scan"),
+        "last_rescore":     state.get("last_rescore"),
+        "positions_open":   [p.to_dict() for p in abiertas],
+        "positions_closed": ESTADISTICAS.recientes(),
+        "stats":            ESTADISTICAS.snapshot(total_open=len(abiertas)),
+        "stats_por_equipo": ESTADISTICAS.por_equipo(),
+        "estrategias":      [c.resumen() for c in CARTERAS],
         "last_scan_ops": last_scan_ops,
+        "ligas":         ultimo.por_liga if ultimo else {},
+        "llm":           {**CONTABILIDAD_LLM.resumen(dias=7), "ultimo_scan": ultimo.llm if ultimo else {},
+                          "router": ROUTER_ANALISIS.resumen()},
         "config": {
             "nea_umbral":          NEA_UMBRAL,
+            "ligas_activas":       LIGAS_ACTIVAS,
             "valor_real_minimo":   VALOR_REAL_MINIMO,
             "take_profit_precio":  TAKE_PROFIT_PRECIO,
             "monitor_interval":    MONITOR_INTERVAL,
+            "rescore_interval":    RESCORE_INTERVAL,
             "capital_total":       CAPITAL_TOTAL,
             "riesgo_por_trade":    RIESGO_POR_TRADE,
             "monto_por_trade_usd": round(CAPITAL_TOTAL * RIESGO_POR_TRADE, 2),
+            "sizing_modo":         SIZING_MODO,
+            "exposicion_max": {
+                "partido": EXPOSICION_MAX_PARTIDO, "equipo": EXPOSICION_MAX_EQUIPO,
+                "dia":     EXPOSICION_MAX_DIA,     "total":  EXPOSICION_MAX_TOTAL,
+            },
         },
     }
 
 
+def indice_scans() -> IndiceRegistros:
+    if _indice_scans["indice"] is None:
+        with _indice_scans_lock:
+            if _indice_scans["indice"] is None:
+                _indice_scans["indice"] = nuevo_indice_scans(iter_scans())
+    return _indice_scans["indice"]
+
+
+def consultar_scans(filtros: dict) -> dict:
+    return consultar_indice_scans(indice_scans(), filtros)
+
+
+def consultar_posiciones(filtros: dict) -> dict:
+    """Consulta sobre la cartera `cartera` de los filtros (principal por defecto)."""
+    nombre = filtros.get("cartera") or "principal"
+    cartera = next((c for c in CARTERAS if c.config.nombre == nombre), None)
+    if cartera is None:
+        raise ValueError(f"cartera desconocida: {nombre}")
+    return cartera.consultar(filtros)
+
+
+# ── Snapshot versionado del dashboard ─────────────────────────────────────────
+# La versión es la firma (mtime + tamaño) de los archivos que alimentan
+# get_dashboard_data, más la fecha ET (pnl_hoy). Mientras no cambie, el
+# payload se reutiliza entre requests sin volver a leer disco.
+
+_snapshot_dashboard = {"version": None, "data": None}
+_snapshot_lock = threading.Lock()
+
+
+def version_dashboard() -> str:
+    dias = _dias_indice_scans()
+    archivos = [_indice_scans_dia(dias[-1]) if dias else SCANS_INDEX_FILE, STATE_FILE, LLM_USAGE_FILE]
+    for c in CARTERAS:
+        archivos += [c.positions_file, c.stats.path]
+    firma = [datetime.now(ET).date().isoformat()]
+    for path in archivos:
+        try:
+            st = os.stat(path)
+            firma.append(f"{st.st_mtime_ns}:{st.st_size}")
+        except FileNotFoundError:
+            firma.append("-")
+    return hashlib.sha1("|".join(firma).encode()).hexdigest()[:16]
+
+
+def dashboard_snapshot() -> tuple[str, dict]:
+    """(versión, payload de get_dashboard_data) cacheado hasta que cambie el estado."""
+    version = version_dashboard()
+    with _snapshot_lock:
+        if _snapshot_dashboard["version"] != version:
+            _snapshot_dashboard["data"]    = {**get_dashboard_data(), "version": version}
+            _snapshot_dashboard["version"] = version
+        return version, _snapshot_dashboard["data"]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CLI
+# ══════════════════════════════════════════════════════════════════════════════
+# Corre sin Flask ni hilos del dashboard: cada comando hace su trabajo y sale.
+# Los comandos que no son export imprimen un resumen (o JSON con --json) con
+# la duración total; --grabar/--reproducir envuelven el comando en una cassette.
+
+def _neas_scan(scan: ScanEntry) -> list[float]:
+    """NEA de cada outcome evaluado en el scan, recalculado desde su slate."""
+    neas = []
+    for juego in scan.slate:
+        if juego.get("analisis") is None:
+            continue
+        neas += [op.nea for op in valorar_partido(juego, juego.get("precios", {}), liga_de(juego["liga"]), 0.0)]
+    return neas
+
+
+def backtest_umbrales(umbrales: list[float], desde: str | None = None,
+                      hasta: str | None = None, cartera=None) -> dict:
+    """
+    Barrido de umbral NEA sobre el historial: para cada umbral, las posiciones
+    cerradas que se hubieran abierto (nea_entrada <= −umbral) con su PnL, y las
+    señales COMPRAR que habría emitido cada scan guardado.
+
+    Las señales salen del slate persistido de cada scan (análisis + precios de
+    todos los partidos), así valen para cualquier umbral. Los scans sin slate
+    solo guardan lo que cruzó el umbral de emisión, y las posiciones solo
+    existen por encima del umbral de la cartera: por debajo de esos pisos
+    (umbral_minimo) la fila queda en None en lugar de repetir la del piso.
+    """
+    cartera = cartera or PRINCIPAL
+    cerradas = [p for p in _iter_posiciones_cartera(cartera, desde, hasta) if p.status != "OPEN"]
+    neas, sin_slate = [], 0
+    for scan in iter_scans(desde, hasta):
+        if scan.slate:
+            neas += _neas_scan(scan)
+        else:
+            sin_slate += 1
+            neas += [op.nea for op in scan.resultados]
+    piso_senales = max(umbral_emision(l) for l in LIGAS.values()) if sin_slate else 0.0
+    piso_trades = max(cartera.config.umbral(l) for l in LIGAS.values())
+
+    filas = []
+    for umbral in sorted(umbrales):
+        fila = {"umbral": umbral, "senales": None, "trades": None, "ganadas": None,
+                "win_rate": None, "pnl_usd": None, "pnl_medio": None}
+        if umbral >= piso_senales:
+            fila["senales"] = sum(1 for nea in neas if nea <= -umbral)
+        if umbral >= piso_trades:
+            trades = [p for p in cerradas if p.nea_entrada <= -umbral]
+            pnl = sum(p.pnl_usd for p in trades)
+            ganadas = sum(1 for p in trades if p.pnl_usd > 0)
+            fila.update({
+                "trades":    len(trades),
+                "ganadas":   ganadas,
+                "win_rate":  round(ganadas / len(trades) * 100, 1) if trades else None,
+                "pnl_usd":   round(pnl, 4),
+                "pnl_medio": round(pnl / len(trades), 4) if trades else None,
+            })
+        filas.append(fila)
+    return {"umbral_minimo": {"senales": piso_senales, "trades": piso_trades},
+            "scans_sin_slate": sin_slate, "umbrales": filas}
+
+
+def _resumen_oportunidades(oportunidades: list[Opportunity], top: int = 10) -> dict:
+    visibles = [op for op in oportunidades if op.accion != "SOMBRA"]
+    return {
+        "oportunidades": len(visibles),
+        "comprar":       sum(1 for op in visibles if op.accion == "COMPRAR"),
+        "top":           [{"partido": op.partido, "equipo": op.equipo, "mercado": op.mercado,
+                           "nea": op.nea, "accion": op.accion} for op in visibles[:top]],
+    }
+
+
+def _cmd_scan(args) -> dict:
+    ligas = [LIGAS[c] for c in args.liga] if args.liga else None
+    if args.dry_run:
+        return {"dry_run": True, **_resumen_oportunidades(ejecutar_scan(ligas, registrar=False))}
+    return ciclo_scan_y_posiciones(ligas)
+
+
+def _cmd_monitor(args) -> dict:
+    antes = {c.config.nombre: len(c.indice.tokens) for c in CARTERAS}
+    ciclo_monitoreo()
+    return {c.config.nombre: {"abiertas_antes": antes[c.config.nombre],
+                              "abiertas": len(c.indice.tokens)} for c in CARTERAS}
+
+
+def _cmd_daemon(args) -> dict:
+    threading.Thread(target=calentar, daemon=True).start()
+    if RESCORE_INTERVAL > 0:
+        threading.Thread(target=_thread_rescoring, daemon=True).start()
+    log.info(f"🚀 Daemon sin dashboard | Monitoreo: cada {MONITOR_INTERVAL}s")
+    try:
+        _thread_scheduler()
+    except KeyboardInterrupt:
+        log.info("Daemon detenido")
+    return {"arranque": estado_arranque()}
+
+
+def _cmd_migrate(args) -> dict:
+    fases = {}
+    for nombre, fn in (("compactar", compactar_posiciones), ("scans", migrar_scan_log)):
+        t = time.perf_counter()
+        fn()
+        fases[nombre] = round(time.perf_counter() - t, 3)
+    return {"fases": fases, "scans_indexados": sum(len(v) for v in load_indice_scans().values())}
+
+
+def _cmd_backtest(args) -> dict:
+    cartera = next((c for c in CARTERAS if c.config.nombre == args.cartera), None)
+    if cartera is None:
+        raise ValueError(f"cartera desconocida: {args.cartera}")
+    return {"cartera": cartera.config.nombre, "desde": args.desde, "hasta": args.hasta,
+            **backtest_umbrales(args.umbrales, args.desde, args.hasta, cartera)}
+
+
+def _imprimir(resultado: dict, segundos: float, como_json: bool):
+    if como_json:
+        print(json.dumps({**resultado, "segundos": round(segundos, 3)}, ensure_ascii=False, indent=2, default=str))
+        return
+    for clave, valor in resultado.items():
+        print(f"{clave}: {json.dumps(valor, ensure_ascii=False, default=str) if isinstance(valor, (dict, list)) else valor}")
+    print(f"⏱ {segundos:.2f}s")
+
+
+def _cmd_export(args, parser):
+    import sys
+
+    try:
+        datos = exportar(args.tipo, args.formato, args.desde, args.hasta, args.gzip, args.cartera)
+    except ValueError as e:
+        parser.error(str(e))
+    destino = sys.stdout.buffer if args.salida == "-" else open(args.salida, "wb")
+    try:
+        for chunk in datos:
+            destino.write(chunk)
+    finally:
+        if destino is not sys.stdout.buffer:
+            destino.close()
+
+
+def cli(argv: list[str] | None = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="main.py", description="NBA Edge Alpha Bot")
+    parser.add_argument("--json", action="store_true", help="Resultado como JSON")
+    parser.add_argument("--grabar", metavar="CASSETTE", help="Graba las llamadas externas del comando")
+    parser.add_argument("--reproducir", metavar="CASSETTE", help="Reproduce el comando desde una cassette")
+    parser.add_argument("--velocidad", type=float, default=1.0,
+                        help="Factor de tiempo del replay (1 = original, 0 = sin esperas)")
+    sub = parser.add_subparsers(dest="comando")
+
+    p = sub.add_parser("scan", help="Scan de todas las ligas activas (y apertura de posiciones)")
+    p.add_argument("--dry-run", action="store_true", help="No abre posiciones ni guarda el scan")
+    p.add_argument("--liga", action="append", choices=list(LIGAS), help="Limita el scan a esta liga (repetible)")
+
+    sub.add_parser("monitor", help="Un ciclo de monitoreo de posiciones abiertas")
+    sub.add_parser("daemon", help="Scheduler (scan, monitoreo, re-scoring) sin el dashboard")
+    sub.add_parser("migrate", help="Compacta positions.json y migra scan_log.json a segmentos")
+
+    p = sub.add_parser("backtest", help="Barrido de umbral NEA sobre posiciones cerradas y scans")
+    p.add_argument("--umbrales", type=float, nargs="+", default=[5.0, 7.5, 10.0, 12.5, 15.0, 20.0])
+    p.add_argument("--desde", help="YYYY-MM-DD (inclusive)")
+    p.add_argument("--hasta", help="YYYY-MM-DD (inclusive)")
+    p.add_argument("--cartera", default="principal")
+
+    p = sub.add_parser("export", help="Exporta posiciones, scans o ticks como NDJSON/CSV")
+    p.add_argument("tipo", choices=list(EXPORT_TIPOS))
+    p.add_argument("--formato", choices=("ndjson", "csv"), default="ndjson")
+    p.add_argument("--desde", help="YYYY-MM-DD (inclusive)")
+    p.add_argument("--hasta", help="YYYY-MM-DD (inclusive)")
+    p.add_argument("--gzip", action="store_true", help="Comprime la salida")
+    p.add_argument("--cartera", default="principal")
+    p.add_argument("-o", "--salida", default="-", help="Archivo de salida (- = stdout)")
+
+    args = parser.parse_args(argv)
+
+    if args.grabar and args.reproducir:
+        parser.error("--grabar y --reproducir son excluyentes")
+    if args.comando == "export":
+        return _cmd_export(args, parser)
+
+    comandos = {
+        None:       _cmd_scan,          # modo standalone de siempre: scan + posiciones
+        "scan":     _cmd_scan,
+        "monitor":  _cmd_monitor,
+        "daemon":   _cmd_daemon,
+        "migrate":  _cmd_migrate,
+        "backtest": _cmd_backtest,
+    }
+    if args.comando is None:
+        args.dry_run, args.liga = False, None
+
+    cassette = None
+    if args.grabar:
+        cassette = Cassette(args.grabar, "grabar")
+    elif args.reproducir:
+        cassette = Cassette(args.reproducir, "reproducir", args.velocidad)
+
+    t0 = time.perf_counter()
+    try:
+        if cassette is not None:
+            with cassette:
+                resultado = comandos[args.comando](args)
+        else:
+            resultado = comandos[args.comando](args)
+    except ValueError as e:
+        parser.error(str(e))
+    _imprimir(resultado or {}, time.perf_counter() - t0, args.json)
+
+
 if __name__ == "__main__":
-    # Modo standalone (sin dashboard)
-    ciclo_scan_y_posiciones()
+    cli()
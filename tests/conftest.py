@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+
+# main.py crea sus directorios y carga estado al importarse: apuntar DATA_DIR
+# a un directorio temporal antes del primer import.
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="edge-alpha-tests-")
+os.environ.pop("GEMINI_API_KEY", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime
+
+import pytest
+
+import main as bot
+
+
+def nueva_posicion(i, status="OPEN", token=None, **kwargs) -> bot.Position:
+    ahora = datetime.now(bot.ET).isoformat()
+    datos = dict(
+        id=f"p{i}", partido="Visitante vs Local", equipo="Local", token_id=token or f"tok-{i}",
+        precio_entrada=0.3, precio_actual=0.3, valor_real=0.45, nea_entrada=-12.0,
+        take_profit=0.42, stop_loss=0.15, monto_usd=1.0, hora_partido="7:00 PM ET",
+        status=status, opened_at=ahora, shares=1 / 0.3,
+    )
+    if status != "OPEN":
+        datos.update(closed_at=ahora, close_reason="TAKE_PROFIT", precio_salida=0.42,
+                     pnl_usd=0.4, pnl_pct=40.0)
+    datos.update(kwargs)
+    return bot.Position(**datos)
+
+
+@pytest.fixture
+def cartera(tmp_path):
+    return bot.Cartera.en_directorio(bot.ConfigEstrategia("test"), str(tmp_path))
@@ -0,0 +1,56 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+import main as bot
+
+
+@pytest.fixture
+def servidor_midpoint():
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            token = parse_qs(urlparse(self.path).query).get("token_id", [""])[0]
+            cuerpo = json.dumps({"mid": str(len(token) / 10)}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/midpoint"
+    server.shutdown()
+
+
+def test_replay_solo_sirve_la_clave_exacta(tmp_path, servidor_midpoint):
+    path = str(tmp_path / "c.cassette.gz")
+    with bot.Cassette(path, "grabar"):
+        grabado = bot.SESSION.get(servidor_midpoint, params={"token_id": "a"}).json()
+
+    with bot.Cassette(path, "reproducir", velocidad=0) as cassette:
+        assert bot.SESSION.get(servidor_midpoint, params={"token_id": "a"}).json() == grabado
+        with pytest.raises(requests.ConnectionError):
+            # mismo endpoint, otro token: no se sustituye por la respuesta de "a"
+            bot.SESSION.get(servidor_midpoint, params={"token_id": "bb"})
+        with pytest.raises(requests.ConnectionError):
+            bot.SESSION.get(servidor_midpoint, params={"token_id": "a"})     # ya consumida
+    assert cassette.faltantes == 2
+
+
+def test_replay_gemini_sin_grabacion_falla(tmp_path):
+    path = str(tmp_path / "g.cassette.gz")
+    with bot.Cassette(path, "grabar") as cassette:
+        assert list(cassette.stream_gemini("m", "partido A", None, lambda: iter(["{", "}"]))) == ["{", "}"]
+
+    with bot.Cassette(path, "reproducir", velocidad=0) as cassette:
+        with pytest.raises(RuntimeError):
+            list(cassette.stream_gemini("m", "partido B", None, None))
+        assert list(cassette.stream_gemini("m", "partido A", None, None)) == ["{", "}"]
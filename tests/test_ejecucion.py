@@ -0,0 +1,111 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+import main as bot
+
+LIBRO = {
+    "bids": [{"price": "0.48", "size": "100"}, {"price": "0.47", "size": "200"}, {"price": "0.40", "size": "50"}],
+    "asks": [{"price": "0.52", "size": "100"}, {"price": "0.53", "size": "200"}],
+}
+
+
+@pytest.fixture
+def servidor_books():
+    """Servidor local que responde /book y POST /books con LIBRO para cualquier token."""
+    pedidos = []
+
+    class _Handler(BaseHTTPRequestHandler):
+        def _responder(self, data):
+            cuerpo = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def do_GET(self):
+            token = parse_qs(urlparse(self.path).query).get("token_id", [""])[0]
+            pedidos.append(token)
+            self._responder({"asset_id": token, **LIBRO})
+
+        def do_POST(self):
+            tokens = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            pedidos.extend(t["token_id"] for t in tokens)
+            self._responder([{"asset_id": t["token_id"], **LIBRO} for t in tokens])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", pedidos
+    server.shutdown()
+
+
+def _simulador(base_url="http://127.0.0.1:9", ttl=60.0):
+    return bot.SimuladorEjecucion(base_url=base_url, ttl=ttl, modo="book", session=requests.Session())
+
+
+def test_compra_vwap_recorre_asks():
+    sim = _simulador()
+    sim.cachear("t", bot.Book.from_clob(LIBRO))
+    fill = sim.comprar("t", 100.0, 0.50)
+    # 52 USD en el primer nivel (100 shares) y 48 USD en el segundo
+    shares = 100 + 48 / 0.53
+    assert fill.completo and fill.niveles == 2 and fill.fuente == "book"
+    assert fill.shares == pytest.approx(shares)
+    assert fill.precio == pytest.approx(100 / shares)
+    assert fill.slippage == pytest.approx((100 / shares - 0.50) / 0.50 * 100, abs=1e-4)
+
+
+def test_compra_sin_libro_usa_el_mid():
+    sim = bot.SimuladorEjecucion(modo="mid")
+    fill = sim.comprar("t", 10.0, 0.25)
+    assert (fill.precio, fill.shares, fill.fuente, fill.slippage) == (0.25, 40.0, "mid", 0.0)
+
+
+def test_venta_vwap_recorre_bids():
+    sim = _simulador()
+    sim.cachear("t", bot.Book.from_clob(LIBRO))
+    fill = sim.vender("t", 150.0, 0.50)
+    assert fill.completo and fill.niveles == 2
+    assert fill.monto_usd == pytest.approx(100 * 0.48 + 50 * 0.47)
+    assert fill.precio == pytest.approx((100 * 0.48 + 50 * 0.47) / 150)
+
+
+def test_libros_por_http_y_snapshot(servidor_books):
+    base_url, pedidos = servidor_books
+    sim = _simulador(base_url)
+    assert set(sim.snapshot(["a", "b", "a"])) == {"a", "b"}
+    fill = sim.comprar("a", 52.0, 0.50)
+    assert fill.shares == pytest.approx(100) and fill.precio == pytest.approx(0.52)
+    assert sorted(pedidos) == ["a", "b"]     # el fill reutiliza el libro del snapshot
+    assert sim.book("c").best_bid == 0.48
+    assert pedidos[-1] == "c"
+
+
+def test_venta_sin_profundidad_valora_el_resto_al_mid():
+    sim = _simulador()
+    sim.cachear("t", bot.Book.from_clob(LIBRO))
+    fill = sim.vender("t", 400.0, 0.50)     # los bids suman 350 shares
+    cobrado = 100 * 0.48 + 200 * 0.47 + 50 * 0.40
+    assert not fill.completo and fill.sin_llenar == pytest.approx(50)
+    assert fill.monto_usd == pytest.approx(cobrado + 50 * 0.50)
+
+
+def test_cierre_en_libro_fino_no_registra_perdida_ficticia(monkeypatch):
+    sim = _simulador()
+    sim.cachear("t", bot.Book(bids=[(0.41, 1.0)], asks=[]))
+    monkeypatch.setattr(bot, "EJECUCION", sim)
+    pos = bot.Position(id="p", partido="", equipo="E", token_id="t", precio_entrada=0.3,
+                       precio_actual=0.42, valor_real=0.45, nea_entrada=-12.0, take_profit=0.42,
+                       stop_loss=0.15, monto_usd=3.0, hora_partido="", status="OPEN",
+                       opened_at="2026-05-01T12:00:00-04:00", shares=10.0)
+    bot._cerrar_posicion(pos, "TAKE_PROFIT", 0.42)
+    assert pos.pnl_usd == pytest.approx(0.41 + 9 * 0.42 - 3.0, abs=1e-4)
+    assert pos.extra["shares_sin_liquidez"] == pytest.approx(9.0)
@@ -0,0 +1,63 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+import main as bot
+from conftest import nueva_posicion
+
+
+@pytest.fixture
+def cartera_con_historial(cartera):
+    ahora = datetime.now(bot.ET).isoformat()
+    abierta, cerrada = nueva_posicion(0), nueva_posicion(1, status="CLOSED")
+    for pos in (abierta, cerrada):
+        pos.price_history.append(ahora, 0.3)
+        pos.price_history.append(ahora, 0.35)
+    cartera.save_positions([abierta])
+    bot.archivar_posiciones([cerrada], cartera.archive_dir)
+    return cartera
+
+
+def _scan():
+    ahora = datetime.now(bot.ET).isoformat()
+    op = bot.Opportunity(partido="Visitante vs Local", equipo="Local", es_local=True, p_poly=30.0,
+                         valor_real=45.0, nea=-12.0, accion="COMPRAR", hora="7:00 PM ET",
+                         token_id="tok-0", resumen="", scanned_at=ahora)
+    return bot.ScanEntry(ts=ahora, partidos=1, oportunidades=1, resultados=[op])
+
+
+@pytest.mark.parametrize("tipo, esperadas", [("positions", 2), ("ticks", 4), ("scans", 1)])
+def test_export_ida_y_vuelta(cartera_con_historial, tipo, esperadas):
+    scan = _scan()
+    filas, campos = {
+        "positions": (lambda: bot.export_posiciones(cartera=cartera_con_historial), bot._CAMPOS_POSICION),
+        "ticks":     (lambda: bot.export_ticks(cartera=cartera_con_historial), bot._CAMPOS_TICK),
+        "scans":     (lambda: bot._filas_scan(scan), bot._CAMPOS_SCAN),
+    }[tipo]
+
+    ndjson = "".join(bot.serializar_export(filas(), "ndjson", campos))
+    registros = [json.loads(line) for line in ndjson.splitlines()]
+    assert len(registros) == esperadas
+
+    lector = csv.DictReader(io.StringIO("".join(bot.serializar_export(filas(), "csv", campos))))
+    assert lector.fieldnames == list(campos)
+    assert len(list(lector)) == esperadas
+
+    comprimido = b"".join(bot.comprimir_gzip(bot.serializar_export(filas(), "ndjson", campos)))
+    assert gzip.decompress(comprimido).decode("utf-8") == ndjson
+
+
+def test_ticks_usan_el_precio_de_cada_punto(cartera_con_historial):
+    precios = sorted(fila["precio"] for fila in bot.export_ticks(cartera=cartera_con_historial))
+    assert precios == [0.3, 0.3, 0.35, 0.35]
+
+
+def test_exportar_valida_parametros():
+    with pytest.raises(ValueError):
+        list(bot.exportar("otro"))
+    with pytest.raises(ValueError):
+        list(bot.exportar("positions", desde="ayer"))
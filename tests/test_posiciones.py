@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+
+import pytest
+
+import main as bot
+from conftest import nueva_posicion
+
+
+def test_transacciones_concurrentes_no_pierden_escrituras(tmp_path):
+    """Hilos "scan" abren y hilos "monitor" cierran en paralelo sobre el mismo archivo."""
+    path = str(tmp_path / "positions.json")
+    hilos, por_hilo = 4, 50
+    abiertas, cerradas = [], []
+    listo = threading.Event()
+
+    def _scan(h):
+        for k in range(por_hilo):
+            pos = nueva_posicion(f"{h}-{k}", token=f"s{h}-{k}")
+            bot.transaccion_posiciones(lambda ps: (ps + [pos], None), path, intentos=1000)
+            abiertas.append(pos.id)
+
+    def _cierra(pos):
+        return int(pos.id.split("-")[1]) % 2 == 0
+
+    def _monitor():
+        while True:
+            fin = listo.is_set()
+
+            def _tx(ps):
+                cerrar = [p for p in ps if _cierra(p)]
+                return ([p for p in ps if p not in cerrar] if cerrar else None), [p.id for p in cerrar]
+
+            cerradas.extend(bot.transaccion_posiciones(_tx, path, intentos=1000))
+            if fin:
+                return
+            time.sleep(0.001)
+
+    monitores = [threading.Thread(target=_monitor) for _ in range(hilos)]
+    scans = [threading.Thread(target=_scan, args=(h,)) for h in range(hilos)]
+    for t in monitores + scans:
+        t.start()
+    for t in scans:
+        t.join()
+    listo.set()
+    for t in monitores:
+        t.join()
+
+    esperadas = {i for i in abiertas if int(i.split("-")[1]) % 2 == 0}
+    assert len(abiertas) == hilos * por_hilo
+    assert len(cerradas) == len(set(cerradas))
+    assert set(cerradas) == esperadas
+    assert {p.id for p in bot.load_positions(path)} == set(abiertas) - esperadas
+
+
+def test_transaccion_sin_cambios_no_escribe(tmp_path):
+    path = str(tmp_path / "positions.json")
+    bot.save_positions([nueva_posicion(1)], path)
+    _, version = bot.load_positions_versionado(path)
+    assert bot.transaccion_posiciones(lambda ps: (None, len(ps)), path) == 1
+    assert bot.load_positions_versionado(path)[1] == version
+
+
+def test_compactar_positions_legado_reconstruye_stats(cartera):
+    """positions.json previo (lista, con cerradas) sin aggregates.json."""
+    legado = [nueva_posicion(1, status="CLOSED"), nueva_posicion(2, status="CLOSED"), nueva_posicion(3)]
+    with open(cartera.positions_file, "w") as f:
+        json.dump([p.to_dict() for p in legado], f)
+
+    cartera.compactar()
+
+    assert [p.id for p in cartera.load_positions()] == ["p3"]
+    assert sorted(p.id for p in bot.iter_archivo_posiciones(archive_dir=cartera.archive_dir)) == ["p1", "p2"]
+    snap = cartera.stats.snapshot()
+    assert (snap["total_opened"], snap["total_closed"], snap["take_profits"]) == (3, 2, 2)
+    assert snap["pnl_total_usd"] == pytest.approx(0.8)
+
+    cartera.compactar()     # idempotente
+    assert cartera.stats.snapshot()["total_opened"] == 3
+
+
+def test_otro_proceso_refresca_indice_y_stats(tmp_path):
+    """Dos Cartera sobre el mismo directorio se comportan como web + CLI."""
+    web = bot.Cartera.en_directorio(bot.ConfigEstrategia("test"), str(tmp_path))
+    cli = bot.Cartera.en_directorio(bot.ConfigEstrategia("test"), str(tmp_path))
+    assert web.indice.total == 0 and web.stats.snapshot()["total_opened"] == 0
+
+    pos = nueva_posicion(1, monto_usd=2.5)
+    cli.transaccion(lambda ps: (ps + [pos], pos))
+    cli.indice.agregar(pos)
+    cli.stats.registrar_apertura(pos)
+
+    assert pos.token_id in web.indice.tokens and web.indice.total == 2.5
+    assert web.consultar({})["total"] == 1
+    web.stats.registrar_apertura(nueva_posicion(2))     # no pisa la apertura de la CLI
+    assert cli.stats.snapshot()["total_opened"] == 2
+
+
+def test_aperturas_simultaneas_respetan_limite_por_partido(tmp_path, monkeypatch):
+    cartera = bot.Cartera.en_directorio(bot.ConfigEstrategia("test", riesgo_por_trade=0.02), str(tmp_path))
+    monkeypatch.setattr(bot, "LIQ_FILTRO", False)
+    monkeypatch.setattr(bot, "EXPOSICION_MAX_PARTIDO", 0.03)     # $3 por partido: entra una de $2
+    ambos_dimensionaron = threading.Barrier(2)
+    sim = bot.SimuladorEjecucion(modo="mid")
+
+    def _comprar(token_id, monto_usd, precio_ref):
+        ambos_dimensionaron.wait(timeout=5)
+        return sim.comprar(token_id, monto_usd, precio_ref)
+
+    monkeypatch.setattr(bot.EJECUCION, "comprar", _comprar)
+    ops = [bot.Opportunity(partido="Visitante vs Local", equipo=equipo, es_local=equipo == "Local",
+                           p_poly=30.0, valor_real=45.0, nea=-12.0, accion="COMPRAR", hora="",
+                           token_id=f"tok-{equipo}", resumen="", scanned_at="")
+           for equipo in ("Local", "Visitante")]
+    abiertas = []
+    hilos = [threading.Thread(target=lambda op=op: abiertas.append(cartera.abrir(op))) for op in ops]
+    for t in hilos:
+        t.start()
+    for t in hilos:
+        t.join()
+
+    assert sum(p is not None for p in abiertas) == 1
+    assert len(cartera.load_positions()) == 1
+    assert cartera.indice.total == 2.0
@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import main as bot
+
+ANALISIS = {"p_vegas": 60.0, "n_local": 10.0, "n_visitante": -10.0, "r_local": 50.0,
+            "r_visitante": 50.0, "total_proyectado": None, "resumen": "", "fuente": "gemini"}
+
+
+@pytest.fixture
+def slate(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "SLATE_FILE", str(tmp_path / "slate.json"))
+
+    def _guardar(inicio: str, horas: float):
+        analizado = (datetime.now(bot.ET) - timedelta(hours=horas)).isoformat()
+        bot.save_slate([{"liga": "nba", "partido": "A vs. B", "visitante": "A", "local": "B",
+                         "inicio": inicio, "mercados": {}, "analisis": ANALISIS, "analizado_en": analizado}])
+    return _guardar
+
+
+def test_previo_solo_para_la_misma_fecha(slate):
+    slate("2026-05-01T19:00:00-04:00", horas=1)
+    nba = bot.LIGAS["nba"]
+    assert bot.analisis_slate_previo(nba, "A", "B", "2026-05-01") == ANALISIS
+    assert bot.analisis_slate_previo(nba, "A", "B", "2026-05-03") is None   # otro partido de la serie
+
+
+def test_previo_vencido_no_se_usa(slate):
+    slate("2026-05-01T19:00:00-04:00", horas=bot.PREFILTRO_PREVIO_MAX_HORAS + 1)
+    assert bot.analisis_slate_previo(bot.LIGAS["nba"], "A", "B", "2026-05-01") is None
@@ -0,0 +1,40 @@
+import time
+
+import main as bot
+
+
+def _falso_gemini(demoras: dict):
+    def _generar(prompt, esquema, tipo, modelo, cancelar):
+        # respuesta "lenta" del modelo: espera la cancelación o su demora
+        cancelar.wait(demoras[(modelo, tipo)])
+        return '{"ok": 1}'
+    return _generar
+
+
+def _validar(texto):
+    return texto if "ok" in texto else None
+
+
+def test_latencias_separadas_por_tipo(monkeypatch):
+    monkeypatch.setattr(bot, "_gemini_generar", _falso_gemini({("p", "slate"): 0.05, ("p", "partido"): 0.0}))
+    router = bot.RouterAnalisis("p", espera_inicial=1.0)
+    for _ in range(bot._MIN_MUESTRAS_HEDGE):
+        router.generar("x", _validar, tipo="slate")
+        router.generar("x", _validar, tipo="partido")
+
+    assert router.umbral_hedge("slate") >= 0.05
+    assert router.umbral_hedge("partido") < 0.05
+    assert set(router.resumen()["modelos"]["p"]) == {"slate", "partido"}
+
+
+def test_primaria_cancelada_registra_su_latencia(monkeypatch):
+    monkeypatch.setattr(bot, "_gemini_generar", _falso_gemini({("lento", "partido"): 5, ("rapido", "partido"): 0.0}))
+    router = bot.RouterAnalisis("lento", "rapido", espera_inicial=0.05)
+    assert router.generar("x", _validar) == ('{"ok": 1}', None)
+
+    fin = time.monotonic() + 2
+    while time.monotonic() < fin and not router.resumen()["modelos"]["lento"]["partido"]["canceladas"]:
+        time.sleep(0.01)
+    lento = router.resumen()["modelos"]["lento"]["partido"]
+    assert lento["canceladas"] == 1
+    assert lento["p50_seg"] >= 0.05        # cota inferior: lo que tardó hasta cancelarse
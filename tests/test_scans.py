@@ -0,0 +1,24 @@
+import threading
+import time
+
+import main as bot
+
+
+def test_indice_scans_se_construye_una_vez(monkeypatch):
+    monkeypatch.setitem(bot._indice_scans, "indice", None)
+    construidos = []
+
+    def _lento(scans):
+        time.sleep(0.05)
+        construidos.append(bot.IndiceRegistros(lambda r: {}))
+        return construidos[-1]
+
+    monkeypatch.setattr(bot, "nuevo_indice_scans", _lento)
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(bot.indice_scans())) for _ in range(8)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert len(construidos) == 1
+    assert all(r is construidos[0] for r in resultados)
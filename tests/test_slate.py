@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+import main as bot
+
+VALIDO = {"partido": "A @ B", "p_vegas": 60, "n_local": 10, "n_visitante": -5,
+          "r_local": 55, "r_visitante": 45, "total_proyectado": 221.5, "resumen": "B viene mejor [1]"}
+
+
+def test_slate_con_prosa_alrededor():
+    texto = f"Según las fuentes [1], este es el análisis:\n```json\n{json.dumps([VALIDO])}\n```\nVer [2]."
+    resultado = bot._parsear_slate(texto, ["A @ B"])
+    assert resultado["A @ B"]["p_vegas"] == 60.0
+
+
+@pytest.mark.parametrize("cambio", [
+    {"p_vegas": None},              # falta un requerido
+    {"n_local": "10"},              # tipo incorrecto
+    {"r_local": 180},               # fuera de rango
+    {"resumen": ""},
+])
+def test_elementos_fuera_del_esquema_se_descartan(cambio):
+    otro = {**VALIDO, "partido": "C @ D", **cambio}
+    resultado = bot._parsear_slate(json.dumps([VALIDO, otro]), ["A @ B", "C @ D"])
+    assert list(resultado) == ["A @ B"]
+
+
+def test_sin_array_de_objetos_falla():
+    with pytest.raises(ValueError):
+        bot._parsear_slate("No encontré datos [1] [2].", ["A @ B"])